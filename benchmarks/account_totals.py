@@ -0,0 +1,97 @@
+"""
+Benchmark of the ways to compute the total value of a portfolio of 10,000 positions:
+  - loop over the `Stock` objects (`Stock.get_stock_position_value()`)
+  - SQL aggregate (SUM of `position_value`)
+  - materialized account totals (`account_totals` table)
+
+Run from the top-level folder with:
+
+    python benchmarks/account_totals.py [--positions 10000] [--repeat 20]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from project import create_app, database  # noqa: E402
+from project.models import (Stock, User, get_account_total, get_portfolio_total,  # noqa: E402
+                            refresh_account_totals)
+
+
+def create_positions(user_id: int, number_of_positions: int):
+    symbols = [f'S{index:04d}' for index in range(500)]
+    database.session.execute(database.insert(Stock), [
+        {'stock_symbol': symbols[index % len(symbols)],
+         'number_of_shares': 10 + index % 90,
+         'purchase_price': 10000 + index,
+         'user_id': user_id,
+         'purchase_date': datetime(2020, 7, 1),
+         'current_price': 15000 + index,
+         'current_price_date': datetime.now(),
+         'position_value': (15000 + index) * (10 + index % 90)}
+        for index in range(number_of_positions)
+    ])
+    refresh_account_totals([user_id])
+    database.session.commit()
+
+
+def loop_total(user_id: int) -> float:
+    query = database.select(Stock).where(Stock.user_id == user_id)
+    total = 0.0
+    for stock in database.session.execute(query).scalars().all():
+        total += stock.get_stock_position_value()
+    database.session.expunge_all()
+    return round(total, 2)
+
+
+def aggregate_total(user_id: int) -> float:
+    _, total_value = get_portfolio_total(user_id)
+    return total_value / 100
+
+
+def materialized_total(user_id: int) -> float:
+    total = get_account_total(user_id).get_total_value()
+    database.session.expunge_all()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--positions', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    database_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    database_file.close()
+    os.environ['CONFIG_TYPE'] = 'config.TestingConfig'
+    os.environ['TEST_DATABASE_URI'] = f'sqlite:///{database_file.name}'
+
+    app = create_app()
+    try:
+        with app.app_context():
+            database.create_all()
+            user = User('benchmark@example.com', 'FlaskIsAwesome123')
+            database.session.add(user)
+            database.session.commit()
+            create_positions(user.id, args.positions)
+
+            print(f'Total value of {args.positions} positions (best of {args.repeat} runs):')
+            for name, function in [('ORM loop', loop_total),
+                                   ('SQL aggregate', aggregate_total),
+                                   ('Materialized', materialized_total)]:
+                total = function(user.id)
+                best = min(timeit.repeat(lambda: function(user.id), number=1, repeat=args.repeat))
+                print(f'  {name:<15} {best * 1000:9.3f} ms   (${total:,.2f})')
+
+            database.session.remove()
+            database.drop_all()
+    finally:
+        os.remove(database_file.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark of the daily portfolio snapshot job (`flask stocks snapshot`) for a
+large number of users.
+
+Run from the top-level folder with:
+
+    python benchmarks/portfolio_snapshots.py [--users 100000] [--positions 5] [--chunk-size 1000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from project import create_app, database  # noqa: E402
+from project.models import Stock, User  # noqa: E402
+from project.snapshots import take_portfolio_snapshots  # noqa: E402
+
+
+def create_users(number_of_users: int, positions_per_user: int):
+    symbols = [f'S{index:04d}' for index in range(500)]
+    for first_user_id in range(1, number_of_users + 1, 10000):
+        user_ids = range(first_user_id, min(first_user_id + 10000, number_of_users + 1))
+        database.session.execute(database.insert(User), [
+            {'id': user_id, 'email': f'user{user_id}@example.com', 'password_hashed': '-'} for user_id in user_ids
+        ])
+        database.session.execute(database.insert(Stock), [
+            {'stock_symbol': symbols[(user_id * 7 + index) % len(symbols)],
+             'number_of_shares': 10 + index,
+             'purchase_price': 10000 + user_id % 1000,
+             'user_id': user_id,
+             'purchase_date': datetime(2020, 7, 1),
+             'current_price': 15000 + index,
+             'position_value': (15000 + index) * (10 + index)}
+            for user_id in user_ids for index in range(positions_per_user)
+        ])
+        database.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--positions', type=int, default=5)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    database_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    database_file.close()
+    os.environ['CONFIG_TYPE'] = 'config.TestingConfig'
+    os.environ['TEST_DATABASE_URI'] = f'sqlite:///{database_file.name}'
+
+    app = create_app()
+    try:
+        with app.app_context():
+            database.create_all()
+            create_users(args.users, args.positions)
+
+            start = time.perf_counter()
+            number_of_rows = take_portfolio_snapshots(date.today(), {}, args.chunk_size)
+            elapsed = time.perf_counter() - start
+            print(f'Snapshot of {args.users} users ({args.users * args.positions} positions): '
+                  f'{number_of_rows} rows in {elapsed:.2f} s')
+
+            database.session.remove()
+            database.drop_all()
+    finally:
+        os.remove(database_file.name)
+
+
+if __name__ == '__main__':
+    main()
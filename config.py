@@ -4,6 +4,43 @@ from datetime import timedelta
 # Determine the folder of the top-level directory of this project
 BASEDIR = os.path.abspath(os.path.dirname(__file__))
 
+# Engine options (SQLALCHEMY_ENGINE_OPTIONS) of each database backend
+DATABASE_ENGINE_PROFILES = {
+    # SQLAlchemy defaults
+    'default': {},
+    'postgresql': {
+        'pool_size': int(os.getenv('DATABASE_POOL_SIZE', default=10)),
+        'max_overflow': int(os.getenv('DATABASE_MAX_OVERFLOW', default=20)),
+        'pool_timeout': 10,  # seconds waiting for a connection when the pool is exhausted
+        'pool_recycle': 1800,  # seconds, before the server (or a proxy) drops idle connections
+        'pool_pre_ping': True,
+        # Cancel the statements running for longer than DATABASE_STATEMENT_TIMEOUT milliseconds
+        'connect_args': {'options': f"-c statement_timeout={os.getenv('DATABASE_STATEMENT_TIMEOUT', default=10000)}"},
+    },
+    # The SQLite tuning is done by the SQLITE_PRAGMAS run on each new connection
+    'sqlite': {},
+}
+
+# PRAGMAs run on each new connection with the 'sqlite' engine profile: readers do not block
+# the writer (and the other way round), and a writer waits for the lock instead of failing
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,  # bytes
+    'busy_timeout': 5000,  # milliseconds
+}
+
+
+def get_database_engine_profile(database_uri: str) -> str:
+    """Return the name of the engine profile set by DATABASE_ENGINE_PROFILE, or else of the backend of `database_uri`"""
+    backend = database_uri.split(':', 1)[0].split('+', 1)[0]
+    default_profile = backend if backend in DATABASE_ENGINE_PROFILES else 'default'
+    profile = os.getenv('DATABASE_ENGINE_PROFILE', default=default_profile)
+    if profile not in DATABASE_ENGINE_PROFILES:
+        raise ValueError(f'Unknown DATABASE_ENGINE_PROFILE {profile!r} '
+                         f'(valid profiles: {", ".join(DATABASE_ENGINE_PROFILES)})')
+    return profile
+
 
 class Config(object):
     FLASK_ENV = 'development'
@@ -17,6 +54,9 @@ class Config(object):
     else:
         SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(BASEDIR, 'instance', 'app.db')}"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    DATABASE_ENGINE_PROFILE = get_database_engine_profile(SQLALCHEMY_DATABASE_URI)
+    SQLALCHEMY_ENGINE_OPTIONS = DATABASE_ENGINE_PROFILES[DATABASE_ENGINE_PROFILE]
+    SQLITE_PRAGMAS = SQLITE_PRAGMAS
     WTF_CSRF_ENABLED = True
     EMEMBER_COOKIE_DURATION = timedelta(days=14)
     # Flask-Mail Configuration
@@ -31,6 +71,68 @@ class Config(object):
     LOG_WITH_GUNICORN = os.getenv('LOG_WITH_GUNICORN', default=False)
 
     ALPHA_VANTAGE_API_KEY = os.getenv('ALPHA_VANTAGE_API_KEY', default='demo')
+    # Market-data provider: 'ALPHA_VANTAGE', 'FAKE' (deterministic local provider),
+    # 'RECORD' or 'REPLAY' (Alpha Vantage responses recorded to/replayed from a cassette)
+    MARKET_DATA_PROVIDER = os.getenv('MARKET_DATA_PROVIDER', default='ALPHA_VANTAGE')
+    MARKET_DATA_CASSETTE = os.getenv('MARKET_DATA_CASSETTE',
+                                     default=os.path.join(BASEDIR, 'instance', 'market_data_cassette.json.gz'))
+    MARKET_DATA_FAKE_LATENCY = float(os.getenv('MARKET_DATA_FAKE_LATENCY', default=0.0))        # seconds
+    MARKET_DATA_FAKE_ERROR_RATE = float(os.getenv('MARKET_DATA_FAKE_ERROR_RATE', default=0.0))  # 0.0 - 1.0
+    MARKET_DATA_FAKE_SEED = 0
+    # Quote cache (shared by all users holding the same stock symbol)
+    QUOTE_CACHE_TTL = int(os.getenv('QUOTE_CACHE_TTL', default=3600))  # seconds
+    QUOTE_CACHE_MAX_SIZE = 1024
+    # Maximum number of quotes fetched in parallel when rendering a portfolio
+    MARKET_DATA_MAX_CONCURRENCY = int(os.getenv('MARKET_DATA_MAX_CONCURRENCY', default=8))
+    # Retrieve multiple quotes per call with Alpha Vantage's bulk quote endpoint (premium API keys only)
+    MARKET_DATA_BULK_QUOTES = os.getenv('MARKET_DATA_BULK_QUOTES', default='false').lower() == 'true'
+    MARKET_DATA_BULK_QUOTE_SIZE = 100
+    # HTTP client used for the calls to Alpha Vantage
+    MARKET_DATA_CONNECT_TIMEOUT = 3.05  # seconds
+    MARKET_DATA_READ_TIMEOUT = 10.0     # seconds
+    MARKET_DATA_MAX_RETRIES = 2
+    MARKET_DATA_RETRY_BACKOFF = 0.5     # seconds
+    MARKET_DATA_POOL_SIZE = 10
+    # Call budget for Alpha Vantage (the free tier allows 5 calls per minute); calls
+    # wait up to MARKET_DATA_MAX_WAIT seconds for the budget before using stored data
+    MARKET_DATA_CALLS_PER_MINUTE = float(os.getenv('MARKET_DATA_CALLS_PER_MINUTE', default=5))
+    MARKET_DATA_BURST = int(os.getenv('MARKET_DATA_BURST', default=5))
+    MARKET_DATA_MAX_WAIT = 2.0  # seconds
+    # Stop calling the provider for MARKET_DATA_RESET_TIMEOUT seconds after
+    # MARKET_DATA_FAILURE_THRESHOLD consecutive network or server errors
+    MARKET_DATA_FAILURE_THRESHOLD = int(os.getenv('MARKET_DATA_FAILURE_THRESHOLD', default=5))
+    MARKET_DATA_RESET_TIMEOUT = 30.0  # seconds
+    # Render the portfolio page with stale prices (refreshed in the background) unless
+    # they are older than STOCKS_MAX_STALENESS, which forces a synchronous refresh
+    STOCKS_STALE_WHILE_REVALIDATE = True
+    STOCKS_MAX_STALENESS = int(os.getenv('STOCKS_MAX_STALENESS', default=3 * 24 * 3600))  # seconds
+    # Number of stocks on each page of the portfolio (`/stocks?page_size=...`, up to STOCKS_MAX_PAGE_SIZE)
+    STOCKS_PAGE_SIZE = 100
+    STOCKS_MAX_PAGE_SIZE = 1000
+    # Live prices pushed to the portfolio page (`/stocks/stream`): each watched symbol is
+    # polled every PRICE_STREAM_INTERVAL seconds and a heartbeat is sent to idle connections
+    PRICE_STREAM_INTERVAL = float(os.getenv('PRICE_STREAM_INTERVAL', default=60))  # seconds
+    PRICE_STREAM_HEARTBEAT = 15.0  # seconds
+    # A stream holds a worker while it is open, so it is closed after PRICE_STREAM_MAX_DURATION
+    # seconds and the browser reconnects (EventSource) after PRICE_STREAM_RETRY seconds
+    PRICE_STREAM_MAX_DURATION = 300.0  # seconds
+    PRICE_STREAM_RETRY = 5.0  # seconds
+    # Portfolio analytics (`/stocks/analytics`), cached per user and as-of date
+    ANALYTICS_CACHE_TTL = 3600  # seconds
+    ANALYTICS_CACHE_MAX_SIZE = 1024
+    ANALYTICS_RISK_FREE_RATE = float(os.getenv('ANALYTICS_RISK_FREE_RATE', default=0.0))  # annual rate
+    # Weekly value history of each portfolio, extended with the new weeks on each view
+    PORTFOLIO_HISTORY_CACHE_TTL = 7 * 24 * 3600  # seconds
+    # Risk of the portfolios (`/stocks/risk`): covariance matrix of the weekly returns over
+    # the last RISK_LOOKBACK_WEEKS, cached per symbol set (and day) for every portfolio
+    RISK_LOOKBACK_WEEKS = int(os.getenv('RISK_LOOKBACK_WEEKS', default=156))
+    RISK_CACHE_TTL = 24 * 3600  # seconds
+    # Background price refresh (`flask stocks refresh-daemon`)
+    REFRESH_DAEMON_CALLS_PER_MINUTE = float(os.getenv('REFRESH_DAEMON_CALLS_PER_MINUTE', default=3))
+    REFRESH_VIEWS_HALF_LIFE = 24  # hours
+    # The views of the stocks are buffered in memory and written at most every STOCK_VIEWS_FLUSH_INTERVAL
+    # seconds, so that viewing a portfolio with fresh prices does not write to the database
+    STOCK_VIEWS_FLUSH_INTERVAL = 60.0  # seconds
 
 
 class ProductionConfig(Config):
@@ -45,5 +147,13 @@ class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = os.getenv('TEST_DATABASE_URI',
                                         default=f"sqlite:///{os.path.join(BASEDIR, 'instance', 'test.db')}")
+    DATABASE_ENGINE_PROFILE = get_database_engine_profile(SQLALCHEMY_DATABASE_URI)
+    SQLALCHEMY_ENGINE_OPTIONS = DATABASE_ENGINE_PROFILES[DATABASE_ENGINE_PROFILE]
     WTF_CSRF_ENABLED = False
     MAIL_DEFAULT_SENDER = 'flaskstockportfolioapp@gmail.com'
+    # Disable quote caching, the call budget, the circuit breaker and the background
+    # refresh so that each test sees the response of its own mock
+    QUOTE_CACHE_TTL = 0
+    MARKET_DATA_CALLS_PER_MINUTE = None
+    MARKET_DATA_FAILURE_THRESHOLD = None
+    STOCKS_STALE_WHILE_REVALIDATE = False
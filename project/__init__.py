@@ -5,11 +5,16 @@ from flask.logging import default_handler
 import os
 from flask_sqlalchemy import SQLAlchemy
 from flask_wtf import CSRFProtect
-from sqlalchemy import MetaData
+from sqlalchemy import MetaData, event
 from flask_migrate import Migrate
 from flask_login import LoginManager
 from flask_mail import Mail
 
+from project.cache import QuoteCache, TTLCache
+from project.gateway import ProviderGateway
+from project.price_stream import PriceStreamHub
+from project.providers import create_market_data_client, create_market_data_provider
+
 # -------------
 # Configuration
 # -------------
@@ -80,12 +85,61 @@ def initialize_extensions(app):
     # Since the application instance is now created, pass it to each Flask
     # extension instance to bind it to the Flask application instance (app)
     database.init_app(app)
+
+    # Tune each new connection of the 'sqlite' engine profile with the SQLite PRAGMAs
+    if app.config['DATABASE_ENGINE_PROFILE'] == 'sqlite':
+        pragmas = app.config['SQLITE_PRAGMAS']
+
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name} = {value}')
+            cursor.close()
+
+        with app.app_context():
+            event.listen(database.engine, 'connect', set_sqlite_pragmas)
     db_migration.init_app(app, database)
     csrf_protection.init_app(app)
 
     login.init_app(app)
     mail.init_app(app)
 
+    # Quotes are cached per application instance so that every request handled
+    # by this worker process shares the same upstream fetches
+    app.extensions['quote_cache'] = QuoteCache(max_size=app.config['QUOTE_CACHE_MAX_SIZE'],
+                                               ttl=app.config['QUOTE_CACHE_TTL'])
+
+    app.extensions['analytics_cache'] = TTLCache(max_size=app.config['ANALYTICS_CACHE_MAX_SIZE'],
+                                                 ttl=app.config['ANALYTICS_CACHE_TTL'])
+    app.extensions['portfolio_history_cache'] = TTLCache(max_size=app.config['ANALYTICS_CACHE_MAX_SIZE'],
+                                                         ttl=app.config['PORTFOLIO_HISTORY_CACHE_TTL'])
+    app.extensions['risk_cache'] = TTLCache(max_size=app.config['ANALYTICS_CACHE_MAX_SIZE'],
+                                            ttl=app.config['RISK_CACHE_TTL'])
+
+    # Every call to Alpha Vantage goes through a single pooled HTTP client, fronted
+    # by a gateway that coalesces duplicate calls and enforces the call budget.
+    # The market-data provider (Alpha Vantage or the fake provider) is selected
+    # by the MARKET_DATA_PROVIDER configuration variable; the fake provider calls
+    # a local fake client through the same gateway.
+    app.extensions['market_data_client'] = create_market_data_client(app.config)
+    app.extensions['market_data_gateway'] = ProviderGateway.from_config(app.extensions['market_data_client'],
+                                                                        app.config)
+    app.extensions['market_data_provider'] = create_market_data_provider(app.config,
+                                                                         app.extensions['market_data_gateway'])
+
+    # Live prices (`/stocks/stream`) are polled once per symbol and fanned out to every connection
+    from project.models import get_current_stock_price
+
+    def fetch_streamed_price(symbol):
+        # Each poller thread needs its own application context (and database session)
+        with app.app_context():
+            price = get_current_stock_price(symbol)
+            database.session.commit()
+            return price
+
+    app.extensions['price_stream'] = PriceStreamHub(fetch_streamed_price,
+                                                    interval=app.config['PRICE_STREAM_INTERVAL'])
+
     # Flask-Login configuration
     from project.models import User
 
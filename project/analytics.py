@@ -0,0 +1,303 @@
+"""
+Performance analytics of the portfolios, computed from the stored weekly prices.
+
+The adjusted closing prices of every stock of a portfolio are loaded with a
+single query into a (weeks x symbols) matrix, and the metrics of every
+position and of the portfolio are computed with NumPy over the whole matrix:
+  - time-weighted return
+  - annualized volatility
+  - Sharpe ratio (annualized)
+  - maximum drawdown
+
+The results are cached per (user, as-of date) in the 'analytics_cache' extension.
+
+The weekly value history of each portfolio is cached in the 'portfolio_history_cache'
+extension and only extended with the new weeks on the next views.
+"""
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from flask import current_app
+
+from project import database
+from project.models import PriceHistory, Stock, sync_weekly_price_history
+from project.series import PriceSeries
+
+WEEKS_PER_YEAR = 52
+
+
+class PerformanceMetrics(object):
+    """Performance metrics of a position or of a portfolio (None when not enough weeks are available)"""
+
+    def __init__(self, time_weighted_return=None, annualized_volatility=None, sharpe_ratio=None,
+                 max_drawdown=None, number_of_weeks=0):
+        self.time_weighted_return = time_weighted_return
+        self.annualized_volatility = annualized_volatility
+        self.sharpe_ratio = sharpe_ratio
+        self.max_drawdown = max_drawdown
+        self.number_of_weeks = number_of_weeks
+
+    def to_dict(self) -> dict:
+        return {'time_weighted_return': self.time_weighted_return,
+                'annualized_volatility': self.annualized_volatility,
+                'sharpe_ratio': self.sharpe_ratio,
+                'max_drawdown': self.max_drawdown,
+                'number_of_weeks': self.number_of_weeks}
+
+
+class PortfolioAnalytics(object):
+    def __init__(self, as_of: date, positions: list, portfolio: PerformanceMetrics):
+        self.as_of = as_of
+        self.positions = positions  # List of ((stock ID, symbol), PerformanceMetrics)
+        self.portfolio = portfolio
+
+    def to_dict(self) -> dict:
+        return {'as_of': self.as_of.isoformat(),
+                'positions': [dict(metrics.to_dict(), id=stock_id, symbol=symbol)
+                              for (stock_id, symbol), metrics in self.positions],
+                'portfolio': self.portfolio.to_dict()}
+
+
+def load_weekly_closes(symbols: list, start_date: date, end_date: date):
+    """Load the weekly adjusted closing prices of `symbols` with a single query
+
+    Returns the array of the weeks and a (weeks x symbols) matrix of the prices
+    in dollars, where a missing week is filled with the previous price (NaN
+    before the first stored week of a symbol).
+    """
+    query = (database.select(PriceHistory.stock_symbol,
+                             PriceHistory.date,
+                             database.func.coalesce(PriceHistory.adjusted_close_price, PriceHistory.close_price))
+             .where(PriceHistory.stock_symbol.in_(symbols),
+                    PriceHistory.date >= start_date,
+                    PriceHistory.date <= end_date))
+    rows = database.session.execute(query).all()
+    if not rows:
+        return np.array([], dtype='datetime64[D]'), np.empty((0, len(symbols)))
+
+    row_symbols, row_dates, row_prices = zip(*rows)
+    weeks, week_index = np.unique(np.array(row_dates, dtype='datetime64[D]'), return_inverse=True)
+    symbol_index = {symbol: index for index, symbol in enumerate(symbols)}
+    closes = np.full((len(weeks), len(symbols)), np.nan)
+    closes[week_index, [symbol_index[symbol] for symbol in row_symbols]] = np.array(row_prices, dtype=float) / 100
+
+    # Forward-fill the missing weeks with the last known price
+    is_known = ~np.isnan(closes)
+    last_known = np.where(is_known, np.arange(len(weeks))[:, None], 0)
+    np.maximum.accumulate(last_known, axis=0, out=last_known)
+    closes = closes[last_known, np.arange(len(symbols))]
+    closes[~np.maximum.accumulate(is_known, axis=0)] = np.nan
+    return weeks, closes
+
+
+def compute_metrics(returns: np.ndarray, risk_free_rate: float = 0.0) -> list:
+    """Compute the metrics of each column of a (weeks x series) matrix of weekly returns
+
+    NaN returns (weeks when a series is not held) are ignored.
+    """
+    is_held = ~np.isnan(returns)
+    number_of_weeks = is_held.sum(axis=0)
+    growth = np.where(is_held, 1.0 + returns, 1.0)
+
+    wealth = np.cumprod(growth, axis=0)
+    time_weighted_returns = wealth[-1] - 1.0 if len(wealth) else np.zeros(returns.shape[1])
+    peaks = np.maximum.accumulate(np.vstack([np.ones((1, returns.shape[1])), wealth]), axis=0)[1:]
+    max_drawdowns = np.min(wealth / peaks - 1.0, axis=0, initial=0.0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_returns = np.nansum(returns, axis=0) / number_of_weeks
+        variances = np.nansum((returns - mean_returns) ** 2, axis=0) / (number_of_weeks - 1)
+        volatilities = np.sqrt(variances * WEEKS_PER_YEAR)
+        sharpe_ratios = (mean_returns * WEEKS_PER_YEAR - risk_free_rate) / volatilities
+
+    def to_float(value):
+        return float(value) if np.isfinite(value) else None
+
+    return [PerformanceMetrics(time_weighted_return=float(time_weighted_returns[index]) if weeks else None,
+                               annualized_volatility=to_float(volatilities[index]) if weeks > 1 else None,
+                               sharpe_ratio=to_float(sharpe_ratios[index]) if weeks > 1 else None,
+                               max_drawdown=float(max_drawdowns[index]) if weeks else None,
+                               number_of_weeks=int(weeks))
+            for index, weeks in enumerate(number_of_weeks)]
+
+
+def compute_portfolio_analytics(stocks: list, as_of: date) -> PortfolioAnalytics:
+    """Compute the performance of each position of `stocks` and of the portfolio until `as_of`
+
+    Each position is held from its purchase date. The portfolio return of each
+    week only includes the positions held at the start of the week, so that
+    buying a position does not count as a return (time-weighted return).
+    """
+    if not stocks:
+        return PortfolioAnalytics(as_of, [], compute_metrics(np.empty((0, 1)))[0])
+
+    symbols = sorted({stock.stock_symbol for stock in stocks})
+    purchase_dates = np.array([stock.purchase_date.date() for stock in stocks], dtype='datetime64[D]')
+    weeks, closes = load_weekly_closes(symbols, purchase_dates.min().item(), as_of)
+
+    # Prices (weeks x lots) of each lot, only from its purchase date
+    symbol_ids = np.array([symbols.index(stock.stock_symbol) for stock in stocks])
+    prices = closes[:, symbol_ids]
+    prices[weeks[:, None] < purchase_dates[None, :]] = np.nan
+    with np.errstate(invalid='ignore'):
+        position_returns = prices[1:] / prices[:-1] - 1.0
+
+    # Weekly returns of the portfolio: change of value of the lots held during the whole week
+    shares = np.array([stock.number_of_shares for stock in stocks], dtype=float)
+    is_held = ~np.isnan(position_returns)
+    start_values = np.where(is_held, prices[:-1] * shares, 0.0).sum(axis=1)
+    end_values = np.where(is_held, prices[1:] * shares, 0.0).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        portfolio_returns = np.where(start_values > 0, end_values / start_values - 1.0, np.nan)
+
+    risk_free_rate = current_app.config['ANALYTICS_RISK_FREE_RATE']
+    position_metrics = compute_metrics(position_returns, risk_free_rate)
+    portfolio_metrics = compute_metrics(portfolio_returns[:, None], risk_free_rate)[0]
+    return PortfolioAnalytics(as_of,
+                              [((stock.id, stock.stock_symbol), metrics)
+                               for stock, metrics in zip(stocks, position_metrics)],
+                              portfolio_metrics)
+
+
+def sync_portfolio_price_history(stocks: list):
+    """Make sure the price history of each symbol of `stocks` is stored from its earliest purchase date
+
+    The provider is only called for the symbols whose stored weeks are not current.
+    """
+    start_dates = {}
+    for stock in stocks:
+        start_date = stock.purchase_date.date()
+        start_dates[stock.stock_symbol] = min(start_date, start_dates.get(stock.stock_symbol, start_date))
+    for symbol, start_date in start_dates.items():
+        sync_weekly_price_history(symbol, start_date)
+
+
+def get_portfolio_analytics(user_id: int, as_of: date = None) -> PortfolioAnalytics:
+    """Return the performance analytics of the portfolio of a user, cached per (user, as-of date)"""
+    as_of = as_of or datetime.now().date()
+    analytics_cache = current_app.extensions['analytics_cache']
+    analytics = analytics_cache.get((user_id, as_of))
+    if analytics is not None:
+        return analytics
+
+    query = database.select(Stock).where(Stock.user_id == user_id).order_by(Stock.id)
+    stocks = database.session.execute(query).scalars().all()
+    sync_portfolio_price_history(stocks)
+
+    analytics = compute_portfolio_analytics(stocks, as_of)
+    analytics_cache.set((user_id, as_of), analytics)
+    return analytics
+
+
+def invalidate_portfolio_analytics(user_id: int):
+    """Remove the cached analytics of a user, such as when a position is added"""
+    current_app.extensions['analytics_cache'].delete_matching(lambda key: key[0] == user_id)
+
+
+# -----------------------
+# Portfolio Value History
+# -----------------------
+
+class PortfolioValueHistory(object):
+    """Weekly values of a portfolio, which can be extended with the new weeks
+
+    - `version` - version of the positions and price history the values were computed from
+    - `series` - weekly values of the portfolio (in cents)
+    - `resume_prices` - prices (in dollars) of each symbol known before the last week of
+      `series`, from which the values are computed again when the history is extended
+    """
+
+    def __init__(self, version: tuple, series: PriceSeries, resume_prices: np.ndarray):
+        self.version = version
+        self.series = series
+        self.resume_prices = resume_prices
+
+
+def get_portfolio_history_version(user_id: int) -> tuple:
+    """Return the version of the positions of a user and of the start of their price history
+
+    A cached value history can only be extended if the positions are the same
+    and no older weeks were stored in the price history since it was computed.
+    """
+    symbols = database.select(Stock.stock_symbol).where(Stock.user_id == user_id).distinct()
+    query = database.select(database.func.count(Stock.id),
+                            database.func.max(Stock.id),
+                            database.func.sum(Stock.number_of_shares)).where(Stock.user_id == user_id)
+    earliest_dates = (database.select(database.func.min(PriceHistory.date))
+                      .where(PriceHistory.stock_symbol.in_(symbols))
+                      .group_by(PriceHistory.stock_symbol)
+                      .order_by(PriceHistory.stock_symbol))
+    return (tuple(database.session.execute(query).one()),
+            tuple(database.session.execute(earliest_dates).scalars()))
+
+
+def extend_portfolio_value_history(stocks: list, version: tuple, history: PortfolioValueHistory = None,
+                                   end_date: date = None) -> PortfolioValueHistory:
+    """Compute the weekly values of the portfolio `stocks` after the weeks already in `history`
+
+    The last week of `history` is computed again, as it may have been a partial
+    week. Without `history`, the values are computed from the first purchase date.
+    The values are computed until `end_date` (default: today).
+    """
+    symbols = sorted({stock.stock_symbol for stock in stocks})
+    symbol_ids = np.array([symbols.index(stock.stock_symbol) for stock in stocks], dtype=np.int64)
+    shares = np.array([stock.number_of_shares for stock in stocks], dtype=float)
+    purchase_dates = np.array([stock.purchase_date.date() for stock in stocks], dtype='datetime64[D]')
+
+    if history is not None and len(history.series) > 0:
+        days, values = history.series.days[:-1], history.series.prices[:-1]
+        start_date = history.series.last_date()
+        resume_prices = history.resume_prices
+    else:
+        days, values = [], []
+        start_date = purchase_dates.min().item() if stocks else datetime.now().date()
+        resume_prices = np.full(len(symbols), np.nan)
+
+    weeks, closes = load_weekly_closes(symbols, start_date, end_date or datetime.now().date())
+    if len(weeks) == 0:
+        return PortfolioValueHistory(version, history.series if history is not None else PriceSeries(),
+                                     resume_prices)
+
+    # The weeks before the first stored week of a symbol (since `start_date`) use the last known price
+    closes = np.where(np.isnan(closes), resume_prices[None, :], closes)
+    is_held = weeks[:, None] >= purchase_dates[None, :]
+    week_values = np.nansum(np.where(is_held, closes[:, symbol_ids] * shares, 0.0), axis=1)
+
+    series = PriceSeries(days, values)
+    series.days.extend(weeks.astype(np.int64).tolist())
+    series.prices.extend(np.rint(week_values * 100).astype(np.int64).tolist())
+    return PortfolioValueHistory(version, series, closes[-2] if len(weeks) > 1 else resume_prices)
+
+
+def get_portfolio_value_history(user_id: int, end_date: date = None) -> PriceSeries:
+    """Return the weekly values of the portfolio of a user until `end_date` (default: today)
+
+    The value history is cached per user: the next views only compute the weeks
+    stored since the last view (and the price history is only synchronized once
+    the last week is a week old). A cached history that goes beyond `end_date`
+    is sliced to it, and a shorter one is extended until `end_date`.
+    """
+    end_date = end_date or datetime.now().date()
+    history_cache = current_app.extensions['portfolio_history_cache']
+    history = history_cache.get(user_id)
+    version = get_portfolio_history_version(user_id)
+    if history is not None and history.version != version:
+        history = None
+
+    is_last_week_current = (history is not None and len(history.series) > 0 and
+                            history.series.last_date() > end_date - timedelta(weeks=1))
+    if is_last_week_current:
+        return history.series.until(end_date)
+
+    query = database.select(Stock).where(Stock.user_id == user_id).order_by(Stock.id)
+    stocks = database.session.execute(query).scalars().all()
+    sync_portfolio_price_history(stocks)
+
+    # Syncing may have stored older weeks, which requires computing the values from scratch
+    new_version = get_portfolio_history_version(user_id)
+    if new_version != version:
+        history = None
+
+    history = extend_portfolio_value_history(stocks, new_version, history, end_date)
+    history_cache.set(user_id, history)
+    return history.series
@@ -0,0 +1,95 @@
+"""
+In-process caches shared by every request handled by a worker process.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache(object):
+    """Thread-safe LRU cache where each entry expires after `ttl` seconds
+
+    A `ttl` of zero (or less) disables the cache: every lookup is a miss
+    and nothing is stored.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_matching(self, predicate):
+        """Delete every entry whose key matches `predicate(key)`"""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class QuoteCache(TTLCache):
+    """Cache of the current share price (in dollars) keyed by stock symbol
+
+    In addition to the in-process hit/miss counters, this cache counts how
+    often a quote was found in the persisted `quotes` table and how often
+    the market-data provider actually had to be called.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300.0):
+        super().__init__(max_size, ttl)
+        self.persisted_hits = 0
+        self.upstream_fetches = 0
+
+    def record_persisted_hit(self):
+        with self._lock:
+            self.persisted_hits += 1
+
+    def record_upstream_fetch(self):
+        with self._lock:
+            self.upstream_fetches += 1
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats['persisted_hits'] = self.persisted_hits
+        stats['upstream_fetches'] = self.upstream_fetches
+        return stats
@@ -0,0 +1,214 @@
+"""
+Gateway in front of the market-data provider (Alpha Vantage).
+
+Every call to the provider goes through the gateway, which:
+  - coalesces concurrent in-flight requests for the same URL into one call
+  - enforces a token-bucket budget of calls, so that calls which would be
+    rejected by the provider's rate limit are not wasted
+  - fails fast with a circuit breaker while the provider is down, so that
+    requests are served from the stored data instead of waiting on timeouts
+"""
+import threading
+import time
+from concurrent.futures import Future
+
+import requests
+
+
+class ProviderUnavailable(Exception):
+    """Raised when the provider is not called, so the stored data should be used instead"""
+    pass
+
+
+class RateLimitExceeded(ProviderUnavailable):
+    """Raised when no call to the provider is available within the call budget"""
+    pass
+
+
+class CircuitOpen(ProviderUnavailable):
+    """Raised when the circuit breaker is open after consecutive failures of the provider"""
+    pass
+
+
+class SingleFlight(object):
+    """Coalesces concurrent calls with the same key into a single call"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function):
+        with self._lock:
+            future = self._calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._calls[key] = future
+
+        # Followers wait for the result (or exception) of the call made by the leader
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = function()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class TokenBucket(object):
+    """Token-bucket rate limiter allowing `calls_per_minute` with bursts of `capacity`"""
+
+    def __init__(self, calls_per_minute: float, capacity: int = None):
+        self.rate = calls_per_minute / 60.0
+        self.capacity = capacity or max(int(calls_per_minute), 1)
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def acquire(self, timeout: float = 0.0) -> bool:
+        """Take a token, waiting up to `timeout` seconds for one to become available"""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return True
+                wait = (1.0 - self._tokens) / self.rate
+
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def drain(self):
+        """Empty the bucket, such as when the provider reports that its quota is exhausted"""
+        with self._lock:
+            self._tokens = 0.0
+            self._updated_at = time.monotonic()
+
+
+class CircuitBreaker(object):
+    """Circuit breaker that opens after `failure_threshold` consecutive failures
+
+    While open, calls are refused for `reset_timeout` seconds. After that, the
+    circuit is half-open: a single probe call is allowed, which closes the
+    circuit if it succeeds or re-opens it if it fails.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Check if a call can be made (a half-open circuit only allows one probe call)"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def cancel_probe(self):
+        """Give back the probe call of a half-open circuit when it is not made"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class ProviderGateway(object):
+    def __init__(self, client, calls_per_minute: float = None, burst: int = None, max_wait: float = 0.0,
+                 failure_threshold: int = None, reset_timeout: float = 30.0):
+        self.client = client
+        self.max_wait = max_wait
+        self.rate_limiter = TokenBucket(calls_per_minute, burst) if calls_per_minute else None
+        self.circuit_breaker = CircuitBreaker(failure_threshold, reset_timeout) if failure_threshold else None
+        self._single_flight = SingleFlight()
+
+    @classmethod
+    def from_config(cls, client, config):
+        return cls(client,
+                   calls_per_minute=config['MARKET_DATA_CALLS_PER_MINUTE'],
+                   burst=config['MARKET_DATA_BURST'],
+                   max_wait=config['MARKET_DATA_MAX_WAIT'],
+                   failure_threshold=config['MARKET_DATA_FAILURE_THRESHOLD'],
+                   reset_timeout=config['MARKET_DATA_RESET_TIMEOUT'])
+
+    def get(self, url: str, consume=None, key: str = None):
+        """Send a GET call to the provider, sharing the result with concurrent identical calls
+
+        If `consume` is given, the response is streamed and the result of
+        `consume(response)` is returned (and shared) instead of the response.
+        Concurrent calls are identified by `key`, which defaults to the URL.
+        """
+        return self._single_flight.do(key or url, lambda: self._get(url, consume))
+
+    def _get(self, url: str, consume=None):
+        if self.circuit_breaker is not None and not self.circuit_breaker.allow():
+            raise CircuitOpen()
+        if self.rate_limiter is not None and not self.rate_limiter.acquire(self.max_wait):
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.cancel_probe()
+            raise RateLimitExceeded()
+
+        # Network errors (connection failures, timeouts) and server errors count as
+        # failures of the provider; any other response means that the provider is up
+        try:
+            if consume is None:
+                r = self.client.get(url)
+                self._record_result(r.status_code)
+                return r
+
+            r = self.client.get(url, stream=True)
+            try:
+                self._record_result(r.status_code)
+                return consume(r)
+            finally:
+                # Closing the response stops downloading whatever was not consumed
+                r.close()
+        except requests.exceptions.RequestException:
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.record_failure()
+            raise
+
+    def _record_result(self, status_code: int):
+        if self.circuit_breaker is None:
+            return
+        if status_code >= 500:
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()
+
+    def report_rate_limited(self):
+        if self.rate_limiter is not None:
+            self.rate_limiter.drain()
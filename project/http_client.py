@@ -0,0 +1,43 @@
+"""
+HTTP client used for every call to the market-data provider (Alpha Vantage).
+"""
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class MarketDataClient(object):
+    """Pooled, keep-alive HTTP client with timeouts and retry-with-backoff
+
+    A single instance is created per application (see `initialize_extensions()`)
+    so that the TCP+TLS connections to the provider are re-used between calls.
+    """
+
+    def __init__(self, connect_timeout: float = 3.05, read_timeout: float = 10.0,
+                 max_retries: int = 2, backoff_factor: float = 0.5, pool_size: int = 10):
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+
+        retry = Retry(total=max_retries,
+                      backoff_factor=backoff_factor,
+                      status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset(['GET']),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(connect_timeout=config['MARKET_DATA_CONNECT_TIMEOUT'],
+                   read_timeout=config['MARKET_DATA_READ_TIMEOUT'],
+                   max_retries=config['MARKET_DATA_MAX_RETRIES'],
+                   backoff_factor=config['MARKET_DATA_RETRY_BACKOFF'],
+                   pool_size=config['MARKET_DATA_POOL_SIZE'])
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def close(self):
+        self.session.close()
@@ -1,62 +1,658 @@
-from datetime import datetime, timedelta
+import hashlib
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 
 import flask_login
-import requests
 from flask import current_app
 
 from project import database
-from sqlalchemy import Integer, String, DateTime, Boolean, ForeignKey
+from project.gateway import ProviderUnavailable
+from project.series import PriceSeries
+from sqlalchemy import Integer, BigInteger, String, Date, DateTime, Boolean, ForeignKey, Index, UniqueConstraint
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import mapped_column, relationship
 from werkzeug.security import generate_password_hash, check_password_hash
 
 
-def create_alpha_vantage_url_quote(symbol: str) -> str:
-    return 'https://www.alphavantage.co/query?function={}&symbol={}&apikey={}'.format(
-        'GLOBAL_QUOTE',
-        symbol,
-        current_app.config['ALPHA_VANTAGE_API_KEY']
+def get_current_stock_price(symbol: str) -> float:
+    """Return the current share price of `symbol`, consulting the quote caches first
+
+    Quotes are shared between every user holding the same stock: the in-process
+    cache is checked first, then the persisted `quotes` table (shared between
+    worker processes), and only if both are stale is the market-data provider called.
+    """
+    quote_cache = current_app.extensions['quote_cache']
+    price = quote_cache.get(symbol)
+    if price is not None:
+        return price
+
+    quote = database.session.get(Quote, symbol)
+    if quote is not None and quote.is_fresh(quote_cache.ttl):
+        quote_cache.record_persisted_hit()
+        price = quote.get_price()
+        quote_cache.set(symbol, price)
+        return price
+
+    try:
+        price = current_app.extensions['market_data_provider'].get_quote(symbol)
+    except ProviderUnavailable as e:
+        # Serve the last stored quote when the call budget is exhausted (instead of wasting
+        # a call that would be rejected) or when the provider is down (circuit breaker open)
+        current_app.logger.warning(f'Market-data provider not called ({type(e).__name__}), '
+                                   f'serving the stored quote ({symbol})!')
+        return quote.get_price() if quote is not None else 0.0
+
+    quote_cache.record_upstream_fetch()
+    if price > 0.0:
+        store_quote(symbol, price, quote)
+
+    return price
+
+
+def store_quote(symbol: str, price: float, quote=None):
+    """Save a freshly retrieved share price in the quote cache and the `quotes` table
+
+    The quote is written with an upsert, so that workers storing the quote of the
+    same new symbol at the same time do not collide on its primary key. `quote`
+    is the `Quote` object of the symbol already loaded in the session (if any).
+    """
+    current_app.extensions['quote_cache'].set(symbol, price)
+    values = {'price': int(price * 100), 'updated_on': datetime.now()}
+    database.session.execute(
+        dialect_insert(Quote)
+        .values(stock_symbol=symbol, view_count=0, **values)
+        .on_conflict_do_update(index_elements=[Quote.stock_symbol], set_=values)
     )
+    if quote is not None:
+        database.session.expire(quote)
+
+
+def dialect_insert(model):
+    """Return an INSERT statement into `model` supporting ON CONFLICT (SQLite and PostgreSQL)"""
+    if database.session.get_bind().dialect.name == 'postgresql':
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+
+def get_current_stock_prices(symbols) -> dict:
+    """Return a dictionary of the current share price of each stock symbol
+
+    Duplicate symbols are only looked up once, and the quotes that are not
+    already cached are retrieved with bulk quote calls (if supported by the
+    market-data provider). Any remaining quotes are fetched concurrently (up to
+    MARKET_DATA_MAX_CONCURRENCY at a time), so the latency is roughly one
+    round-trip instead of one per symbol.
+    """
+    symbols = sorted(set(symbols))
+    quote_cache = current_app.extensions['quote_cache']
+    prices = {}
+    for symbol in symbols:
+        price = quote_cache.get(symbol)
+        if price is not None:
+            prices[symbol] = price
+
+    uncached_symbols = [symbol for symbol in symbols if symbol not in prices]
+    if uncached_symbols and current_app.extensions['market_data_provider'].supports_bulk_quotes:
+        prices.update(get_bulk_stock_prices(uncached_symbols))
+        uncached_symbols = [symbol for symbol in uncached_symbols if symbol not in prices]
+
+    max_concurrency = min(current_app.config['MARKET_DATA_MAX_CONCURRENCY'], len(uncached_symbols))
+    if max_concurrency <= 1:
+        for symbol in uncached_symbols:
+            prices[symbol] = get_current_stock_price(symbol)
+        return prices
+
+    app = current_app._get_current_object()
+
+    def fetch(symbol):
+        # Each worker thread needs its own application context (and database session)
+        with app.app_context():
+            price = get_current_stock_price(symbol)
+            database.session.commit()
+            return price
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        prices.update(zip(uncached_symbols, executor.map(fetch, uncached_symbols)))
+
+    return prices
+
+
+def get_bulk_stock_prices(symbols: list) -> dict:
+    """Return the current share prices of `symbols` using as few calls to the provider as possible
+
+    Fresh quotes are read from the `quotes` table with a single query and the
+    stale ones are retrieved with one bulk quote call per MARKET_DATA_BULK_QUOTE_SIZE
+    symbols. Symbols that could not be retrieved are left out of the result.
+    """
+    quote_cache = current_app.extensions['quote_cache']
+    query = database.select(Quote).where(Quote.stock_symbol.in_(symbols))
+    quotes = {quote.stock_symbol: quote for quote in database.session.execute(query).scalars()}
+
+    prices = {}
+    stale_symbols = []
+    for symbol in symbols:
+        quote = quotes.get(symbol)
+        if quote is not None and quote.is_fresh(quote_cache.ttl):
+            quote_cache.record_persisted_hit()
+            prices[symbol] = quote.get_price()
+            quote_cache.set(symbol, prices[symbol])
+        else:
+            stale_symbols.append(symbol)
+
+    provider = current_app.extensions['market_data_provider']
+    batch_size = current_app.config['MARKET_DATA_BULK_QUOTE_SIZE']
+    for index in range(0, len(stale_symbols), batch_size):
+        try:
+            fetched_prices = provider.get_quotes(stale_symbols[index:index + batch_size])
+        except ProviderUnavailable as e:
+            current_app.logger.warning(f'Market-data provider not called ({type(e).__name__}), '
+                                       f'skipped the bulk quote call!')
+            break
+
+        quote_cache.record_upstream_fetch()
+        for symbol, price in fetched_prices.items():
+            if symbol in stale_symbols and price > 0.0:
+                store_quote(symbol, price, quotes.get(symbol))
+                prices[symbol] = price
+
+    return prices
+
+
+# (User ID, stock symbol) of the background price refreshes in progress
+_refreshing_symbols = set()
+_refreshing_symbols_lock = threading.Lock()
 
 
-def create_alpha_vantage_get_url_weekly(symbol: str) -> str:
-    return 'https://www.alphavantage.co/query?function={}&symbol={}&apikey={}'.format(
-        'TIME_SERIES_WEEKLY_ADJUSTED',
-        symbol,
-        current_app.config['ALPHA_VANTAGE_API_KEY']
+def schedule_price_refresh(symbols, user_id: int = None):
+    """Refresh the prices of the positions on `symbols` in a background thread
+
+    Only the positions of `user_id` are written, unless it is None (every user).
+    Symbols that already have a refresh in progress (for the same user) are
+    skipped. The refreshed prices are written to the database, so they are
+    picked up by the next page load. Returns the thread (or None if there was
+    nothing to refresh).
+    """
+    with _refreshing_symbols_lock:
+        keys = {(user_id, symbol) for symbol in symbols} - _refreshing_symbols
+        _refreshing_symbols.update(keys)
+    if not keys:
+        return None
+
+    symbols = {symbol for _, symbol in keys}
+    app = current_app._get_current_object()
+
+    def refresh_prices():
+        try:
+            with app.app_context():
+                write_back_stock_prices(get_current_stock_prices(symbols), user_id=user_id)
+                database.session.commit()
+                app.logger.info(f'Refreshed the prices of {len(symbols)} stocks in the background!')
+        finally:
+            with _refreshing_symbols_lock:
+                _refreshing_symbols.difference_update(keys)
+
+    thread = threading.Thread(target=refresh_prices, daemon=True)
+    thread.start()
+    return thread
+
+
+# View counts of the stock symbols that are not written to the `quotes` table yet
+_pending_stock_views = Counter()
+_pending_stock_views_lock = threading.Lock()
+_pending_stock_views_since = None
+
+
+def record_stock_views(symbols):
+    """Count a view of each stock symbol, used to prioritize the background price refresh
+
+    The views are buffered in memory and written to the `quotes` table by
+    `flush_stock_views()`, so that viewing a page does not write to the database.
+    """
+    global _pending_stock_views_since
+    with _pending_stock_views_lock:
+        _pending_stock_views.update(set(symbols))
+        if _pending_stock_views_since is None:
+            _pending_stock_views_since = datetime.now()
+
+
+def flush_stock_views(max_age: float = 0.0) -> bool:
+    """Write the buffered views to the `quotes` table if the oldest one was recorded over `max_age` seconds ago
+
+    The views are written with a single (executemany) UPDATE statement. Returns
+    True if views were written, so the session needs to be committed.
+    """
+    global _pending_stock_views_since
+    with _pending_stock_views_lock:
+        if (_pending_stock_views_since is None or
+                datetime.now() - _pending_stock_views_since < timedelta(seconds=max_age)):
+            return False
+        views = [{'symbol': symbol, 'views': count} for symbol, count in _pending_stock_views.items()]
+        _pending_stock_views.clear()
+        _pending_stock_views_since = None
+
+    quotes = Quote.__table__
+    database.session.execute(
+        database.update(quotes)
+        .where(quotes.c.stock_symbol == database.bindparam('symbol'))
+        .values(view_count=database.func.coalesce(quotes.c.view_count, 0) + database.bindparam('views'),
+                last_viewed_on=datetime.now()),
+        views
+    )
+    return True
+
+
+def get_symbols_to_refresh(limit: int) -> list:
+    """Return up to `limit` held stock symbols whose quote is stale, most popular first
+
+    The popularity of a symbol is the number of users holding it plus its view
+    count, where the views decay by half every REFRESH_VIEWS_HALF_LIFE hours
+    since the symbol was last viewed.
+    """
+    query = (database.select(Stock.stock_symbol,
+                             database.func.count(database.distinct(Stock.user_id)),
+                             Quote.view_count,
+                             Quote.last_viewed_on,
+                             Quote.updated_on)
+             .outerjoin(Quote, Quote.stock_symbol == Stock.stock_symbol)
+             .group_by(Stock.stock_symbol, Quote.view_count, Quote.last_viewed_on, Quote.updated_on))
+
+    now = datetime.now()
+    max_age = timedelta(seconds=current_app.config['QUOTE_CACHE_TTL'])
+    half_life = current_app.config['REFRESH_VIEWS_HALF_LIFE']
+    candidates = []
+    for symbol, holders, view_count, last_viewed_on, updated_on in database.session.execute(query):
+        if updated_on is not None and now - updated_on < max_age:
+            continue
+
+        score = float(holders)
+        if view_count and last_viewed_on is not None:
+            hours_since_viewed = (now - last_viewed_on).total_seconds() / 3600
+            score += view_count * 0.5 ** (hours_since_viewed / half_life)
+        candidates.append((score, symbol))
+
+    candidates.sort(key=lambda candidate: (-candidate[0], candidate[1]))
+    return [symbol for _, symbol in candidates[:limit]]
+
+
+def get_symbols_to_write_back() -> list:
+    """Return the held stock symbols whose quote is fresh but with positions whose price is stale
+
+    The quote of a symbol can be refreshed without writing back the positions of
+    every user (such as by a page view), so these positions are written back
+    from the stored quote, without calling the provider.
+    """
+    now = datetime.now()
+    start_of_day = datetime.combine(now.date(), datetime.min.time())
+    max_age = timedelta(seconds=current_app.config['QUOTE_CACHE_TTL'])
+    query = (database.select(Stock.stock_symbol)
+             .join(Quote, Quote.stock_symbol == Stock.stock_symbol)
+             .where(Quote.updated_on > now - max_age,
+                    database.or_(Stock.current_price_date.is_(None), Stock.current_price_date < start_of_day))
+             .distinct()
+             .order_by(Stock.stock_symbol))
+    return database.session.execute(query).scalars().all()
+
+def write_back_stock_prices(prices: dict, batch_size: int = 500, user_id: int = None) -> list:
+    """Update the current price of the positions on each stock symbol in `prices`
+
+    Only the positions of `user_id` are written, unless it is None (the positions
+    of every user, as written by the refresh daemon). The positions are written
+    with one UPDATE statement per `batch_size` symbols, and only the positions
+    whose price changed (or is from a previous day) are written. The account
+    totals of the users holding these positions are updated as well. Returns the
+    IDs of these users (empty if nothing was written).
+    """
+    now = datetime.now()
+    start_of_day = datetime.combine(now.date(), datetime.min.time())
+    prices_cents = {symbol: int(price * 100) for symbol, price in prices.items() if price > 0.0}
+    symbols = sorted(prices_cents)
+
+    user_ids = set()
+    for index in range(0, len(symbols), batch_size):
+        batch_prices = {symbol: prices_cents[symbol] for symbol in symbols[index:index + batch_size]}
+        new_price = database.case(batch_prices, value=Stock.stock_symbol)
+        is_changed = database.and_(Stock.stock_symbol.in_(batch_prices),
+                                   database.or_(Stock.current_price.is_distinct_from(new_price),
+                                                Stock.current_price_date.is_(None),
+                                                Stock.current_price_date < start_of_day))
+        if user_id is not None:
+            is_changed = database.and_(is_changed, Stock.user_id == user_id)
+
+        query = database.select(Stock.user_id).where(is_changed).distinct()
+        changed_user_ids = database.session.execute(query).scalars().all()
+        if not changed_user_ids:
+            continue
+        database.session.execute(
+            database.update(Stock)
+            .where(is_changed)
+            .values(current_price=new_price,
+                    current_price_date=now,
+                    position_value=new_price * Stock.number_of_shares)
+            .execution_options(synchronize_session=False)
+        )
+        user_ids.update(changed_user_id for changed_user_id in changed_user_ids if changed_user_id is not None)
+
+    user_ids = sorted(user_ids)
+    for index in range(0, len(user_ids), batch_size):
+        refresh_account_totals(user_ids[index:index + batch_size])
+    return user_ids
+
+
+def refresh_account_totals(user_ids):
+    """Re-compute the materialized totals of the users in `user_ids` (list or SELECT of user IDs)
+
+    The totals are aggregated in the database, without loading the positions, and
+    written with an upsert so that two transactions refreshing the same user at the
+    same time do not collide on the primary key.
+    """
+    insert = dialect_insert(AccountTotal).from_select(
+        ['user_id', 'total_value', 'total_cost', 'number_of_positions', 'updated_on'],
+        database.select(Stock.user_id,
+                        database.func.coalesce(database.func.sum(Stock.position_value), 0),
+                        database.func.sum(Stock.purchase_price * Stock.number_of_shares),
+                        database.func.count(Stock.id),
+                        database.literal(datetime.now()))
+        .where(Stock.user_id.in_(user_ids))
+        .group_by(Stock.user_id)
+    )
+    database.session.execute(insert.on_conflict_do_update(
+        index_elements=[AccountTotal.user_id],
+        set_={column: insert.excluded[column]
+              for column in ['total_value', 'total_cost', 'number_of_positions', 'updated_on']}
+    ))
+
+    # Users without any position left have no totals
+    database.session.execute(
+        database.delete(AccountTotal)
+        .where(AccountTotal.user_id.in_(user_ids),
+               AccountTotal.user_id.not_in(database.select(Stock.user_id).where(Stock.user_id.is_not(None))))
+        .execution_options(synchronize_session=False)
     )
 
 
-def get_current_stock_price(symbol: str) -> float:
-    url = create_alpha_vantage_url_quote(symbol)
+def get_account_total(user_id: int):
+    """Return the materialized totals of a user, computing them if they are missing"""
+    account_total = database.session.get(AccountTotal, user_id)
+    if account_total is None:
+        refresh_account_totals([user_id])
+        account_total = database.session.get(AccountTotal, user_id)
+    return account_total
+
+
+def get_portfolio_total(user_id: int) -> tuple:
+    """Return the number of positions and the total value (in cents) of the portfolio of a user
+
+    The totals are aggregated in the database, without loading the positions.
+    """
+    query = database.select(database.func.count(Stock.id),
+                            database.func.coalesce(database.func.sum(Stock.position_value), 0)
+                            ).where(Stock.user_id == user_id)
+    number_of_positions, total_value = database.session.execute(query).one()
+    return number_of_positions, total_value
+
+
+def get_position_values_by_symbol(user_id: int) -> list:
+    """Return the (symbol, number of shares, position value in cents) of each stock symbol of a user"""
+    query = (database.select(Stock.stock_symbol,
+                             database.func.sum(Stock.number_of_shares),
+                             database.func.coalesce(database.func.sum(Stock.position_value), 0))
+             .where(Stock.user_id == user_id)
+             .group_by(Stock.stock_symbol)
+             .order_by(Stock.stock_symbol))
+    return [tuple(row) for row in database.session.execute(query)]
+
+
+def is_price_history_current(latest_date: date, earliest_date: date, start_date: date,
+                             history_since: date = None) -> bool:
+    """Check if the stored weeks cover `start_date` until this week
+
+    `history_since` is the earliest date the weeks were requested from for the
+    symbol: the provider has no weeks before the first stored week, so the start
+    is covered if the weeks were requested from `start_date` (or earlier).
+    """
+    if latest_date is None:
+        return False
+    is_latest_week_stale = latest_date <= datetime.now().date() - timedelta(weeks=1)
+    is_start_covered = (earliest_date <= start_date + timedelta(weeks=1) or
+                        (history_since is not None and history_since <= start_date))
+    return not is_latest_week_stale and is_start_covered
+
+
+def get_price_history_since(symbol: str):
+    """Return a scalar subquery of the earliest date the weeks of `symbol` were requested from"""
+    return database.select(Quote.price_history_since).where(Quote.stock_symbol == symbol).scalar_subquery()
+
+
+def record_price_history_since(symbol: str, start_date: date):
+    """Record that the weeks of `symbol` were requested from the provider from `start_date`"""
+    history_since = database.case((Quote.price_history_since <= start_date, Quote.price_history_since),
+                                  else_=start_date)
+    database.session.execute(
+        dialect_insert(Quote)
+        .values(stock_symbol=symbol, price=0, view_count=0, price_history_since=start_date)
+        .on_conflict_do_update(index_elements=[Quote.stock_symbol], set_={'price_history_since': history_since})
+    )
+
+
+def sync_weekly_price_history(symbol: str, start_date: date) -> bool:
+    """Make sure the price history store covers `symbol` from `start_date` until this week
+
+    The provider is only called when the latest stored week is stale or when the
+    stored weeks do not go back far enough. Only the weeks that are not stored yet
+    are inserted; the latest stored week is re-written as it may have been a
+    partial week. Returns True if there is price history available for `symbol`.
+    """
+    query = database.select(database.func.max(PriceHistory.date),
+                            database.func.min(PriceHistory.date),
+                            get_price_history_since(symbol)).where(PriceHistory.stock_symbol == symbol)
+    latest_date, earliest_date, history_since = database.session.execute(query).one()
+
+    # Only the weeks after `stop_before` are retrieved from the provider: either the
+    # weeks since the start date or, if those are already stored, the latest weeks
+    if is_price_history_current(latest_date, earliest_date, start_date, history_since):
+        return True
+
+    stop_before = start_date
+    if latest_date is not None and (earliest_date <= start_date + timedelta(weeks=1) or
+                                    (history_since is not None and history_since <= start_date)):
+        stop_before = latest_date - timedelta(weeks=1)
+
+    try:
+        weekly_prices = current_app.extensions['market_data_provider'].get_weekly_prices(symbol, stop_before)
+    except ProviderUnavailable as e:
+        current_app.logger.warning(f'Market-data provider not called ({type(e).__name__}), skipped '
+                                   f'retrieving the weekly stock data ({symbol})!')
+        weekly_prices = None
+
+    if weekly_prices is None:
+        # Fall back to the stored prices (if any) when the provider is unavailable
+        return latest_date is not None
+
+    cutoff_date = None
+    if latest_date is not None:
+        cutoff_date = latest_date - timedelta(weeks=1)
+        database.session.execute(database.delete(PriceHistory).where(PriceHistory.stock_symbol == symbol,
+                                                                     PriceHistory.date > cutoff_date))
+
+    rows = []
+    for row in weekly_prices:
+        if cutoff_date is None or row['date'] > cutoff_date or row['date'] < earliest_date:
+            rows.append(dict(row, stock_symbol=symbol))
 
-    # Attempt the GET call to Alpha Vantage and check that a ConnectionError does
-    # not occur, which happens when the GET call fails due to a network issue
     try:
-        r = requests.get(url)
-    except requests.exceptions.ConnectionError:
-        current_app.logger.error(
-            f'Error! Network problem preventing retrieving the stock data ({symbol})!')
+        if rows:
+            database.session.execute(database.insert(PriceHistory), rows)
+        if stop_before == start_date:
+            # The provider has no weeks before the ones returned, even if they start after `start_date`
+            record_price_history_since(symbol, start_date)
+        database.session.commit()
+    except IntegrityError:
+        # Another request synchronized the same symbol concurrently
+        database.session.rollback()
+
+    current_app.logger.debug(f'Stored {len(rows)} weeks of price history ({symbol})!')
+    return True
+
+
+def get_portfolio_version(user_id: int):
+    """Return the (ETag, Last-Modified) version of the portfolio page of a user
+
+    The version is computed with a single aggregate query over the positions of
+    the user. Returns None if the price of any position is stale, as rendering
+    the page would then refresh the prices.
+    """
+    query = database.select(database.func.count(Stock.id),
+                            database.func.max(Stock.id),
+                            database.func.sum(Stock.position_value),
+                            database.func.count(Stock.current_price_date),
+                            database.func.min(Stock.current_price_date),
+                            database.func.max(Stock.current_price_date)).where(Stock.user_id == user_id)
+    count, max_id, total_value, priced_count, oldest_price_date, latest_price_date = \
+        database.session.execute(query).one()
+
+    if priced_count < count or (count > 0 and oldest_price_date.date() != datetime.now().date()):
+        return None
+
+    version = f'{user_id}:{count}:{max_id}:{total_value}:{latest_price_date}'
+    return hashlib.sha1(version.encode()).hexdigest(), latest_price_date
+
+
+def get_stock_details_version(stock, start_date: date):
+    """Return the (ETag, Last-Modified) version of the details page of a stock
+
+    Returns None if the price history of the stock would be synchronized with
+    the market-data provider when rendering the page.
+    """
+    query = database.select(database.func.max(PriceHistory.date),
+                            database.func.min(PriceHistory.date),
+                            database.func.count(PriceHistory.id).filter(PriceHistory.date > start_date),
+                            database.func.sum(PriceHistory.close_price).filter(PriceHistory.date > start_date),
+                            get_price_history_since(stock.stock_symbol)
+                            ).where(PriceHistory.stock_symbol == stock.stock_symbol)
+    latest_date, earliest_date, count, total_close_price, history_since = database.session.execute(query).one()
+
+    if not is_price_history_current(latest_date, earliest_date, start_date, history_since):
+        return None
+
+    version = (f'{stock.id}:{stock.user_id}:{stock.number_of_shares}:{stock.purchase_price}:{stock.purchase_date}:'
+               f'{start_date}:{latest_date}:{count}:{total_close_price}')
+    return hashlib.sha1(version.encode()).hexdigest(), datetime.combine(latest_date, datetime.min.time())
+
+
+def load_weekly_price_series(symbol: str, start_date: date) -> PriceSeries:
+    """Return the stored weekly closing prices of `symbol` after `start_date`"""
+    query = database.select(PriceHistory.date, PriceHistory.close_price).where(
+        PriceHistory.stock_symbol == symbol,
+        PriceHistory.date > start_date
+    ).order_by(PriceHistory.date)
+    return PriceSeries.from_rows(database.session.execute(query))
+
+
+class PriceHistory(database.Model):
+    """Weekly prices of a stock symbol, shared by all users (prices stored in cents)"""
+    __tablename__ = 'price_history'
+    __table_args__ = (UniqueConstraint('stock_symbol', 'date'),)
+
+    id = mapped_column(Integer(), primary_key=True)
+    stock_symbol = mapped_column(String(), nullable=False)
+    date = mapped_column(Date(), nullable=False)
+    open_price = mapped_column(Integer())
+    high_price = mapped_column(Integer())
+    low_price = mapped_column(Integer())
+    close_price = mapped_column(Integer())
+    adjusted_close_price = mapped_column(Integer())
+    volume = mapped_column(BigInteger())
 
-    # Status code returned from Alpha Vantage needs to be 200 (OK) to process stock data
-    if r.status_code != 200:
-        current_app.logger.warning(f'Error! Received unexpected status code ({r.status_code}) '
-                                   f'when retrieving daily stock data ({symbol})!')
-        return 0.0
+    def __repr__(self):
+        return f'<PriceHistory: {self.stock_symbol} {self.date}>'
 
-    stock_data = r.json()
 
-    # The key of 'Global Quote' needs to be present in order to process the stock data.
-    # Typically, this key will not be present if the API rate limit has been exceeded.
-    if 'Global Quote' not in stock_data:
-        current_app.logger.warning(f'Could not find the Global Quote key when retrieving '
-                                   f'the daily stock data ({symbol})!')
-        return 0.0
+class PortfolioSnapshot(database.Model):
+    """Daily snapshot of the positions of a user in a stock symbol (values in cents)
 
-    return float(stock_data['Global Quote']['05. price'])
+    Written by the `flask stocks snapshot` batch job.
+    """
+    __tablename__ = 'portfolio_snapshots'
+    __table_args__ = (UniqueConstraint('snapshot_date', 'user_id', 'stock_symbol'),
+                      Index('ix_portfolio_snapshots_user_id_snapshot_date', 'user_id', 'snapshot_date'))
+
+    id = mapped_column(Integer(), primary_key=True)
+    snapshot_date = mapped_column(Date(), nullable=False)
+    user_id = mapped_column(ForeignKey('users.id'), nullable=False)
+    stock_symbol = mapped_column(String(), nullable=False)
+    number_of_shares = mapped_column(BigInteger())
+    price = mapped_column(Integer())
+    position_value = mapped_column(BigInteger())
+    cost_basis = mapped_column(BigInteger())
+
+    def __repr__(self):
+        return f'<PortfolioSnapshot: {self.snapshot_date} user {self.user_id} {self.stock_symbol}>'
+
+
+class AccountTotal(database.Model):
+    """Materialized totals of the positions of a user (values in cents)
+
+    Kept up to date with `refresh_account_totals()` whenever the positions or
+    their prices change, so the totals can be read without loading the positions.
+    """
+    __tablename__ = 'account_totals'
+
+    user_id = mapped_column(ForeignKey('users.id'), primary_key=True)
+    total_value = mapped_column(BigInteger())
+    total_cost = mapped_column(BigInteger())
+    number_of_positions = mapped_column(Integer())
+    updated_on = mapped_column(DateTime())
+
+    def get_total_value(self) -> float:
+        return float(self.total_value / 100)
+
+    def __repr__(self):
+        return f'<AccountTotal: user {self.user_id} - ${self.total_value / 100}>'
+
+
+class Quote(database.Model):
+    """Latest known share price for a stock symbol, shared by all users"""
+    __tablename__ = 'quotes'
+
+    stock_symbol = mapped_column(String(), primary_key=True)
+    price = mapped_column(Integer())
+    updated_on = mapped_column(DateTime())
+    view_count = mapped_column(Integer(), default=0)
+    last_viewed_on = mapped_column(DateTime())
+    price_history_since = mapped_column(Date())
+
+    def __init__(self, stock_symbol: str):
+        self.stock_symbol = stock_symbol
+        self.price = 0
+        self.updated_on = None
+        self.view_count = 0
+        self.last_viewed_on = None
+        self.price_history_since = None
+
+    def get_price(self) -> float:
+        return float(self.price / 100)
+
+    def set_price(self, price: float):
+        self.price = int(price * 100)
+        self.updated_on = datetime.now()
+
+    def is_fresh(self, ttl: float) -> bool:
+        if self.updated_on is None or ttl <= 0:
+            return False
+        return datetime.now() - self.updated_on < timedelta(seconds=ttl)
+
+    def __repr__(self):
+        return f'<Quote: {self.stock_symbol} ${self.price / 100}>'
 
 
 class Stock(database.Model):
     __tablename__ = 'stocks'
+    # The portfolio of a user is read in ID order and the prices are written back per symbol
+    __table_args__ = (Index('ix_stocks_user_id_id', 'user_id', 'id'),
+                      Index('ix_stocks_stock_symbol', 'stock_symbol'))
 
     id = mapped_column(Integer(), primary_key=True)
     stock_symbol = mapped_column(String())
@@ -85,63 +681,41 @@ class Stock(database.Model):
     def get_stock_position_value(self) -> float:
         return float(self.position_value / 100)
 
-    def get_stock_data(self):
-        if self.current_price_date is None or self.current_price_date.date() != datetime.now().date():
-            current_price = get_current_stock_price(self.stock_symbol)
-            if current_price > 0.0:
-                self.current_price = int(current_price * 100)
-                self.current_price_date = datetime.now()
-                self.position_value = self.current_price * self.number_of_shares
-                current_app.logger.debug(f'Retrieved current price {self.current_price / 100} '
-                                         f'for the stock data ({self.stock_symbol})!')
-
-    def get_weekly_stock_data(self):
-        title = 'Stock chart is unavailable.'
-        labels = []
-        values = []
-        url = create_alpha_vantage_get_url_weekly(self.stock_symbol)
+    def is_price_stale(self) -> bool:
+        return self.current_price_date is None or self.current_price_date.date() != datetime.now().date()
 
-        try:
-            r = requests.get(url)
-        except requests.exceptions.ConnectionError:
-            current_app.logger.info(
-                f'Error! Network problem preventing retrieving the weekly stock data ({self.stock_symbol})!')
-
-        # Status code returned from Alpha Vantage needs to be 200 (OK) to process stock data
-        if r.status_code != 200:
-            current_app.logger.warning(f'Error! Received unexpected status code ({r.status_code}) '
-                                       f'when retrieving weekly stock data ({self.stock_symbol})!')
-            return title, '', ''
-
-        weekly_data = r.json()
-
-        # The key of 'Weekly Adjusted Time Series' needs to be present in order to process the stock data
-        # Typically, this key will not be present if the API rate limit has been exceeded.
-        if 'Weekly Adjusted Time Series' not in weekly_data:
-            current_app.logger.warning(f'Could not find the Weekly Adjusted Time Series key when retrieving '
-                                       f'the weekly stock data ({self.stock_symbol})!')
-            return title, '', ''
+    def update_current_price(self, current_price: float):
+        if current_price > 0.0:
+            self.current_price = int(current_price * 100)
+            self.current_price_date = datetime.now()
+            self.position_value = self.current_price * self.number_of_shares
+            current_app.logger.debug(f'Retrieved current price {self.current_price / 100} '
+                                     f'for the stock data ({self.stock_symbol})!')
 
-        title = f'Weekly Prices ({self.stock_symbol})'
+    def get_stock_data(self):
+        if self.is_price_stale():
+            self.update_current_price(get_current_stock_price(self.stock_symbol))
 
+    def get_chart_start_date(self) -> date:
         # Determine the start date as either:
         #   - If the start date is less than 12 weeks ago, then use the date from 12 weeks ago
         #   - Otherwise, use the purchase date
         start_date = self.purchase_date
         if (datetime.now() - self.purchase_date) < timedelta(weeks=12):
             start_date = datetime.now() - timedelta(weeks=12)
+        return start_date.date()
 
-        for element in weekly_data['Weekly Adjusted Time Series']:
-            date = datetime.fromisoformat(element)
-            if date.date() > start_date.date():
-                labels.append(date)
-                values.append(weekly_data['Weekly Adjusted Time Series'][element]['4. close'])
+    def get_weekly_stock_data(self):
+        title = 'Stock chart is unavailable.'
+        start_date = self.get_chart_start_date()
 
-        # Reverse the elements as the data from Alpha Vantage is read in latest to oldest
-        labels.reverse()
-        values.reverse()
+        # The weekly prices are read from the price history store, which is only
+        # synchronized with the market-data provider when the latest stored week is stale
+        if not sync_weekly_price_history(self.stock_symbol, start_date):
+            return title, PriceSeries()
 
-        return title, labels, values
+        title = f'Weekly Prices ({self.stock_symbol})'
+        return title, load_weekly_price_series(self.stock_symbol, start_date)
 
     def __repr__(self):
         return f'{self.stock_symbol} - {self.number_of_shares} shares purchased at ${self.purchase_price / 100}'
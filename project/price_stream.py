@@ -0,0 +1,103 @@
+"""
+Live stock prices pushed to the browsers with Server-Sent Events (`/stocks/stream`).
+
+Each symbol being watched is polled by a single background thread, whatever
+the number of connections watching it, and every price change is fanned out
+to the queue of each subscribed connection.
+"""
+import queue
+import threading
+
+
+class Subscription(object):
+    """Queue of the (symbol, price) updates for one connection"""
+
+    def __init__(self, hub, symbols):
+        self.hub = hub
+        self.symbols = set(symbols)
+        self.queue = queue.Queue()
+
+    def get(self, timeout: float = None):
+        """Return the next (symbol, price) update, or None if there is none within `timeout` seconds"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class PriceStreamHub(object):
+    """Fan-out of the prices polled by one thread per symbol to every subscription
+
+    `fetch_price(symbol)` is called every `interval` seconds for each symbol with
+    at least one subscription, and returns 0.0 if the price is not available.
+    The poller of a symbol stops once its last subscription is closed.
+    """
+
+    def __init__(self, fetch_price, interval: float = 60.0):
+        self.fetch_price = fetch_price
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+        self._prices = {}
+        self._pollers = {}
+        self._closed = threading.Event()
+
+    def subscribe(self, symbols) -> Subscription:
+        subscription = Subscription(self, symbols)
+        with self._lock:
+            for symbol in subscription.symbols:
+                self._subscriptions.setdefault(symbol, set()).add(subscription)
+
+                # Send the last polled price straight away instead of waiting for the next change
+                if symbol in self._prices:
+                    subscription.queue.put((symbol, self._prices[symbol]))
+
+                if symbol not in self._pollers:
+                    poller = threading.Thread(target=self._poll, args=(symbol,), daemon=True)
+                    self._pollers[symbol] = poller
+                    poller.start()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            for symbol in subscription.symbols:
+                subscriptions = self._subscriptions.get(symbol)
+                if subscriptions is not None:
+                    subscriptions.discard(subscription)
+                    if not subscriptions:
+                        del self._subscriptions[symbol]
+
+    def subscriber_count(self, symbol: str) -> int:
+        with self._lock:
+            return len(self._subscriptions.get(symbol, ()))
+
+    def close(self):
+        """Stop every poller (such as when the application shuts down)"""
+        self._closed.set()
+
+    def _poll(self, symbol: str):
+        while True:
+            with self._lock:
+                # Checked under the same lock as `subscribe()`, so a new subscription
+                # either keeps this poller running or starts a new one
+                if symbol not in self._subscriptions or self._closed.is_set():
+                    del self._pollers[symbol]
+                    self._prices.pop(symbol, None)
+                    return
+
+            try:
+                price = self.fetch_price(symbol)
+            except Exception:
+                # Keep polling: the provider may be available again on the next poll
+                price = 0.0
+
+            with self._lock:
+                if price > 0.0 and price != self._prices.get(symbol):
+                    self._prices[symbol] = price
+                    for subscription in self._subscriptions.get(symbol, ()):
+                        subscription.queue.put((symbol, price))
+
+            self._closed.wait(self.interval)
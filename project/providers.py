@@ -0,0 +1,440 @@
+"""
+Market-data providers used to retrieve the stock prices.
+
+The provider is selected with the MARKET_DATA_PROVIDER configuration variable:
+  - 'ALPHA_VANTAGE' - Alpha Vantage API (default)
+  - 'FAKE'          - Alpha Vantage responses generated locally (see `FakeClient`), for offline
+                      benchmarks and load tests of the gateway and the provider
+  - 'RECORD'        - Alpha Vantage API, recording every response to a cassette (saved after each response)
+  - 'REPLAY'        - responses recorded in a cassette, without any network call
+
+Every provider returns prices in dollars (floats) and weekly prices as a list of
+rows (newest week first) with the prices in cents, matching the `price_history` table.
+"""
+import gzip
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from datetime import date, datetime, timedelta
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from flask import current_app
+
+from project.http_client import MarketDataClient
+
+from project.streaming import parse_time_series
+
+
+class MarketDataProvider(object):
+    """Interface of a market-data provider
+
+    `get_quote()` returns 0.0 and `get_weekly_prices()` returns None when the
+    data is not available. Both may raise `ProviderUnavailable` when the call
+    budget for the provider is exhausted or the circuit breaker is open.
+    """
+    supports_bulk_quotes = False
+
+    def get_quote(self, symbol: str) -> float:
+        raise NotImplementedError
+
+    def get_quotes(self, symbols: list) -> dict:
+        """Return the current prices of multiple symbols (only if `supports_bulk_quotes`)"""
+        raise NotImplementedError
+
+    def get_weekly_prices(self, symbol: str, stop_before: date = None):
+        """Return the weekly prices newest week first
+
+        If `stop_before` is given, only the weeks after it plus the first week on
+        or before it are returned; otherwise the whole history is returned.
+        """
+        raise NotImplementedError
+
+
+# -------------
+# Alpha Vantage
+# -------------
+
+def create_alpha_vantage_url_quote(symbol: str) -> str:
+    return 'https://www.alphavantage.co/query?function={}&symbol={}&apikey={}'.format(
+        'GLOBAL_QUOTE',
+        symbol,
+        current_app.config['ALPHA_VANTAGE_API_KEY']
+    )
+
+
+def create_alpha_vantage_url_bulk_quotes(symbols: list) -> str:
+    return 'https://www.alphavantage.co/query?function={}&symbol={}&apikey={}'.format(
+        'REALTIME_BULK_QUOTES',
+        ','.join(symbols),
+        current_app.config['ALPHA_VANTAGE_API_KEY']
+    )
+
+
+def create_alpha_vantage_get_url_weekly(symbol: str) -> str:
+    return 'https://www.alphavantage.co/query?function={}&symbol={}&apikey={}'.format(
+        'TIME_SERIES_WEEKLY_ADJUSTED',
+        symbol,
+        current_app.config['ALPHA_VANTAGE_API_KEY']
+    )
+
+
+def create_price_history_row(week: date, prices: dict) -> dict:
+    def to_cents(key):
+        return round(float(prices[key]) * 100) if key in prices else None
+
+    return {
+        'date': week,
+        'open_price': to_cents('1. open'),
+        'high_price': to_cents('2. high'),
+        'low_price': to_cents('3. low'),
+        'close_price': to_cents('4. close'),
+        'adjusted_close_price': to_cents('5. adjusted close'),
+        'volume': int(prices['6. volume']) if '6. volume' in prices else None,
+    }
+
+
+class AlphaVantageProvider(MarketDataProvider):
+    def __init__(self, gateway, bulk_quotes: bool = False):
+        self.gateway = gateway
+        self.supports_bulk_quotes = bulk_quotes
+
+    def _fetch(self, function: str, symbol: str, url: str, consume=None, key: str = None):
+        """Send the GET call for `function` of `symbol` to Alpha Vantage (hook for the cassette providers)
+
+        If `consume` is given, the response is streamed and `consume(response)` is returned.
+        """
+        return self.gateway.get(url, consume=consume, key=key)
+
+    def _report_rate_limited(self):
+        # The replay provider has no gateway, as it does not call Alpha Vantage
+        if self.gateway is not None:
+            self.gateway.report_rate_limited()
+
+    def get_quote(self, symbol: str) -> float:
+        url = create_alpha_vantage_url_quote(symbol)
+
+        # Attempt the GET call to Alpha Vantage and check that a network error (connection
+        # failure, timeout or too many retries) does not occur
+        try:
+            r = self._fetch('GLOBAL_QUOTE', symbol, url)
+        except requests.exceptions.RequestException:
+            current_app.logger.error(
+                f'Error! Network problem preventing retrieving the stock data ({symbol})!')
+            return 0.0
+
+        # Status code returned from Alpha Vantage needs to be 200 (OK) to process stock data
+        if r.status_code != 200:
+            current_app.logger.warning(f'Error! Received unexpected status code ({r.status_code}) '
+                                       f'when retrieving daily stock data ({symbol})!')
+            return 0.0
+
+        stock_data = r.json()
+
+        # The key of 'Global Quote' needs to be present in order to process the stock data.
+        # Typically, this key will not be present if the API rate limit has been exceeded.
+        if 'Global Quote' not in stock_data:
+            current_app.logger.warning(f'Could not find the Global Quote key when retrieving '
+                                       f'the daily stock data ({symbol})!')
+            if 'Note' in stock_data or 'Information' in stock_data:
+                self._report_rate_limited()
+            return 0.0
+
+        return float(stock_data['Global Quote']['05. price'])
+
+    def get_quotes(self, symbols: list) -> dict:
+        """Retrieve the current share prices of up to 100 symbols with one call to Alpha Vantage"""
+        url = create_alpha_vantage_url_bulk_quotes(symbols)
+
+        try:
+            r = self._fetch('REALTIME_BULK_QUOTES', ','.join(symbols), url)
+        except requests.exceptions.RequestException:
+            current_app.logger.error(
+                f'Error! Network problem preventing retrieving the bulk stock quotes ({len(symbols)} symbols)!')
+            return {}
+
+        if r.status_code != 200:
+            current_app.logger.warning(f'Error! Received unexpected status code ({r.status_code}) '
+                                       f'when retrieving the bulk stock quotes ({len(symbols)} symbols)!')
+            return {}
+
+        bulk_data = r.json()
+
+        # The key of 'data' is not present if the bulk quote endpoint is not available
+        # for the API key (premium endpoint) or if the API rate limit has been exceeded
+        if 'data' not in bulk_data:
+            current_app.logger.warning(f'Could not find the data key when retrieving '
+                                       f'the bulk stock quotes ({len(symbols)} symbols)!')
+            if 'Note' in bulk_data:
+                self._report_rate_limited()
+            return {}
+
+        prices = {}
+        for element in bulk_data['data']:
+            try:
+                prices[element['symbol']] = float(element['close'])
+            except (KeyError, TypeError, ValueError):
+                continue
+        return prices
+
+    def get_weekly_prices(self, symbol: str, stop_before: date = None):
+        url = create_alpha_vantage_get_url_weekly(symbol)
+        stop_before = stop_before.isoformat() if stop_before is not None else None
+
+        def consume(r):
+            # Status code returned from Alpha Vantage needs to be 200 (OK) to process stock data
+            if r.status_code != 200:
+                return r.status_code, {}, None
+
+            # Parse the weeks as they are downloaded (newest first) and stop after `stop_before`
+            header, weeks = parse_time_series(r.iter_content(chunk_size=16384),
+                                              'Weekly Adjusted Time Series', stop_before)
+            return r.status_code, header, weeks
+
+        try:
+            status_code, header, weeks = self._fetch('TIME_SERIES_WEEKLY_ADJUSTED', symbol, url,
+                                                     consume=consume, key=f'{url}&stop_before={stop_before}')
+        except requests.exceptions.RequestException:
+            current_app.logger.info(
+                f'Error! Network problem preventing retrieving the weekly stock data ({symbol})!')
+            return None
+        except ValueError:
+            current_app.logger.warning(f'Error! Received invalid JSON when retrieving weekly stock data ({symbol})!')
+            return None
+
+        if status_code != 200:
+            current_app.logger.warning(f'Error! Received unexpected status code ({status_code}) '
+                                       f'when retrieving weekly stock data ({symbol})!')
+            return None
+
+        # The key of 'Weekly Adjusted Time Series' needs to be present in order to process the stock data
+        # Typically, this key will not be present if the API rate limit has been exceeded.
+        if weeks is None:
+            current_app.logger.warning(f'Could not find the Weekly Adjusted Time Series key when retrieving '
+                                       f'the weekly stock data ({symbol})!')
+            if 'Note' in header or 'Information' in header:
+                self._report_rate_limited()
+            return None
+
+        return [create_price_history_row(date.fromisoformat(element), prices) for element, prices in weeks]
+
+
+# ----------------------
+# Record/Replay Cassette
+# ----------------------
+
+class Cassette(object):
+    """On-disk store of Alpha Vantage responses keyed by function and symbol
+
+    The responses are stored as a single gzip-compressed JSON document.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._responses = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with gzip.open(path, 'rt', encoding='utf-8') as file:
+                self._responses = json.load(file)
+
+    @staticmethod
+    def key(function: str, symbol: str) -> str:
+        return f'{function}:{symbol}'
+
+    def get(self, function: str, symbol: str):
+        return self._responses.get(self.key(function, symbol))
+
+    def record(self, function: str, symbol: str, payload: dict):
+        with self._lock:
+            self._responses[self.key(function, symbol)] = payload
+
+    def save(self):
+        with self._lock:
+            # Write to a temporary file first so that a replay never reads a partial cassette
+            temporary_path = f'{self.path}.tmp'
+            with gzip.open(temporary_path, 'wt', encoding='utf-8') as file:
+                json.dump(self._responses, file, separators=(',', ':'))
+            os.replace(temporary_path, self.path)
+
+    def __len__(self):
+        return len(self._responses)
+
+
+class CassetteResponse(object):
+    """Response served from a cassette (or by the fake client), with the interface of `requests.Response`"""
+
+    def __init__(self, status_code: int, payload: dict):
+        self.status_code = status_code
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+    def iter_content(self, chunk_size: int = 1):
+        content = json.dumps(self.payload).encode('utf-8')
+        for index in range(0, len(content), chunk_size):
+            yield content[index:index + chunk_size]
+
+    def close(self):
+        pass
+
+
+class RecordingProvider(AlphaVantageProvider):
+    """Alpha Vantage provider recording every successful response to a cassette
+
+    With `save_each_response`, the cassette is written to disk after each
+    recorded response (as when the app runs in the 'RECORD' mode, which is never
+    stopped cleanly); otherwise it is only written when `Cassette.save()` is called.
+    """
+
+    def __init__(self, gateway, cassette: Cassette, bulk_quotes: bool = False, save_each_response: bool = False):
+        super().__init__(gateway, bulk_quotes)
+        self.cassette = cassette
+        self.save_each_response = save_each_response
+
+    def _fetch(self, function: str, symbol: str, url: str, consume=None, key: str = None):
+        # The whole response is downloaded (not streamed) so that it can be recorded
+        r = super()._fetch(function, symbol, url)
+        if r.status_code != 200:
+            return consume(CassetteResponse(r.status_code, {})) if consume is not None else r
+
+        payload = r.json()
+        # Do not overwrite a recorded response with a rate limit message (but record
+        # the rate limit message of a call that has no recorded response yet)
+        is_rate_limited = 'Note' in payload or 'Information' in payload
+        if not is_rate_limited or self.cassette.get(function, symbol) is None:
+            self.cassette.record(function, symbol, payload)
+            if self.save_each_response:
+                self.cassette.save()
+        return consume(CassetteResponse(r.status_code, payload)) if consume is not None else r
+
+
+class ReplayProvider(AlphaVantageProvider):
+    """Alpha Vantage provider serving the responses recorded in a cassette, without any network call
+
+    Requests that were not recorded are answered with a 404 (Not Found) response.
+    """
+
+    def __init__(self, cassette: Cassette):
+        super().__init__(gateway=None)
+        self.cassette = cassette
+
+    def _fetch(self, function: str, symbol: str, url: str, consume=None, key: str = None):
+        payload = self.cassette.get(function, symbol)
+        r = CassetteResponse(404, {}) if payload is None else CassetteResponse(200, payload)
+        return consume(r) if consume is not None else r
+
+
+# -------------
+# Fake Provider
+# -------------
+
+class FakeClient(object):
+    """Deterministic local stand-in for the HTTP client, answering the Alpha Vantage calls
+
+    The prices of a symbol only depend on the symbol and the date, so the same
+    data is returned across runs and processes. `error_rate` is the fraction of
+    calls that fail, drawn from a random generator seeded with `seed`: half of
+    them with a network error and the other half with a server error (503), as
+    the Alpha Vantage API would.
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, seed: int = 0, history_weeks: int = 1040):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.history_weeks = history_weeks
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(latency=config['MARKET_DATA_FAKE_LATENCY'],
+                   error_rate=config['MARKET_DATA_FAKE_ERROR_RATE'],
+                   seed=config['MARKET_DATA_FAKE_SEED'])
+
+    @staticmethod
+    def _price(symbol: str, day: date) -> float:
+        # Random walk seeded by the symbol, evaluated at the number of weeks since 2000-01-07
+        generator = random.Random(zlib.crc32(symbol.encode()))
+        price = generator.uniform(10.0, 500.0)
+        drift = generator.uniform(-0.001, 0.004)
+        week = (day - date(2000, 1, 7)).days // 7
+        noise = random.Random(zlib.crc32(f'{symbol}:{week}'.encode())).uniform(-0.05, 0.05)
+        return round(price * (1.0 + drift) ** week * (1.0 + noise), 2)
+
+    def get(self, url: str, **kwargs) -> CassetteResponse:
+        if self.latency > 0:
+            time.sleep(self.latency)
+        with self._lock:
+            draw = self._random.random()
+        if draw < self.error_rate / 2:
+            raise requests.exceptions.ConnectionError(f'Injected network error ({url})')
+        if draw < self.error_rate:
+            return CassetteResponse(503, {})
+
+        query = parse_qs(urlsplit(url).query)
+        function, symbol = query['function'][0], query['symbol'][0]
+        today = datetime.now().date()
+        if function == 'GLOBAL_QUOTE':
+            return CassetteResponse(200, {'Global Quote': {'01. symbol': symbol,
+                                                           '05. price': f'{self._price(symbol, today):.4f}'}})
+        if function == 'REALTIME_BULK_QUOTES':
+            return CassetteResponse(200, {'data': [{'symbol': element, 'close': f'{self._price(element, today):.4f}'}
+                                                   for element in symbol.split(',')]})
+        if function == 'TIME_SERIES_WEEKLY_ADJUSTED':
+            return CassetteResponse(200, self._weekly_payload(symbol, today))
+        return CassetteResponse(404, {})
+
+    def _weekly_payload(self, symbol: str, today: date) -> dict:
+        # Weekly prices are dated on Fridays, newest week first
+        friday = today - timedelta(days=(today.weekday() - 4) % 7)
+        weeks = {}
+        for week in range(self.history_weeks):
+            day = friday - timedelta(weeks=week)
+            close_price = f'{self._price(symbol, day):.4f}'
+            weeks[day.isoformat()] = {'1. open': close_price,
+                                      '2. high': close_price,
+                                      '3. low': close_price,
+                                      '4. close': close_price,
+                                      '5. adjusted close': close_price,
+                                      '6. volume': '1000000'}
+        return {'Meta Data': {'2. Symbol': symbol, '3. Last Refreshed': today.isoformat()},
+                'Weekly Adjusted Time Series': weeks}
+
+    def close(self):
+        pass
+
+
+class FakeProvider(AlphaVantageProvider):
+    """Alpha Vantage provider for a gateway calling a `FakeClient` instead of the network
+
+    Every call goes through the gateway (single-flight, call budget and circuit
+    breaker) and the responses are parsed as the Alpha Vantage ones, so offline
+    load tests exercise the same code as the Alpha Vantage provider.
+    """
+
+    def __init__(self, gateway):
+        super().__init__(gateway, bulk_quotes=True)
+
+
+def create_market_data_client(config):
+    """Return the HTTP client of the gateway: the fake client for the 'FAKE' provider, else the pooled client"""
+    if config['MARKET_DATA_PROVIDER'] == 'FAKE':
+        return FakeClient.from_config(config)
+    return MarketDataClient.from_config(config)
+
+
+def create_market_data_provider(config, gateway) -> MarketDataProvider:
+    if config['MARKET_DATA_PROVIDER'] == 'FAKE':
+        return FakeProvider(gateway)
+    if config['MARKET_DATA_PROVIDER'] == 'ALPHA_VANTAGE':
+        return AlphaVantageProvider(gateway, bulk_quotes=config['MARKET_DATA_BULK_QUOTES'])
+    if config['MARKET_DATA_PROVIDER'] == 'RECORD':
+        return RecordingProvider(gateway, Cassette(config['MARKET_DATA_CASSETTE']),
+                                 bulk_quotes=config['MARKET_DATA_BULK_QUOTES'], save_each_response=True)
+    if config['MARKET_DATA_PROVIDER'] == 'REPLAY':
+        return ReplayProvider(Cassette(config['MARKET_DATA_CASSETTE']))
+    raise ValueError(f"Unknown market-data provider: {config['MARKET_DATA_PROVIDER']}")
@@ -0,0 +1,114 @@
+"""
+Risk of the portfolios: covariance/correlation of the weekly returns of the
+symbols held, portfolio variance and risk contribution of each position.
+
+The weekly adjusted closing prices are loaded from the price history store and
+aligned on the same weeks (see `load_weekly_closes()`), and the covariance
+matrix is computed with NumPy matrix products. The matrix only depends on the
+symbols, so it is cached per (symbol set, date) in the 'risk_cache' extension
+and shared by every portfolio holding the same symbols.
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+from flask import current_app
+
+from project.analytics import WEEKS_PER_YEAR, load_weekly_closes
+from project.models import sync_weekly_price_history
+from project.valuation import load_positions, value_positions
+
+
+class CovarianceMatrix(object):
+    """Annualized covariance and correlation matrices of the weekly returns of `symbols`"""
+
+    def __init__(self, symbols: list, covariance: np.ndarray, correlation: np.ndarray, number_of_weeks: int):
+        self.symbols = symbols
+        self.covariance = covariance
+        self.correlation = correlation
+        self.number_of_weeks = number_of_weeks
+
+
+def compute_covariance_matrix(symbols: list, closes: np.ndarray) -> CovarianceMatrix:
+    """Compute the covariance matrix of the weekly returns of a (weeks x symbols) matrix of prices
+
+    Each covariance is computed over the weeks when both symbols have a return
+    (pairwise), so symbols with a shorter history do not shorten the others.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns = closes[1:] / closes[:-1] - 1.0
+    is_known = ~np.isnan(returns)
+    known = is_known.astype(float)
+
+    # Center each series on its mean and count the weeks when both series of each pair are known
+    counts = known.T @ known
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.nansum(returns, axis=0) / known.sum(axis=0)
+        centered = np.where(is_known, returns - means, 0.0)
+        covariance = (centered.T @ centered) / (counts - 1) * WEEKS_PER_YEAR
+    covariance[counts < 2] = np.nan
+
+    volatilities = np.sqrt(np.diag(covariance))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        correlation = np.clip(covariance / np.outer(volatilities, volatilities), -1.0, 1.0)
+    np.fill_diagonal(correlation, np.where(np.isnan(volatilities), np.nan, 1.0))
+    return CovarianceMatrix(symbols, covariance, correlation, len(returns))
+
+
+def get_covariance_matrix(symbols: list) -> CovarianceMatrix:
+    """Return the covariance matrix of `symbols` over the last RISK_LOOKBACK_WEEKS, cached per symbol set
+
+    On a cache miss, the price history of the symbols is synchronized first (the
+    provider is only called for the symbols whose stored weeks are not current).
+    """
+    symbols = sorted(set(symbols))
+    today = datetime.now().date()
+    risk_cache = current_app.extensions['risk_cache']
+    matrix = risk_cache.get((tuple(symbols), today))
+    if matrix is None:
+        start_date = today - timedelta(weeks=current_app.config['RISK_LOOKBACK_WEEKS'])
+        for symbol in symbols:
+            sync_weekly_price_history(symbol, start_date)
+        _, closes = load_weekly_closes(symbols, start_date, today)
+        matrix = compute_covariance_matrix(symbols, closes)
+        risk_cache.set((tuple(symbols), today), matrix)
+    return matrix
+
+
+class PortfolioRisk(object):
+    """Risk of a portfolio from the covariance matrix of its symbols and the weight of each symbol"""
+
+    def __init__(self, matrix: CovarianceMatrix, weights: np.ndarray):
+        self.matrix = matrix
+        self.weights = weights
+
+        # Missing covariances (not enough weeks of history) are left out of the variance
+        covariance = np.nan_to_num(matrix.covariance)
+        marginal_risks = covariance @ weights
+        self.variance = float(weights @ marginal_risks)
+        self.volatility = float(np.sqrt(self.variance)) if self.variance > 0 else 0.0
+        self.risk_contributions = (weights * marginal_risks / self.variance if self.variance > 0
+                                   else np.zeros(len(weights)))
+
+    @property
+    def symbols(self) -> list:
+        return self.matrix.symbols
+
+    def to_dict(self) -> dict:
+        def to_list(values):
+            return [None if np.isnan(value) else float(value) for value in values]
+
+        return {'symbols': self.symbols,
+                'weights': to_list(self.weights),
+                'correlation': [to_list(row) for row in self.matrix.correlation],
+                'variance': self.variance,
+                'volatility': self.volatility,
+                'risk_contributions': to_list(self.risk_contributions),
+                'number_of_weeks': self.matrix.number_of_weeks}
+
+
+def get_portfolio_risk(user_id: int) -> PortfolioRisk:
+    """Return the risk of the portfolio of a user, weighting each symbol by its position value"""
+    weights_by_symbol = value_positions(load_positions(user_id)).weights_by_symbol()
+    matrix = get_covariance_matrix(list(weights_by_symbol))
+    weights = np.array([weights_by_symbol[symbol] for symbol in matrix.symbols], dtype=float)
+    return PortfolioRisk(matrix, weights)
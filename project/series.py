@@ -0,0 +1,65 @@
+"""
+Compact representation of a price series, shared by the price history store,
+the stock details view and the chart endpoints.
+"""
+from array import array
+from bisect import bisect_right
+from datetime import date
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+class PriceSeries(object):
+    """Series of prices stored as two flat arrays
+
+    - `days` - dates as the number of days since 1970-01-01 (array of ints)
+    - `prices` - prices in cents (array of ints)
+
+    Storing the points in arrays instead of lists of `datetime`/`str` objects
+    avoids allocating Python objects per point until the series is serialized.
+    """
+    __slots__ = ('days', 'prices')
+
+    def __init__(self, days=(), prices=()):
+        self.days = array('l', days)
+        self.prices = array('q', prices)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Create a series from (date, price in cents) rows ordered by date"""
+        series = cls()
+        for day, price in rows:
+            series.append(day, price)
+        return series
+
+    def append(self, day: date, price: int):
+        self.days.append(day.toordinal() - EPOCH_ORDINAL)
+        self.prices.append(price)
+
+    def __len__(self):
+        return len(self.days)
+
+    def last_date(self) -> date:
+        return date.fromordinal(self.days[-1] + EPOCH_ORDINAL) if self.days else None
+
+    def dates(self) -> list:
+        return [date.fromordinal(day + EPOCH_ORDINAL) for day in self.days]
+
+    def values(self) -> list:
+        return [price / 100 for price in self.prices]
+
+    def until(self, end_date: date) -> 'PriceSeries':
+        """Return the points of the series until `end_date` (included)"""
+        end = bisect_right(self.days, end_date.toordinal() - EPOCH_ORDINAL)
+        return PriceSeries(self.days[:end], self.prices[:end])
+
+    def to_chartjs_json(self) -> str:
+        """Serialize the series to the labels (MM/DD/YYYY) and values (dollars) used by Chart.js"""
+        labels = ','.join([date.fromordinal(day + EPOCH_ORDINAL).strftime('"%m/%d/%Y"') for day in self.days])
+        values = ','.join(['%s%d.%02d' % ('-' if price < 0 else '', *divmod(abs(price), 100))
+                           for price in self.prices])
+        return f'{{"labels":[{labels}],"values":[{values}]}}'
+
+    def __repr__(self):
+        return f'<PriceSeries: {len(self)} points>'
+
@@ -0,0 +1,110 @@
+"""
+Daily snapshots of the portfolios (`portfolio_snapshots` table).
+
+The snapshots are written by the `flask stocks snapshot` batch job, which
+processes the users in chunks: the positions of each chunk of users are loaded
+with one query, valued in bulk with the valuation engine and written with one
+bulk insert, so that the memory used does not grow with the number of users.
+"""
+from datetime import date, datetime, timedelta
+
+from project import database
+from project.analytics import get_portfolio_value_history
+from project.models import PortfolioSnapshot, User
+from project.series import PriceSeries
+from project.valuation import load_positions, value_positions
+
+
+def take_portfolio_snapshots(snapshot_date: date, prices: dict, chunk_size: int = 1000) -> int:
+    """Write the snapshot of the positions of every user on `snapshot_date`
+
+    The positions are valued with `prices` (in cents, by symbol), or with their
+    stored current price for the symbols that are not in `prices`. Any snapshot
+    already written for the same date is replaced. Returns the number of rows written.
+    """
+    number_of_rows = 0
+    last_user_id = 0
+    while True:
+        query = database.select(User.id).where(User.id > last_user_id).order_by(User.id).limit(chunk_size)
+        user_ids = database.session.execute(query).scalars().all()
+        if not user_ids:
+            break
+        last_user_id = user_ids[-1]
+
+        valuation = value_positions(load_positions(user_id_range=(user_ids[0], user_ids[-1])), prices)
+        snapshot_user_ids, symbols, shares, position_values, cost_basis = valuation.totals_by_user_and_symbol()
+
+        database.session.execute(
+            database.delete(PortfolioSnapshot)
+            .where(PortfolioSnapshot.snapshot_date == snapshot_date,
+                   PortfolioSnapshot.user_id.between(user_ids[0], user_ids[-1]))
+        )
+        rows = [{'snapshot_date': snapshot_date,
+                 'user_id': user_id,
+                 'stock_symbol': symbol,
+                 'number_of_shares': number_of_shares,
+                 'price': position_value // number_of_shares if number_of_shares else 0,
+                 'position_value': position_value,
+                 'cost_basis': cost}
+                for user_id, symbol, number_of_shares, position_value, cost in zip(
+                    snapshot_user_ids.tolist(), symbols.tolist(), shares.tolist(),
+                    position_values.tolist(), cost_basis.tolist())]
+        if rows:
+            database.session.execute(database.insert(PortfolioSnapshot), rows)
+        database.session.commit()
+        number_of_rows += len(rows)
+
+    return number_of_rows
+
+
+def load_snapshot_series(user_id: int) -> PriceSeries:
+    """Return the daily total values (in cents) of the portfolio of a user from the snapshots"""
+    query = (database.select(PortfolioSnapshot.snapshot_date, database.func.sum(PortfolioSnapshot.position_value))
+             .where(PortfolioSnapshot.user_id == user_id)
+             .group_by(PortfolioSnapshot.snapshot_date)
+             .order_by(PortfolioSnapshot.snapshot_date))
+    return PriceSeries.from_rows(database.session.execute(query))
+
+
+def merge_snapshot_series(series: PriceSeries, snapshots: PriceSeries) -> PriceSeries:
+    """Combine weekly values computed from the price history with the daily snapshots
+
+    The snapshots are used for the days that have one, as they are the values
+    that were actually recorded; the weekly values are kept on the other days.
+    """
+    if len(snapshots) == 0:
+        return series
+
+    values_by_day = dict(zip(series.days, series.prices))
+    values_by_day.update(zip(snapshots.days, snapshots.prices))
+    days = sorted(values_by_day)
+    return PriceSeries(days, [values_by_day[day] for day in days])
+
+
+def get_uncovered_end_date(snapshots: PriceSeries, today: date):
+    """Return the last date of a week that is not covered by the snapshots (None for this week)
+
+    A week is covered when there is a snapshot in it. The weeks after the latest
+    gap of more than a week between two snapshots are covered, unless the last
+    snapshot is more than a week old.
+    """
+    if today - snapshots.last_date() >= timedelta(weeks=1):
+        return None
+
+    dates = snapshots.dates()
+    for previous_date, next_date in zip(reversed(dates[:-1]), reversed(dates[1:])):
+        if next_date - previous_date > timedelta(weeks=1):
+            return next_date - timedelta(days=1)
+    return dates[0] - timedelta(days=1)
+
+
+def get_portfolio_history_with_snapshots(user_id: int) -> PriceSeries:
+    """Return the values of the portfolio of a user: the daily snapshots, and the weekly
+    values computed from the price history for the weeks that the snapshots do not cover
+    """
+    snapshots = load_snapshot_series(user_id)
+    if len(snapshots) == 0:
+        return get_portfolio_value_history(user_id)
+
+    end_date = get_uncovered_end_date(snapshots, datetime.now().date())
+    return merge_snapshot_series(get_portfolio_value_history(user_id, end_date), snapshots)
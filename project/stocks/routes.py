@@ -1,14 +1,26 @@
-from datetime import datetime
+import json
+import time
+from datetime import date, datetime, timedelta
 
 from flask_login import login_required, current_user
 
 from . import stocks_blueprint
-from flask import current_app, render_template, request, session, flash, redirect, url_for
+from flask import abort, current_app, make_response, render_template, request, session, flash, redirect, url_for
 from pydantic import BaseModel, field_validator, ValidationError
 import click
+from werkzeug.http import is_resource_modified
 
 from .. import database
-from ..models import Stock
+from ..analytics import get_portfolio_analytics, invalidate_portfolio_analytics
+from ..gateway import ProviderGateway
+from ..providers import Cassette, RecordingProvider
+from ..risk import get_portfolio_risk
+from ..snapshots import get_portfolio_history_with_snapshots, take_portfolio_snapshots
+from ..valuation import load_positions, value_positions
+from ..models import (AccountTotal, Stock, flush_stock_views, get_account_total, get_current_stock_prices,
+                      get_portfolio_version, get_position_values_by_symbol,
+                      get_stock_details_version, get_symbols_to_refresh, get_symbols_to_write_back,
+                      record_stock_views, refresh_account_totals, schedule_price_refresh, write_back_stock_prices)
 
 
 class StockModel(BaseModel):
@@ -48,7 +60,9 @@ def add_stock():
                               current_user.id,
                               datetime.fromisoformat(request.form['purchase_date']))
             database.session.add(new_stock)
+            refresh_account_totals([current_user.id])
             database.session.commit()
+            invalidate_portfolio_analytics(current_user.id)
 
             flash(f"Added new stock ({stock_data.stock_symbol})!", 'success')
             current_app.logger.info(f"Added new stock ({request.form['stock_symbol']})!")
@@ -59,20 +73,202 @@ def add_stock():
     return render_template('stocks/add_stock.html')
 
 
+def is_not_modified(version) -> bool:
+    """Check if the page cached by the browser is still current (conditional GET)
+
+    Pages showing flashed messages are never considered as cached.
+    """
+    if version is None or '_flashes' in session:
+        return False
+    etag, last_modified = version
+    return not is_resource_modified(request.environ, etag=etag, last_modified=last_modified)
+
+
+def make_versioned_response(body, version, status=200):
+    """Create a response with the ETag and Last-Modified headers of `version` (if any)
+
+    The browser has to revalidate the page on each view, so that the page is
+    only sent again when it changed.
+    """
+    response = make_response(body, status)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    if version is not None:
+        response.set_etag(version[0])
+        response.last_modified = version[1]
+    return response
+
+
 @stocks_blueprint.route('/stocks')
 @login_required
 def list_stocks():
-    query = database.select(Stock).where(Stock.user_id == current_user.id).order_by(Stock.id)
+    # Short-circuit before loading the positions or calling the provider if the page did not change
+    version = get_portfolio_version(current_user.id)
+    if is_not_modified(version):
+        return make_versioned_response('', version, 304)
+    has_flashes = '_flashes' in session
+
+    # Keyset pagination: the page starts after the stock ID given by `after`, so that
+    # loading and rendering a page costs the same whatever the size of the portfolio
+    after = request.args.get('after', 0, type=int)
+    page_size = request.args.get('page_size', current_app.config['STOCKS_PAGE_SIZE'], type=int)
+    if page_size < 1:
+        abort(400)
+    page_size = min(page_size, current_app.config['STOCKS_MAX_PAGE_SIZE'])
+
+    # One more stock than the page size is loaded to know if there is a next page
+    query = (database.select(Stock)
+             .where(Stock.user_id == current_user.id, Stock.id > after)
+             .order_by(Stock.id)
+             .limit(page_size + 1))
     stocks = database.session.execute(query).scalars().all()
+    has_next_page = len(stocks) > page_size
+    stocks = stocks[:page_size]
+
+    # Stale-while-revalidate: stocks with a price that is stale but not older than the
+    # maximum staleness are rendered with their stored price (marked as stale) while
+    # their price is refreshed in the background for the next page load
+    stale_stocks = {stock for stock in stocks if stock.is_price_stale()}
+    revalidated_stocks = set()
+    if current_app.config['STOCKS_STALE_WHILE_REVALIDATE']:
+        oldest_price_date = datetime.now() - timedelta(seconds=current_app.config['STOCKS_MAX_STALENESS'])
+        revalidated_stocks = {stock for stock in stale_stocks
+                              if stock.current_price_date is not None and stock.current_price_date > oldest_price_date}
+        stale_stocks -= revalidated_stocks
+
+    # Fetch the quotes of the remaining stale stocks in one concurrent stage before rendering,
+    # and write them back in bulk (reloading the page only if a price was written)
+    prices = get_current_stock_prices(stock.stock_symbol for stock in stale_stocks)
+    is_modified = bool(write_back_stock_prices(prices, user_id=current_user.id))
+    if is_modified:
+        stocks = database.session.execute(query.execution_options(populate_existing=True)).scalars().all()[:page_size]
+
+    # The totals cover the whole portfolio, not only this page (materialized, so read without
+    # aggregating the positions; the write-back above refreshes them when a price changed)
+    is_total_missing = database.session.get(AccountTotal, current_user.id) is None
+    account_total = get_account_total(current_user.id)
+    is_modified = is_modified or (is_total_missing and account_total is not None)
+
+    # Read-only page views (all the prices are fresh) do not write to the database
+    record_stock_views(stock.stock_symbol for stock in stocks)
+    if flush_stock_views(current_app.config['STOCK_VIEWS_FLUSH_INTERVAL']) or is_modified:
+        database.session.commit()
+    # A stock is only marked as stale if its price was not refreshed with the other stale stocks
+    body = render_template('stocks/stocks.html', stocks=stocks,
+                           value=account_total.get_total_value() if account_total is not None else 0.0,
+                           number_of_positions=account_total.number_of_positions if account_total is not None else 0,
+                           stale_stock_ids={stock.id for stock in stocks
+                                            if stock in revalidated_stocks and stock.is_price_stale()},
+                           after=after, page_size=page_size,
+                           next_after=stocks[-1].id if has_next_page else None)
+    response = make_versioned_response(body, None if has_flashes else get_portfolio_version(current_user.id))
+
+    # The background refresh is only started once the page is rendered, so that the page
+    # shows the prices that were loaded (and marked as stale), not the refreshed ones
+    schedule_price_refresh((stock.stock_symbol for stock in revalidated_stocks), current_user.id)
+    return response
+
+
+@stocks_blueprint.route('/stocks/stream')
+@login_required
+def stream_stock_prices():
+    """Push the current share price of each stock of the user as Server-Sent Events
+
+    The prices are polled by the shared price stream hub (one poller per symbol,
+    whatever the number of connections), so an open connection costs no call
+    to the market-data provider of its own. An open connection holds a worker
+    though: the stream is closed after PRICE_STREAM_MAX_DURATION seconds (the
+    browser then reconnects), and the app should be served by a gevent (or
+    another asynchronous) worker so that the open pages do not starve the workers.
+    """
+    query = database.select(Stock.stock_symbol).where(Stock.user_id == current_user.id).distinct()
+    symbols = database.session.execute(query).scalars().all()
+    subscription = current_app.extensions['price_stream'].subscribe(symbols)
+    heartbeat = current_app.config['PRICE_STREAM_HEARTBEAT']
+    deadline = time.monotonic() + current_app.config['PRICE_STREAM_MAX_DURATION']
+    retry = int(current_app.config['PRICE_STREAM_RETRY'] * 1000)
+
+    def generate():
+        try:
+            # Reconnection delay (in milliseconds) of the browser once the stream is closed
+            yield f'retry: {retry}\n\n'
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                update = subscription.get(timeout=min(heartbeat, remaining))
+                if update is None:
+                    # Comment line keeping the connection open (and detecting closed connections)
+                    yield ': heartbeat\n\n'
+                else:
+                    symbol, price = update
+                    yield f'event: price\ndata: {json.dumps({"symbol": symbol, "price": price})}\n\n'
+        finally:
+            subscription.close()
+
+    return current_app.response_class(generate(), mimetype='text/event-stream',
+                                      headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@stocks_blueprint.route('/stocks/totals')
+@login_required
+def stock_totals():
+    """Return the totals of the portfolio (aggregated in the database, without loading the positions)"""
+    # The totals are only written (and committed) if they were missing
+    is_modified = database.session.get(AccountTotal, current_user.id) is None
+    account_total = get_account_total(current_user.id)
+    if is_modified and account_total is not None:
+        database.session.commit()
+    return {
+        'total_value': account_total.get_total_value() if account_total is not None else 0.0,
+        'number_of_positions': account_total.number_of_positions if account_total is not None else 0,
+        'symbols': [{'symbol': symbol, 'number_of_shares': number_of_shares, 'position_value': position_value / 100}
+                    for symbol, number_of_shares, position_value in get_position_values_by_symbol(current_user.id)]
+    }
+
+
+@stocks_blueprint.route('/stocks/analytics')
+@login_required
+def portfolio_analytics():
+    try:
+        as_of = date.fromisoformat(request.args['as_of']) if 'as_of' in request.args else None
+    except ValueError:
+        abort(400)
 
-    current_account_value = 0.0
-    for stock in stocks:
-        stock.get_stock_data()
-        database.session.add(stock)
-        current_account_value += stock.get_stock_position_value()
+    analytics = get_portfolio_analytics(current_user.id, as_of)
+    if request.args.get('format') == 'json':
+        return analytics.to_dict()
+    return render_template('stocks/analytics.html', analytics=analytics)
 
-    database.session.commit()
-    return render_template('stocks/stocks.html', stocks=stocks, value=round(current_account_value, 2))
+
+@stocks_blueprint.route('/stocks/risk')
+@login_required
+def portfolio_risk():
+    risk = get_portfolio_risk(current_user.id).to_dict()
+    if request.args.get('format') == 'json':
+        return risk
+    return render_template('stocks/risk.html', risk=risk)
+
+
+@stocks_blueprint.route('/stocks/history')
+@login_required
+def portfolio_history():
+    # The daily snapshots (if any) are used instead of the values computed from the price history
+    series = get_portfolio_history_with_snapshots(current_user.id)
+    return render_template('stocks/portfolio_history.html', chart_data=series.to_chartjs_json())
+
+
+@stocks_blueprint.route('/stocks/history/chart')
+@login_required
+def portfolio_history_chart():
+    series = get_portfolio_history_with_snapshots(current_user.id)
+    return current_app.response_class(series.to_chartjs_json(), mimetype='application/json')
+
+
+@stocks_blueprint.route('/quote_cache_stats')
+@login_required
+def quote_cache_stats():
+    return current_app.extensions['quote_cache'].stats()
 
 
 # ------------
@@ -102,6 +298,92 @@ def create(symbol, number_of_shares, purchase_price):
     database.session.commit()
 
 
+@stocks_blueprint.cli.command('value')
+@click.option('--user-id', type=int, default=None, help='Only value the positions of this user')
+def value(user_id):
+    """Print the total value, cost and gain of the positions of every user"""
+    valuation = value_positions(load_positions(user_id))
+    for user, total_value in valuation.totals_by_user().items():
+        click.echo(f'User {user}: ${total_value / 100:,.2f}')
+    click.echo(f'Total value: ${valuation.total_value / 100:,.2f} '
+               f'(cost: ${valuation.total_cost / 100:,.2f}, gain: ${valuation.total_gain / 100:,.2f})')
+
+
+@stocks_blueprint.cli.command('snapshot')
+@click.option('--date', 'snapshot_date', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Date of the snapshot (default: today)')
+@click.option('--chunk-size', default=1000, help='Number of users processed per query/insert')
+@click.option('--stored-prices', is_flag=True, help='Use the stored prices instead of retrieving the current prices')
+def snapshot(snapshot_date, chunk_size, stored_prices):
+    """Write the daily snapshot of the positions of every user"""
+    snapshot_date = (snapshot_date or datetime.now()).date()
+
+    # Retrieve the current prices of every held symbol in one batch (quote caches and bulk quotes first)
+    prices = {}
+    if not stored_prices:
+        symbols = database.session.execute(database.select(Stock.stock_symbol).distinct()).scalars().all()
+        prices = {symbol: int(price * 100) for symbol, price in get_current_stock_prices(symbols).items()
+                  if price > 0.0}
+        database.session.commit()
+
+    number_of_rows = take_portfolio_snapshots(snapshot_date, prices, chunk_size)
+    current_app.logger.info(f'Wrote {number_of_rows} portfolio snapshot rows for {snapshot_date}!')
+    click.echo(f'Wrote {number_of_rows} portfolio snapshot rows for {snapshot_date}.')
+
+
+@stocks_blueprint.cli.command('refresh-daemon')
+@click.option('--interval', default=60.0, help='Number of seconds between two refresh cycles')
+@click.option('--once', is_flag=True, help='Run a single refresh cycle and exit')
+def refresh_daemon(interval, once):
+    """Keep the prices of the stocks held by all users fresh in the background"""
+    # Stay inside the share of the Alpha Vantage call budget given to the daemon
+    calls_per_cycle = max(int(current_app.config['REFRESH_DAEMON_CALLS_PER_MINUTE'] * interval / 60), 1)
+
+    # Each bulk quote call refreshes up to MARKET_DATA_BULK_QUOTE_SIZE symbols
+    symbols_per_cycle = calls_per_cycle
+    if current_app.extensions['market_data_provider'].supports_bulk_quotes:
+        symbols_per_cycle *= current_app.config['MARKET_DATA_BULK_QUOTE_SIZE']
+
+    while True:
+        if flush_stock_views():
+            database.session.commit()
+        # The positions on symbols with a fresh quote are written back without calling the provider
+        symbols = get_symbols_to_refresh(symbols_per_cycle)
+        symbols += [symbol for symbol in get_symbols_to_write_back() if symbol not in symbols]
+        if symbols:
+            prices = get_current_stock_prices(symbols)
+            write_back_stock_prices(prices)
+            database.session.commit()
+            current_app.logger.info(f'Refreshed the prices of {len(symbols)} stocks: {", ".join(symbols)}')
+
+        if once:
+            break
+        time.sleep(interval)
+
+
+@stocks_blueprint.cli.command('record-cassette')
+@click.option('--path', default=None, help='Cassette file (defaults to MARKET_DATA_CASSETTE)')
+def record_cassette(path):
+    """Record the Alpha Vantage responses for all the stocks in the database"""
+    query = database.select(Stock.stock_symbol).distinct().order_by(Stock.stock_symbol)
+    symbols = database.session.execute(query).scalars().all()
+
+    # Wait for the call budget instead of skipping calls, as the recording runs offline
+    cassette = Cassette(path or current_app.config['MARKET_DATA_CASSETTE'])
+    gateway = ProviderGateway(current_app.extensions['market_data_client'],
+                              calls_per_minute=current_app.config['MARKET_DATA_CALLS_PER_MINUTE'],
+                              burst=current_app.config['MARKET_DATA_BURST'],
+                              max_wait=120.0)
+    provider = RecordingProvider(gateway, cassette)
+    for symbol in symbols:
+        provider.get_quote(symbol)
+        provider.get_weekly_prices(symbol)
+        click.echo(f'Recorded the responses for {symbol}')
+
+    cassette.save()
+    click.echo(f'Saved {len(cassette)} responses to {cassette.path}')
+
+
 # DEMO CHART - to learn basic usage
 @stocks_blueprint.route("/chartjs_demo1")
 def chartjs_demo1():
@@ -147,5 +429,34 @@ def stock_details(id):
     if stock.user_id != current_user.id:
         abort(403)
 
-    title, labels, values = stock.get_weekly_stock_data()
-    return render_template('stocks/stock_details.html', stock=stock, title=title, labels=labels, values=values)
+    # Short-circuit before reading the price history or calling the provider if the page did not change
+    start_date = stock.get_chart_start_date()
+    version = get_stock_details_version(stock, start_date)
+    if is_not_modified(version):
+        return make_versioned_response('', version, 304)
+    has_flashes = '_flashes' in session
+
+    title, series = stock.get_weekly_stock_data()
+    # The price history is committed when it is synchronized, so only flushed views need a commit
+    record_stock_views([stock.stock_symbol])
+    if flush_stock_views(current_app.config['STOCK_VIEWS_FLUSH_INTERVAL']):
+        database.session.commit()
+    body = render_template('stocks/stock_details.html', stock=stock, title=title,
+                           chart_data=series.to_chartjs_json())
+    return make_versioned_response(body, None if has_flashes else get_stock_details_version(stock, start_date))
+
+
+@stocks_blueprint.route('/stocks/<id>/chart')
+@login_required
+def stock_chart(id):
+    query = database.select(Stock).where(Stock.id == id)
+    stock = database.session.execute(query).scalar_one_or_none()
+
+    if stock is None:
+        abort(404)
+
+    if stock.user_id != current_user.id:
+        abort(403)
+
+    _, series = stock.get_weekly_stock_data()
+    return current_app.response_class(series.to_chartjs_json(), mimetype='application/json')
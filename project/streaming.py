@@ -0,0 +1,123 @@
+"""
+Streaming parser for the time series returned by Alpha Vantage.
+
+The time series documents hold 20+ years of data, ordered newest first, while
+usually only the last few months are needed. The parser reads the HTTP response
+in chunks and stops as soon as it passes the requested date, so the whole
+document is never downloaded, decoded or materialized.
+"""
+import codecs
+import json
+
+_decoder = json.JSONDecoder()
+
+
+class _StreamReader(object):
+    """Incremental reader of a JSON document split into byte chunks"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.position = 0
+        self.exhausted = False
+
+    def _read_more(self) -> bool:
+        if self.exhausted:
+            return False
+
+        try:
+            text = self._text_decoder.decode(next(self._chunks))
+        except StopIteration:
+            text = self._text_decoder.decode(b'', final=True)
+            self.exhausted = True
+
+        # Drop the part of the buffer that has already been parsed
+        self.buffer = self.buffer[self.position:] + text
+        self.position = 0
+        return True
+
+    def peek(self) -> str:
+        """Return the next non-whitespace character (without consuming it)"""
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in ' \t\r\n':
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._read_more():
+                raise ValueError('Unexpected end of the JSON document')
+
+    def expect(self, character: str):
+        if self.peek() != character:
+            raise ValueError(f'Expected "{character}" at position {self.position} of the JSON document')
+        self.position += 1
+
+    def skip(self, character: str) -> bool:
+        if self.peek() == character:
+            self.position += 1
+            return True
+        return False
+
+    def value(self):
+        """Decode the next JSON value, reading more chunks until it is complete"""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.position)
+                # A value ending at the end of the buffer (such as a number) may continue in the next chunk
+                if end < len(self.buffer) or self.exhausted:
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.exhausted:
+                    raise
+            self._read_more()
+
+
+def _iter_series(reader: _StreamReader, stop_before: str):
+    reader.expect('{')
+    if reader.skip('}'):
+        return
+
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        value = reader.value()
+        yield key, value
+
+        # The dates are in ISO format, so they can be compared as strings
+        if stop_before is not None and key <= stop_before:
+            return
+
+        if not reader.skip(','):
+            reader.expect('}')
+            return
+
+
+def parse_time_series(chunks, series_key: str, stop_before: str = None):
+    """Parse the time series `series_key` of a JSON document streamed as byte chunks
+
+    Returns a tuple of:
+      - dictionary of the other top-level keys parsed before the time series
+        (all the top-level keys if the time series is not found)
+      - list of (date, values) of the time series newer than `stop_before` plus
+        the first one on or before it, or None if the time series is not found
+
+    The remaining chunks are not read once the time series passes `stop_before`.
+    """
+    reader = _StreamReader(chunks)
+    header = {}
+    reader.expect('{')
+    if reader.skip('}'):
+        return header, None
+
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key == series_key:
+            return header, list(_iter_series(reader, stop_before))
+
+        header[key] = reader.value()
+        if not reader.skip(','):
+            reader.expect('}')
+            return header, None
@@ -0,0 +1,137 @@
+"""
+Portfolio valuation engine.
+
+The positions (lots) are loaded as columnar arrays instead of ORM objects and
+valued with NumPy in a single pass, so that valuing a portfolio of tens of
+thousands of lots (or the positions of every user in a batch job) costs a few
+array operations instead of a Python loop per lot.
+
+All the prices and values are in cents, matching the database.
+"""
+import numpy as np
+
+from project import database
+from project.models import Stock
+
+
+class Positions(object):
+    """Positions stored as columnar arrays (one element per lot)
+
+    - `ids` - IDs of the stocks
+    - `user_ids` - IDs of the users holding the lots
+    - `symbols` - unique stock symbols (sorted)
+    - `symbol_ids` - index of the symbol of each lot in `symbols`
+    - `shares` - number of shares
+    - `purchase_prices` - purchase price per share in cents
+    - `current_prices` - stored current price per share in cents
+    """
+
+    def __init__(self, ids, user_ids, symbols, shares, purchase_prices, current_prices):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)
+        self.symbols, self.symbol_ids = np.unique(np.asarray(symbols, dtype=str), return_inverse=True)
+        self.shares = np.asarray(shares, dtype=np.int64)
+        self.purchase_prices = np.asarray(purchase_prices, dtype=np.int64)
+        self.current_prices = np.asarray(current_prices, dtype=np.int64)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Create the positions from (id, user ID, symbol, shares, purchase price, current price) rows"""
+        columns = list(zip(*rows)) or [()] * 6
+        return cls(*columns)
+
+    @classmethod
+    def from_stocks(cls, stocks):
+        """Create the positions from `Stock` objects that are already loaded"""
+        return cls.from_rows((stock.id, stock.user_id, stock.stock_symbol, stock.number_of_shares,
+                              stock.purchase_price, stock.current_price or 0) for stock in stocks)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __repr__(self):
+        return f'<Positions: {len(self)} lots of {len(self.symbols)} symbols>'
+
+
+def load_positions(user_id: int = None, user_id_range: tuple = None) -> Positions:
+    """Load the positions of a user (or of every user) without creating ORM objects
+
+    `user_id_range` limits the positions to the users with an ID between its
+    first and last elements (included), such as to process the users in chunks.
+    """
+    query = database.select(Stock.id, Stock.user_id, Stock.stock_symbol, Stock.number_of_shares,
+                            Stock.purchase_price, database.func.coalesce(Stock.current_price, 0)).order_by(Stock.id)
+    if user_id is not None:
+        query = query.where(Stock.user_id == user_id)
+    if user_id_range is not None:
+        query = query.where(Stock.user_id.between(*user_id_range))
+    return Positions.from_rows(database.session.execute(query))
+
+
+class Valuation(object):
+    """Values of the positions (in cents) with their gains and weights in the portfolio"""
+
+    def __init__(self, positions: Positions, prices):
+        self.positions = positions
+        self.prices = prices
+        self.position_values = positions.shares * prices
+        self.cost_basis = positions.shares * positions.purchase_prices
+        self.gains = self.position_values - self.cost_basis
+        self.total_value = int(self.position_values.sum())
+        self.total_cost = int(self.cost_basis.sum())
+        self.total_gain = self.total_value - self.total_cost
+        self.weights = (self.position_values / self.total_value if self.total_value
+                        else np.zeros(len(positions)))
+
+    @property
+    def gain_percentages(self):
+        """Gain of each position relative to its cost basis (0.0 for a position without cost)"""
+        return np.divide(self.gains * 100.0, self.cost_basis,
+                         out=np.zeros(len(self.positions)), where=self.cost_basis != 0)
+
+    def totals_by_user(self) -> dict:
+        """Return the total value (in cents) of the positions of each user"""
+        user_ids, index = np.unique(self.positions.user_ids, return_inverse=True)
+        totals = np.bincount(index, weights=self.position_values, minlength=len(user_ids))
+        return {int(user_id): int(total) for user_id, total in zip(user_ids, totals)}
+
+    def weights_by_symbol(self) -> dict:
+        """Return the weight of each symbol in the portfolio (sum of the weights of its lots)"""
+        weights = np.bincount(self.positions.symbol_ids, weights=self.weights, minlength=len(self.positions.symbols))
+        return {str(symbol): float(weight) for symbol, weight in zip(self.positions.symbols, weights)}
+
+    def totals_by_user_and_symbol(self):
+        """Aggregate the lots by (user, symbol)
+
+        Returns the arrays of the user IDs, symbols, number of shares, position
+        values and cost basis (in cents) of each (user, symbol).
+        """
+        positions = self.positions
+        keys = positions.user_ids * len(positions.symbols) + positions.symbol_ids
+        unique_keys, index = np.unique(keys, return_inverse=True)
+
+        def total(values):
+            totals = np.zeros(len(unique_keys), dtype=np.int64)
+            np.add.at(totals, index, values)
+            return totals
+
+        return (unique_keys // max(len(positions.symbols), 1),
+                positions.symbols[unique_keys % max(len(positions.symbols), 1)],
+                total(positions.shares),
+                total(self.position_values),
+                total(self.cost_basis))
+
+
+def value_positions(positions: Positions, prices: dict = None) -> Valuation:
+    """Value the positions with the prices (in cents) of `prices`
+
+    Each lot is valued with the price of its symbol in `prices`, or with its
+    stored current price if the symbol is not in `prices` (or is not priced).
+    """
+    lot_prices = positions.current_prices
+    if prices:
+        # Price vector indexed by symbol ID, joined with the lots through `symbol_ids`
+        price_vector = np.array([prices.get(symbol, 0) for symbol in positions.symbols.tolist()], dtype=np.int64)
+        joined_prices = price_vector[positions.symbol_ids]
+        lot_prices = np.where(joined_prices > 0, joined_prices, lot_prices)
+    return Valuation(positions, lot_prices)
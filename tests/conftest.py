@@ -1,3 +1,4 @@
+import json
 import os
 from datetime import datetime
 
@@ -6,7 +7,7 @@ import requests
 from flask import current_app
 
 from project import create_app, database
-from project.models import Stock, User
+from project.models import PriceHistory, Quote, Stock, User
 
 
 @pytest.fixture(scope='function')
@@ -128,6 +129,15 @@ def add_stocks_for_default_user(test_client, log_in_default_user):
     return
 
 
+@pytest.fixture(scope='function')
+def clear_price_history():
+    # Remove the stored weekly prices so that the data is retrieved from Alpha Vantage
+    database.session.execute(database.delete(PriceHistory))
+    database.session.execute(database.update(Quote).values(price_history_since=None))
+    database.session.commit()
+    return
+
+
 # --------------
 # Helper Classes
 # --------------
@@ -156,6 +166,9 @@ class MockFailedResponse(object):
     def json(self):
         return {'error': 'bad'}
 
+    def close(self):
+        pass
+
 
 class MockSuccessResponseQuote(object):
     def __init__(self, url):
@@ -172,6 +185,22 @@ class MockSuccessResponseQuote(object):
         }
 
 
+class MockSuccessResponseBulkQuotes(object):
+    def __init__(self, url):
+        self.status_code = 200
+        self.url = url
+
+    def json(self):
+        return {
+            "endpoint": "Realtime Bulk Quotes",
+            "data": [
+                {"symbol": "AAPL", "timestamp": "2020-03-24 16:00:00", "close": "148.3400"},
+                {"symbol": "COST", "timestamp": "2020-03-24 16:00:00", "close": "301.2300"},
+                {"symbol": "MSFT", "timestamp": "2020-03-24 16:00:00", "close": "295.3700"}
+            ]
+        }
+
+
 class MockApiRateLimitExceededResponse(object):
     def __init__(self, url):
         self.status_code = 200
@@ -189,6 +218,14 @@ class MockSuccessResponseWeekly(object):
         self.status_code = 200
         self.url = url
 
+    def iter_content(self, chunk_size=1):
+        content = json.dumps(self.json()).encode('utf-8')
+        for index in range(0, len(content), chunk_size):
+            yield content[index:index + chunk_size]
+
+    def close(self):
+        pass
+
     def json(self):
         return {
             'Meta Data': {
@@ -214,40 +251,40 @@ class MockSuccessResponseWeekly(object):
 
 @pytest.fixture(scope='function')
 def mock_requests_get_success_weekly(monkeypatch):
-    # Create a mock for the requests.get() call to prevent making the actual API call
-    def mock_get(url):
+    # Create a mock for the requests.Session.get() call to prevent making the actual API call
+    def mock_get(session, url, **kwargs):
         return MockSuccessResponseWeekly(url)
 
     url = 'https://www.alphavantage.co/query?function=TIME_SERIES_WEEKLY_ADJUSTED&symbol=MSFT&apikey=demo'
-    monkeypatch.setattr(requests, 'get', mock_get)
+    monkeypatch.setattr(requests.Session, 'get', mock_get)
 
 
 @pytest.fixture(scope='function')
 def mock_requests_get_success_quote(monkeypatch):
-    # Create a mock for the requests.get() call to prevent making the actual API call
-    def mock_get(url):
+    # Create a mock for the requests.Session.get() call to prevent making the actual API call
+    def mock_get(session, url, **kwargs):
         return MockSuccessResponseQuote(url)
 
     url = 'https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol=MSFT&apikey=demo'
-    monkeypatch.setattr(requests, 'get', mock_get)
+    monkeypatch.setattr(requests.Session, 'get', mock_get)
 
 
 @pytest.fixture(scope='function')
 def mock_requests_get_api_rate_limit_exceeded(monkeypatch):
-    def mock_get(url):
+    def mock_get(session, url, **kwargs):
         return MockApiRateLimitExceededResponse(url)
 
     url = 'https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol=MSFT&apikey=demo'
-    monkeypatch.setattr(requests, 'get', mock_get)
+    monkeypatch.setattr(requests.Session, 'get', mock_get)
 
 
 @pytest.fixture(scope='function')
 def mock_requests_get_failure(monkeypatch):
-    def mock_get(url):
+    def mock_get(session, url, **kwargs):
         return MockFailedResponse(url)
 
     url = 'https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol=MSFT&apikey=demo'
-    monkeypatch.setattr(requests, 'get', mock_get)
+    monkeypatch.setattr(requests.Session, 'get', mock_get)
 
 
 @pytest.fixture(scope='module')
@@ -1,8 +1,19 @@
 """
 This file (test_stocks.py) contains the functional tests for the 'stocks' blueprint.
 """
+import re
+from datetime import date, datetime, timedelta
+
 import requests
 
+import project.models
+import project.stocks.routes
+from project import database
+from project.analytics import get_portfolio_value_history
+from project.models import (AccountTotal, PortfolioSnapshot, PriceHistory, Stock, User, refresh_account_totals,
+                            schedule_price_refresh, store_quote)
+from project.providers import Cassette
+from project.snapshots import load_snapshot_series
 from tests.conftest import MockSuccessResponse, MockFailedResponse
 
 
@@ -123,6 +134,137 @@ def test_get_stock_list_logged_in(test_client, add_stocks_for_default_user, mock
         assert element in response.data
 
 
+def test_get_stock_list_pages(test_client, add_stocks_for_default_user, mock_requests_get_success_quote):
+    """
+    GIVEN a Flask application configured for testing, with the default user logged in
+          and the default set of stocks in the database
+    WHEN the '/stocks' page is requested (GET) with a page size of 2
+    THEN check that the pages are linked by the ID of the last stock and show the total of the whole portfolio
+    """
+    query = (database.select(Stock.id).join(User).where(User.email == 'patrick@gmail.com').order_by(Stock.id))
+    stock_ids = database.session.execute(query).scalars().all()
+    assert len(stock_ids) >= 3
+
+    response = test_client.get('/stocks?page_size=2')
+    assert response.status_code == 200
+    assert response.data.count(b'<tr data-symbol=') == 2
+    assert f'/stocks?after={stock_ids[1]}&amp;page_size=2'.encode() in response.data
+    assert f'2 of {len(stock_ids)} positions'.encode() in response.data
+    total_value = re.search(rb'id="total-value"[^>]*>\$([0-9.]+)<', response.data).group(1)
+
+    response = test_client.get(f'/stocks?after={stock_ids[1]}&page_size=2')
+    assert response.status_code == 200
+    assert response.data.count(b'<tr data-symbol=') == min(len(stock_ids) - 2, 2)
+    assert b'First page' in response.data
+    assert re.search(rb'id="total-value"[^>]*>\$([0-9.]+)<', response.data).group(1) == total_value
+
+    response = test_client.get('/stocks?page_size=0')
+    assert response.status_code == 400
+
+
+def test_get_stock_list_read_only(test_client, add_stocks_for_default_user, mock_requests_get_success_quote,
+                                  monkeypatch):
+    """
+    GIVEN a Flask application configured for testing, with the default user logged in
+          and the default set of stocks in the database
+    WHEN the '/stocks' page is requested (GET) twice
+    THEN check that the second page view, with fresh prices, does not commit to the database
+    """
+    monkeypatch.setitem(test_client.application.config, 'STOCK_VIEWS_FLUSH_INTERVAL', 3600)
+    response = test_client.get('/stocks')
+    assert response.status_code == 200
+
+    commits = []
+    monkeypatch.setattr(database.session, 'commit', lambda: commits.append(True))
+    response = test_client.get('/stocks')
+    assert response.status_code == 200
+    assert b'SAM' in response.data
+    assert commits == []
+
+
+def test_get_stock_list_account_total(test_client, add_stocks_for_default_user, mock_requests_get_success_quote):
+    """
+    GIVEN a Flask application configured for testing, with the default user logged in
+          and the default set of stocks in the database
+    WHEN the '/stocks' page is requested (GET) with fresh prices
+    THEN check that the total of the portfolio is read from the materialized account totals
+    """
+    response = test_client.get('/stocks')
+    assert response.status_code == 200
+
+    user_id = database.session.execute(database.select(User.id).where(User.email == 'patrick@gmail.com')).scalar_one()
+    database.session.execute(database.update(AccountTotal).where(AccountTotal.user_id == user_id)
+                             .values(total_value=123456))
+    database.session.commit()
+
+    response = test_client.get('/stocks')
+    assert response.status_code == 200
+    assert b'data-total-value="123456">$1234.56<' in response.data
+
+    refresh_account_totals([user_id])
+    database.session.commit()
+
+
+def test_get_stock_list_stale_while_revalidate(test_client, add_stocks_for_default_user,
+                                                mock_requests_get_success_quote, monkeypatch):
+    """
+    GIVEN a Flask application with stale-while-revalidate enabled and stocks priced yesterday
+    WHEN the '/stocks' page is requested (GET)
+    THEN check that the stale prices are displayed and refreshed in the background
+    """
+    scheduled_symbols = []
+
+    def defer_price_refresh(symbols, user_id=None):
+        # Only start the refresh once the page is rendered, so that the stale prices are displayed
+        scheduled_symbols.append(list(symbols))
+
+    monkeypatch.setattr(project.stocks.routes, 'schedule_price_refresh', defer_price_refresh)
+    monkeypatch.setitem(test_client.application.config, 'STOCKS_STALE_WHILE_REVALIDATE', True)
+    database.session.execute(database.update(Stock).values(current_price=12345,
+                                                           current_price_date=datetime.now() - timedelta(days=1)))
+    database.session.commit()
+
+    response = test_client.get('/stocks', follow_redirects=True)
+    assert response.status_code == 200
+    assert b'$123.45*' in response.data
+    assert b'stale-price' in response.data
+
+    assert len(scheduled_symbols) == 1
+    schedule_price_refresh(scheduled_symbols[0]).join(timeout=10)
+    database.session.expire_all()
+    stocks = database.session.execute(database.select(Stock)).scalars().all()
+    assert len(stocks) > 0
+    for stock in stocks:
+        assert stock.current_price == 14834
+        assert not stock.is_price_stale()
+
+
+def test_get_stock_list_stale_while_revalidate_refreshed(test_client, add_stocks_for_default_user,
+                                                          mock_requests_get_success_quote, monkeypatch):
+    """
+    GIVEN a Flask application with stale-while-revalidate enabled and stocks priced yesterday
+    WHEN the '/stocks' page is requested (GET) and the background refresh completes immediately
+    THEN check that the page shows the stale prices that were loaded, marked as stale
+    """
+    def refresh_immediately(symbols, user_id=None):
+        thread = schedule_price_refresh(symbols, user_id)
+        if thread is not None:
+            thread.join(timeout=10)
+
+    monkeypatch.setattr(project.stocks.routes, 'schedule_price_refresh', refresh_immediately)
+    monkeypatch.setitem(test_client.application.config, 'STOCKS_STALE_WHILE_REVALIDATE', True)
+    # Write the views on this page load, so the session is committed (and the stocks expired) before rendering
+    monkeypatch.setitem(test_client.application.config, 'STOCK_VIEWS_FLUSH_INTERVAL', 0)
+    database.session.execute(database.update(Stock).values(current_price=12345,
+                                                           current_price_date=datetime.now() - timedelta(days=1)))
+    database.session.commit()
+
+    response = test_client.get('/stocks', follow_redirects=True)
+    assert response.status_code == 200
+    assert b'$123.45*' in response.data
+    assert b'$148.34' not in response.data
+
+
 def test_get_stock_list_not_logged_in(test_client):
     """
     GIVEN a Flask application configured for testing
@@ -185,7 +327,45 @@ def test_get_stock_detail_page(test_client, add_stocks_for_default_user, mock_re
     assert b'canvas id="stockChart"' in response.data
 
 
-def test_get_stock_detail_page_failed_response(test_client, add_stocks_for_default_user, mock_requests_get_failure):
+def test_get_stock_detail_page_read_only(test_client, add_stocks_for_default_user, mock_requests_get_success_weekly,
+                                         monkeypatch):
+    """
+    GIVEN a Flask application configured for testing, with the default user logged in
+          and the default set of stocks in the database
+    WHEN the '/stocks/3' page is retrieved (GET) twice
+    THEN check that the second page view, with the price history current, does not commit to the database
+    """
+    monkeypatch.setitem(test_client.application.config, 'STOCK_VIEWS_FLUSH_INTERVAL', 3600)
+    response = test_client.get('/stocks/3')
+    assert response.status_code == 200
+
+    # The weekly prices of the mocked responses are too old to ever be current
+    monkeypatch.setattr(project.models, 'sync_weekly_price_history', lambda symbol, start_date: True)
+    commits = []
+    monkeypatch.setattr(database.session, 'commit', lambda: commits.append(True))
+    response = test_client.get('/stocks/3')
+    assert response.status_code == 200
+    assert b'Stock Details' in response.data
+    assert commits == []
+
+
+def test_get_stock_chart(test_client, add_stocks_for_default_user, mock_requests_get_success_weekly):
+    """
+    GIVEN a Flask application configured for testing, with the default user logged in
+          and the default set of stocks in the database
+    WHEN the '/stocks/3/chart' page is retrieved (GET) and the response from Alpha Vantage was successful
+    THEN check that the weekly prices are returned as JSON for Chart.js
+    """
+    response = test_client.get('/stocks/3/chart')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/json'
+    assert response.json['labels'][-1] == '07/24/2020'
+    assert response.json['values'][-1] == 379.24
+    assert len(response.json['labels']) == len(response.json['values'])
+
+
+def test_get_stock_detail_page_failed_response(test_client, add_stocks_for_default_user, clear_price_history,
+                                               mock_requests_get_failure):
     """
     GIVEN a Flask application configured for testing, with the default user logged in
           and the default set of stocks in the database
@@ -218,4 +398,389 @@ def test_get_stock_detail_page_invalid_stock(test_client, log_in_default_user):
     """
     response = test_client.get('/stocks/234')
     assert response.status_code == 404
-    assert b'Stock Details' not in response.data
\ No newline at end of file
+    assert b'Stock Details' not in response.data
+
+
+def test_get_stock_list_not_modified(test_client, add_stocks_for_default_user, mock_requests_get_success_quote):
+    """
+    GIVEN a Flask application configured for testing, with the default user logged in
+          and the default set of stocks in the database
+    WHEN the '/stocks' page is requested (GET) again with the ETag of the previous response
+    THEN check that the page is not sent again (304) until a position changes
+    """
+    test_client.get('/stocks')  # Displays the flashed messages
+    response = test_client.get('/stocks')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert response.headers['Last-Modified'] is not None
+
+    response = test_client.get('/stocks', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    test_client.post('/add_stock', data={'stock_symbol': 'AAPL',
+                                         'number_of_shares': '10',
+                                         'purchase_price': '148.34',
+                                         'purchase_date': '2020-07-01'})
+    test_client.get('/stocks')  # Displays the flashed message
+    response = test_client.get('/stocks', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'AAPL' in response.data
+    assert response.headers['ETag'] != etag
+
+
+def test_get_stock_detail_page_not_modified(test_client, add_stocks_for_default_user,
+                                            mock_requests_get_success_quote):
+    """
+    GIVEN a Flask application configured for testing, with the default user logged in
+          and the price history of a stock stored until this week
+    WHEN the '/stocks/<id>' page is requested (GET) again with the ETag of the previous response
+    THEN check that the page is not sent again (304)
+    """
+    stock = database.session.execute(database.select(Stock).where(Stock.stock_symbol == 'SAM')).scalars().first()
+    stock_id = stock.id
+    database.session.execute(database.delete(PriceHistory).where(PriceHistory.stock_symbol == 'SAM'))
+    week = datetime.now().date()
+    while week > stock.purchase_date.date() - timedelta(weeks=1):
+        database.session.add(PriceHistory(stock_symbol='SAM', date=week, close_price=14834))
+        week -= timedelta(weeks=1)
+    database.session.commit()
+
+    test_client.get('/stocks')  # Displays the flashed messages
+    response = test_client.get(f'/stocks/{stock_id}')
+    assert response.status_code == 200
+    assert b'Weekly Prices (SAM)' in response.data
+    etag = response.headers['ETag']
+
+    response = test_client.get(f'/stocks/{stock_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    database.session.execute(database.delete(PriceHistory).where(PriceHistory.stock_symbol == 'SAM'))
+    database.session.commit()
+
+
+def test_get_stock_totals(test_client, add_stocks_for_default_user, mock_requests_get_success_quote):
+    """
+    GIVEN a Flask application configured for testing, with the default user logged in
+          and the default set of stocks in the database
+    WHEN the '/stocks/totals' page is requested (GET) after the prices are refreshed
+    THEN check that the totals of the portfolio are returned
+    """
+    test_client.get('/stocks')
+    response = test_client.get('/stocks/totals')
+    assert response.status_code == 200
+    totals = response.get_json()
+    assert totals['number_of_positions'] >= len(totals['symbols']) > 0
+    assert round(sum(symbol['position_value'] for symbol in totals['symbols']), 2) == totals['total_value']
+    for symbol in totals['symbols']:
+        assert symbol['position_value'] == round(symbol['number_of_shares'] * 148.34, 2)
+
+
+def test_get_stock_totals_read_only(test_client, add_stocks_for_default_user, mock_requests_get_success_quote,
+                                    monkeypatch):
+    """
+    GIVEN a Flask application configured for testing, with the default user logged in
+          and the default set of stocks in the database
+    WHEN the '/stocks/totals' page is requested (GET) with and without the materialized totals
+    THEN check that the database is only committed to when the totals were missing
+    """
+    user_id = database.session.execute(database.select(User.id).where(User.email == 'patrick@gmail.com')).scalar_one()
+    refresh_account_totals([user_id])
+    database.session.commit()
+
+    commits = []
+    monkeypatch.setattr(database.session, 'commit', lambda: commits.append(True))
+    response = test_client.get('/stocks/totals')
+    assert response.status_code == 200
+    assert commits == []
+
+    monkeypatch.undo()
+    database.session.execute(database.delete(AccountTotal).where(AccountTotal.user_id == user_id))
+    database.session.commit()
+    monkeypatch.setattr(database.session, 'commit', lambda: commits.append(True))
+    response = test_client.get('/stocks/totals')
+    assert response.status_code == 200
+    assert response.get_json()['number_of_positions'] > 0
+    assert commits == [True]
+
+    monkeypatch.undo()
+    refresh_account_totals([user_id])
+    database.session.commit()
+
+
+def test_get_portfolio_analytics(test_client, add_stocks_for_default_user, clear_price_history,
+                                 mock_requests_get_success_weekly):
+    """
+    GIVEN a Flask application configured for testing, with the default user logged in
+          and the default set of stocks in the database
+    WHEN the '/stocks/analytics' page is requested (GET)
+    THEN check that the performance of each position and of the portfolio is returned (and cached)
+    """
+    response = test_client.get('/stocks/analytics?as_of=2020-08-01&format=json')
+    assert response.status_code == 200
+    analytics = response.get_json()
+    assert analytics['as_of'] == '2020-08-01'
+    sam = next(position for position in analytics['positions'] if position['symbol'] == 'SAM')
+    assert sam['number_of_weeks'] == 1
+    assert round(sam['time_weighted_return'], 6) == round(379.24 / 362.76 - 1.0, 6)
+    assert analytics['portfolio']['number_of_weeks'] == 3
+
+    analytics_cache = test_client.application.extensions['analytics_cache']
+    hits = analytics_cache.hits
+    response = test_client.get('/stocks/analytics?as_of=2020-08-01')
+    assert response.status_code == 200
+    assert b'Portfolio Performance' in response.data
+    assert b'SAM' in response.data
+    assert analytics_cache.hits == hits + 1
+
+    response = test_client.get('/stocks/analytics?as_of=invalid')
+    assert response.status_code == 400
+
+
+def test_get_portfolio_risk(test_client, add_stocks_for_default_user, clear_price_history,
+                            mock_requests_get_success_weekly):
+    """
+    GIVEN a Flask application configured for testing, with the default user logged in
+          and the default set of stocks in the database
+    WHEN the '/stocks/risk' page is requested (GET)
+    THEN check that the correlation matrix and the risk contribution of each symbol are returned (and cached)
+    """
+    response = test_client.get('/stocks/risk?format=json')
+    assert response.status_code == 200
+    risk = response.get_json()
+    assert 'SAM' in risk['symbols']
+    number_of_symbols = len(risk['symbols'])
+    assert len(risk['correlation']) == number_of_symbols
+    assert all(len(row) == number_of_symbols for row in risk['correlation'])
+    assert round(sum(risk['weights']), 6) == 1.0
+
+    risk_cache = test_client.application.extensions['risk_cache']
+    hits = risk_cache.hits
+    response = test_client.get('/stocks/risk')
+    assert response.status_code == 200
+    assert b'Portfolio Risk' in response.data
+    assert b'Correlation Matrix' in response.data
+    assert risk_cache.hits == hits + 1
+
+
+def test_get_portfolio_history(test_client, add_stocks_for_default_user, clear_price_history,
+                               mock_requests_get_success_weekly):
+    """
+    GIVEN a Flask application configured for testing, with the default user logged in
+          and the default set of stocks in the database
+    WHEN the '/stocks/history' and '/stocks/history/chart' pages are requested (GET)
+    THEN check that the weekly values of the portfolio are returned
+    """
+    response = test_client.get('/stocks/history')
+    assert response.status_code == 200
+    assert b'Portfolio History' in response.data
+
+    response = test_client.get('/stocks/history/chart')
+    assert response.status_code == 200
+    chart_data = response.get_json()
+    assert chart_data['labels'] == ['02/25/2020', '06/11/2020', '07/17/2020', '07/24/2020']
+    assert len(chart_data['values']) == 4
+    assert all(value > 0 for value in chart_data['values'])
+
+
+def test_stream_stock_prices(test_client, add_stocks_for_default_user, mock_requests_get_success_quote):
+    """
+    GIVEN a Flask application configured for testing, with the default user logged in
+          and the default set of stocks in the database
+    WHEN the '/stocks/stream' page is requested (GET)
+    THEN check that the current share price of each stock is pushed as a Server-Sent Event
+    """
+    response = test_client.get('/stocks/stream', buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+
+    query = database.select(Stock.stock_symbol).join(User).where(User.email == 'patrick@gmail.com').distinct()
+    number_of_symbols = len(database.session.execute(query).scalars().all())
+    assert next(response.response) == b'retry: 5000\n\n'
+    events = [next(response.response) for _ in range(number_of_symbols)]
+    response.close()
+    for symbol in ['SAM', 'COST', 'TWTR']:
+        assert f'event: price\ndata: {{"symbol": "{symbol}", "price": 148.34}}\n\n'.encode() in events
+
+
+def test_stream_stock_prices_max_duration(test_client, add_stocks_for_default_user, mock_requests_get_success_quote,
+                                          monkeypatch):
+    """
+    GIVEN a Flask application configured for testing, with the default user logged in
+    WHEN the '/stocks/stream' page is requested (GET) and kept open
+    THEN check that the stream ends after PRICE_STREAM_MAX_DURATION seconds
+    """
+    monkeypatch.setitem(test_client.application.config, 'PRICE_STREAM_HEARTBEAT', 0.05)
+    monkeypatch.setitem(test_client.application.config, 'PRICE_STREAM_MAX_DURATION', 0.3)
+    response = test_client.get('/stocks/stream', buffered=False)
+    assert response.status_code == 200
+
+    events = list(response.response)
+    response.close()
+    assert events[0] == b'retry: 5000\n\n'
+    assert b': heartbeat\n\n' in events
+    assert test_client.application.extensions['price_stream'].subscriber_count('SAM') == 0
+
+
+def test_refresh_daemon_once(test_client, add_stocks_for_default_user, mock_requests_get_success_quote):
+    """
+    GIVEN a Flask application configured for testing with stocks whose prices are stale
+    WHEN the 'flask stocks refresh-daemon --once' command is run
+    THEN check that the prices of the stocks are refreshed
+    """
+    database.session.execute(database.update(Stock).values(current_price=0, current_price_date=None))
+    database.session.commit()
+
+    runner = test_client.application.test_cli_runner()
+    result = runner.invoke(args=['stocks', 'refresh-daemon', '--once', '--interval', '600'])
+    assert result.exit_code == 0
+
+    database.session.expire_all()
+    stocks = database.session.execute(database.select(Stock)).scalars().all()
+    assert len(stocks) > 0
+    for stock in stocks:
+        assert stock.current_price == 14834
+        assert stock.current_price_date is not None
+        assert stock.position_value == 14834 * stock.number_of_shares
+
+
+def test_refresh_daemon_bulk_quotes(test_client, monkeypatch):
+    """
+    GIVEN a Flask application configured for testing with bulk quotes enabled
+    WHEN the 'flask stocks refresh-daemon --once' command is run
+    THEN check that each call of the cycle can refresh a full bulk quote call of symbols
+    """
+    limits = []
+    monkeypatch.setattr(project.stocks.routes, 'get_symbols_to_refresh', lambda limit: limits.append(limit) or [])
+    monkeypatch.setattr(test_client.application.extensions['market_data_provider'], 'supports_bulk_quotes', True)
+    monkeypatch.setitem(test_client.application.config, 'REFRESH_DAEMON_CALLS_PER_MINUTE', 3)
+
+    runner = test_client.application.test_cli_runner()
+    result = runner.invoke(args=['stocks', 'refresh-daemon', '--once', '--interval', '60'])
+    assert result.exit_code == 0
+    assert limits == [3 * test_client.application.config['MARKET_DATA_BULK_QUOTE_SIZE']]
+
+
+def test_refresh_daemon_fresh_quotes(test_client, add_stocks_for_default_user, monkeypatch):
+    """
+    GIVEN a Flask application configured for testing with fresh quotes and stocks whose prices are stale
+    WHEN the 'flask stocks refresh-daemon --once' command is run
+    THEN check that the prices of the stocks are written back from the quotes without calling the provider
+    """
+    requested_urls = []
+    monkeypatch.setattr(requests.Session, 'get', lambda session, url, **kwargs: requested_urls.append(url))
+    monkeypatch.setitem(test_client.application.config, 'QUOTE_CACHE_TTL', 3600)
+    quote_cache = test_client.application.extensions['quote_cache']
+    monkeypatch.setattr(quote_cache, 'ttl', 3600)
+    for symbol in database.session.execute(database.select(Stock.stock_symbol).distinct()).scalars().all():
+        store_quote(symbol, 150.0)
+    database.session.execute(database.update(Stock).values(current_price=12345,
+                                                           current_price_date=datetime.now() - timedelta(days=1)))
+    database.session.commit()
+
+    runner = test_client.application.test_cli_runner()
+    result = runner.invoke(args=['stocks', 'refresh-daemon', '--once', '--interval', '600'])
+    assert result.exit_code == 0
+    assert requested_urls == []
+
+    database.session.expire_all()
+    stocks = database.session.execute(database.select(Stock)).scalars().all()
+    assert len(stocks) > 0
+    for stock in stocks:
+        assert stock.current_price == 15000
+        assert not stock.is_price_stale()
+    quote_cache.clear()
+
+def test_record_cassette(test_client, add_stocks_for_default_user, mock_requests_get_success_quote, tmp_path):
+    """
+    GIVEN a Flask application configured for testing with stocks in the database
+    WHEN the 'flask stocks record-cassette' command is run
+    THEN check that the responses for each stock are recorded to the cassette
+    """
+    cassette_path = str(tmp_path / 'cassette.json.gz')
+    runner = test_client.application.test_cli_runner()
+    result = runner.invoke(args=['stocks', 'record-cassette', '--path', cassette_path])
+    assert result.exit_code == 0
+    assert 'Recorded the responses for SAM' in result.output
+
+    cassette = Cassette(cassette_path)
+    assert cassette.get('GLOBAL_QUOTE', 'SAM')['Global Quote']['05. price'] == '148.3400'
+
+
+def test_value_command(test_client, add_stocks_for_default_user):
+    """
+    GIVEN a Flask application configured for testing with stocks in the database
+    WHEN the 'flask stocks value' command is run
+    THEN check that the total value of the positions is printed
+    """
+    runner = test_client.application.test_cli_runner()
+    result = runner.invoke(args=['stocks', 'value'])
+    assert result.exit_code == 0
+    assert 'Total value: $' in result.output
+
+
+def test_snapshot_command(test_client, add_stocks_for_default_user, mock_requests_get_success_quote):
+    """
+    GIVEN a Flask application configured for testing with stocks in the database
+    WHEN the 'flask stocks snapshot' command is run (twice for the same date)
+    THEN check that one snapshot row is written per user and per symbol
+    """
+    runner = test_client.application.test_cli_runner()
+    result = runner.invoke(args=['stocks', 'snapshot', '--date', '2024-01-10', '--stored-prices'])
+    assert result.exit_code == 0
+    result = runner.invoke(args=['stocks', 'snapshot', '--date', '2024-01-10', '--chunk-size', '1'])
+    assert result.exit_code == 0
+    assert 'portfolio snapshot rows for 2024-01-10' in result.output
+
+    query = (database.select(PortfolioSnapshot).join(User, User.id == PortfolioSnapshot.user_id)
+             .where(User.email == 'patrick@gmail.com', PortfolioSnapshot.snapshot_date == date(2024, 1, 10)))
+    snapshots = {snapshot.stock_symbol: snapshot for snapshot in database.session.execute(query).scalars()}
+    assert {'SAM', 'COST', 'TWTR'} <= set(snapshots)
+    assert snapshots['SAM'].price == 14834
+    assert snapshots['SAM'].position_value == snapshots['SAM'].number_of_shares * 14834
+    assert snapshots['SAM'].number_of_shares % 27 == 0
+
+    user = database.session.execute(database.select(User).where(User.email == 'patrick@gmail.com')).scalar_one()
+    series = load_snapshot_series(user.id)
+    assert series.last_date() == date(2024, 1, 10)
+    assert series.prices[-1] == sum(snapshot.position_value for snapshot in snapshots.values())
+
+
+def test_get_portfolio_history_with_snapshots(test_client, add_stocks_for_default_user, clear_price_history,
+                                              mock_requests_get_success_weekly):
+    """
+    GIVEN a Flask application configured for testing, with the default user logged in
+          and daily snapshots of the portfolio in the database
+    WHEN the '/stocks/history/chart' page is requested (GET)
+    THEN check that the snapshots are used on their days, the weekly values on the other days,
+         and that only the weeks not covered by the snapshots are computed
+    """
+    query = database.select(User.id).where(User.email == 'patrick@gmail.com')
+    user_id = database.session.execute(query).scalar_one()
+    database.session.execute(database.delete(PortfolioSnapshot).where(PortfolioSnapshot.user_id == user_id))
+    database.session.execute(database.insert(PortfolioSnapshot), [
+        {'snapshot_date': snapshot_date, 'user_id': user_id, 'stock_symbol': 'SAM',
+         'number_of_shares': 1, 'price': 12345, 'position_value': 12345, 'cost_basis': 10000}
+        for snapshot_date in [date(2020, 6, 1), datetime.now().date()]
+    ])
+    database.session.commit()
+
+    response = test_client.get('/stocks/history/chart')
+    assert response.status_code == 200
+    chart_data = response.get_json()
+    assert chart_data['labels'] == ['02/25/2020', '06/01/2020', '06/11/2020', '07/17/2020', '07/24/2020',
+                                    datetime.now().strftime('%m/%d/%Y')]
+    assert chart_data['values'][1] == 123.45
+    assert chart_data['values'][-1] == 123.45
+
+    history_cache = test_client.application.extensions['portfolio_history_cache']
+    assert history_cache.get(user_id).series.last_date() == date(2020, 7, 24)
+
+    # Without the snapshots, the same cached history is extended until today (and then sliced again)
+    database.session.execute(database.delete(PortfolioSnapshot).where(PortfolioSnapshot.user_id == user_id))
+    database.session.commit()
+    response = test_client.get('/stocks/history/chart')
+    assert response.status_code == 200
+    assert response.get_json()['labels'][-1] == '07/24/2020'
+    with test_client.application.test_request_context():
+        assert get_portfolio_value_history(user_id, date(2020, 7, 20)).dates()[-1] == date(2020, 7, 17)
@@ -0,0 +1,83 @@
+"""
+This file (test_analytics.py) contains the unit tests for the analytics.py file.
+"""
+import math
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from project import database
+from project.analytics import WEEKS_PER_YEAR, compute_metrics, extend_portfolio_value_history
+from project.models import PriceHistory, Stock
+
+
+def test_compute_metrics():
+    """
+    GIVEN a series of weekly returns
+    WHEN the performance metrics are computed
+    THEN check the time-weighted return, volatility, Sharpe ratio and maximum drawdown
+    """
+    returns = np.array([0.1, -0.5, 0.2])
+    metrics = compute_metrics(returns[:, None])[0]
+
+    assert math.isclose(metrics.time_weighted_return, 1.1 * 0.5 * 1.2 - 1.0)
+    assert math.isclose(metrics.annualized_volatility, np.std(returns, ddof=1) * math.sqrt(WEEKS_PER_YEAR))
+    assert math.isclose(metrics.sharpe_ratio, returns.mean() * WEEKS_PER_YEAR / metrics.annualized_volatility)
+    assert math.isclose(metrics.max_drawdown, 0.55 / 1.1 - 1.0)
+    assert metrics.number_of_weeks == 3
+
+
+def test_compute_metrics_not_held():
+    """
+    GIVEN weekly returns of two series, where the second one is only held for one week
+    WHEN the performance metrics are computed
+    THEN check that the weeks when a series is not held are ignored
+    """
+    returns = np.array([[0.1, np.nan],
+                        [0.2, np.nan],
+                        [-0.1, 0.05]])
+    first, second = compute_metrics(returns)
+
+    assert first.number_of_weeks == 3
+    assert math.isclose(second.time_weighted_return, 0.05)
+    assert second.max_drawdown == 0.0
+    assert second.annualized_volatility is None
+    assert second.sharpe_ratio is None
+    assert second.number_of_weeks == 1
+
+
+def test_extend_portfolio_value_history(new_stock):
+    """
+    GIVEN the weekly value history of a portfolio computed from the stored weeks
+    WHEN new weeks are stored (and the last week is re-written) and the history is extended
+    THEN check that the history matches the history computed from scratch
+    """
+    today = datetime.now()
+    weeks = [(today - timedelta(weeks=week)).date() for week in range(10, 0, -1)]
+    stocks = [Stock('ZZZA', '10', '100.00', 17, today - timedelta(weeks=12)),
+              Stock('ZZZB', '5', '50.00', 17, today - timedelta(weeks=6, days=1))]
+    for index, week in enumerate(weeks[:6]):
+        database.session.add(PriceHistory(stock_symbol='ZZZA', date=week, close_price=10000 + index * 100))
+    database.session.add(PriceHistory(stock_symbol='ZZZB', date=weeks[2], close_price=5000))
+    database.session.flush()
+
+    history = extend_portfolio_value_history(stocks, ())
+    assert len(history.series) == 6
+    assert history.series.prices[0] == 10 * 10000
+    assert history.series.prices[-1] == 10 * 10500 + 5 * 5000
+
+    database.session.execute(database.update(PriceHistory)
+                             .where(PriceHistory.stock_symbol == 'ZZZA', PriceHistory.date == weeks[5])
+                             .values(close_price=11000))
+    for index, week in enumerate(weeks[6:]):
+        database.session.add(PriceHistory(stock_symbol='ZZZA', date=week, close_price=12000 + index * 100))
+    database.session.add(PriceHistory(stock_symbol='ZZZB', date=weeks[8], close_price=6000))
+    database.session.flush()
+
+    extended_history = extend_portfolio_value_history(stocks, (), history)
+    full_history = extend_portfolio_value_history(stocks, ())
+    assert len(extended_history.series) == 10
+    assert list(extended_history.series.days) == list(full_history.series.days)
+    assert list(extended_history.series.prices) == list(full_history.series.prices)
+    assert extended_history.series.prices[5] == 10 * 11000 + 5 * 5000
+    database.session.rollback()
@@ -0,0 +1,61 @@
+"""
+This file (test_cache.py) contains the unit tests for the cache.py file.
+"""
+from freezegun import freeze_time
+
+from project.cache import TTLCache, QuoteCache
+
+
+def test_cache_hit_and_miss():
+    """
+    GIVEN a TTL cache
+    WHEN a value is stored and then retrieved
+    THEN check the value is returned and the hit/miss counters are updated
+    """
+    cache = TTLCache(max_size=4, ttl=60)
+    assert cache.get('AAPL') is None
+    cache.set('AAPL', 148.34)
+    assert cache.get('AAPL') == 148.34
+    assert cache.stats() == {'size': 1, 'hits': 1, 'misses': 1}
+
+
+def test_cache_expired_entry():
+    """
+    GIVEN a TTL cache containing a value
+    WHEN the value is retrieved after its time-to-live has passed
+    THEN check that a miss is reported and the entry is dropped
+    """
+    with freeze_time('2020-07-28 10:00:00') as frozen_time:
+        cache = TTLCache(max_size=4, ttl=60)
+        cache.set('AAPL', 148.34)
+        frozen_time.tick(61)
+        assert cache.get('AAPL') is None
+        assert len(cache) == 0
+
+
+def test_cache_evicts_least_recently_used():
+    """
+    GIVEN a full TTL cache
+    WHEN a new value is stored
+    THEN check that the least recently used entry is evicted
+    """
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set('AAPL', 1.0)
+    cache.set('MSFT', 2.0)
+    cache.get('AAPL')
+    cache.set('COST', 3.0)
+    assert cache.get('MSFT') is None
+    assert cache.get('AAPL') == 1.0
+    assert cache.get('COST') == 3.0
+
+
+def test_cache_disabled():
+    """
+    GIVEN a TTL cache with a time-to-live of zero
+    WHEN a value is stored
+    THEN check that nothing is cached
+    """
+    cache = QuoteCache(max_size=4, ttl=0)
+    cache.set('AAPL', 148.34)
+    assert cache.get('AAPL') is None
+    assert cache.stats()['upstream_fetches'] == 0
@@ -0,0 +1,119 @@
+"""
+This file (test_gateway.py) contains the unit tests for the gateway.py file.
+"""
+import threading
+import time
+
+import pytest
+import requests
+
+from project.gateway import CircuitBreaker, CircuitOpen, ProviderGateway, RateLimitExceeded, SingleFlight, TokenBucket
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    """
+    GIVEN a single-flight group
+    WHEN several threads make the same call concurrently
+    THEN check that the call is only made once and every thread gets its result
+    """
+    single_flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+    results = []
+
+    def slow_call():
+        calls.append(1)
+        release.wait(timeout=5)
+        return 148.34
+
+    threads = [threading.Thread(target=lambda: results.append(single_flight.do('AAPL', slow_call)))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while not calls:
+        pass
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [148.34] * 5
+
+
+def test_token_bucket_budget():
+    """
+    GIVEN a token bucket allowing bursts of two calls
+    WHEN three calls are attempted without waiting
+    THEN check that the third call is refused
+    """
+    bucket = TokenBucket(calls_per_minute=5, capacity=2)
+    assert bucket.acquire()
+    assert bucket.acquire()
+    assert not bucket.acquire()
+
+
+def test_gateway_rate_limit_exceeded():
+    """
+    GIVEN a provider gateway whose call budget has been drained
+    WHEN a call is made through the gateway
+    THEN check that RateLimitExceeded is raised without calling the client
+    """
+    class Client(object):
+        def get(self, url):
+            raise AssertionError('The client should not be called!')
+
+    gateway = ProviderGateway(Client(), calls_per_minute=5, burst=5)
+    gateway.report_rate_limited()
+    with pytest.raises(RateLimitExceeded):
+        gateway.get('https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol=AAPL&apikey=demo')
+
+
+def test_circuit_breaker_opens_and_half_opens():
+    """
+    GIVEN a circuit breaker opening after two consecutive failures
+    WHEN two failures are recorded and the reset timeout elapses
+    THEN check that calls are refused until a single probe call is allowed
+    """
+    circuit_breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    circuit_breaker.record_failure()
+    assert circuit_breaker.allow()
+    circuit_breaker.record_failure()
+    assert circuit_breaker.state == CircuitBreaker.OPEN
+    assert not circuit_breaker.allow()
+
+    time.sleep(0.05)
+    assert circuit_breaker.allow()
+    assert circuit_breaker.state == CircuitBreaker.HALF_OPEN
+    assert not circuit_breaker.allow()
+
+    # A failed probe re-opens the circuit, a successful one closes it
+    circuit_breaker.record_failure()
+    assert circuit_breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.05)
+    assert circuit_breaker.allow()
+    circuit_breaker.record_success()
+    assert circuit_breaker.state == CircuitBreaker.CLOSED
+    assert circuit_breaker.allow()
+
+
+def test_gateway_circuit_open():
+    """
+    GIVEN a provider gateway with a circuit breaker and a client that times out
+    WHEN calls are made through the gateway
+    THEN check that CircuitOpen is raised without calling the client after consecutive timeouts
+    """
+    calls = []
+
+    class Client(object):
+        def get(self, url):
+            calls.append(url)
+            raise requests.exceptions.Timeout()
+
+    gateway = ProviderGateway(Client(), failure_threshold=3, reset_timeout=60)
+    url = 'https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol=AAPL&apikey=demo'
+    for _ in range(3):
+        with pytest.raises(requests.exceptions.Timeout):
+            gateway.get(url)
+    with pytest.raises(CircuitOpen):
+        gateway.get(url)
+    assert len(calls) == 3
@@ -3,8 +3,19 @@ This file (test_models.py) contains the unit tests for the models.py file.
 """
 from datetime import datetime
 
+import requests
+from flask import current_app
 from freezegun import freeze_time
 
+from project.cache import QuoteCache
+from tests.conftest import (MockApiRateLimitExceededResponse, MockSuccessResponseBulkQuotes,
+                            MockSuccessResponseQuote, MockSuccessResponseWeekly)
+from project import database
+from project.gateway import ProviderGateway
+from project.models import (AccountTotal, Quote, Stock, flush_stock_views, get_account_total, get_current_stock_price,
+                            get_current_stock_prices, get_position_values_by_symbol, record_stock_views,
+                            refresh_account_totals, store_quote, write_back_stock_prices)
+
 
 def test_new_stock(new_stock):
     """
@@ -91,6 +102,24 @@ def test_get_stock_data_failure(new_stock, mock_requests_get_failure):
     assert new_stock.position_value == 0
 
 
+def test_get_stock_data_network_error(new_stock, monkeypatch):
+    """
+    GIVEN a Flask application configured for testing and a monkeypatched version of requests.Session.get()
+    WHEN the HTTP request times out
+    THEN check that the stock data is not updated and the request timeout was set
+    """
+    def mock_get(session, url, **kwargs):
+        assert kwargs['timeout'] == (current_app.config['MARKET_DATA_CONNECT_TIMEOUT'],
+                                     current_app.config['MARKET_DATA_READ_TIMEOUT'])
+        raise requests.exceptions.Timeout()
+
+    monkeypatch.setattr(requests.Session, 'get', mock_get)
+    new_stock.get_stock_data()
+    assert new_stock.current_price == 0
+    assert new_stock.current_price_date is None
+    assert new_stock.position_value == 0
+
+
 def test_get_stock_data_success_two_calls(new_stock, mock_requests_get_success_quote):
     """
     GIVEN a Flask application configured for testing and a monkeypatched version of requests.get()
@@ -111,6 +140,107 @@ def test_get_stock_data_success_two_calls(new_stock, mock_requests_get_success_q
     assert new_stock.position_value == (14834*16)
 
 
+def test_get_current_stock_price_cached(new_stock, mock_requests_get_success_quote, monkeypatch):
+    """
+    GIVEN a Flask application with the quote cache enabled and a monkeypatched version of requests.get()
+    WHEN the current price of the same stock symbol is requested multiple times
+    THEN check that Alpha Vantage is only called once
+    """
+    current_app.extensions['quote_cache'] = QuoteCache(max_size=16, ttl=60)
+    assert get_current_stock_price('AAPL') == 148.34
+
+    def mock_get(session, url, **kwargs):
+        raise AssertionError('Quote should have been served from the cache!')
+
+    monkeypatch.setattr(requests.Session, 'get', mock_get)
+    assert get_current_stock_price('AAPL') == 148.34
+    assert get_current_stock_price('AAPL') == 148.34
+    stats = current_app.extensions['quote_cache'].stats()
+    assert stats['hits'] == 2
+    assert stats['upstream_fetches'] == 1
+
+
+def test_get_current_stock_prices_concurrent(new_stock, monkeypatch):
+    """
+    GIVEN a Flask application configured for testing and a monkeypatched version of requests.get()
+    WHEN the current prices of a list of stock symbols (including duplicates) are requested
+    THEN check that each symbol is fetched exactly once
+    """
+    requested_urls = []
+
+    def mock_get(session, url, **kwargs):
+        requested_urls.append(url)
+        return MockSuccessResponseQuote(url)
+
+    monkeypatch.setattr(requests.Session, 'get', mock_get)
+    prices = get_current_stock_prices(['AAPL', 'MSFT', 'AAPL', 'COST'])
+    assert prices == {'AAPL': 148.34, 'COST': 148.34, 'MSFT': 148.34}
+    assert len(requested_urls) == 3
+
+
+def test_get_current_stock_prices_bulk(new_stock, monkeypatch):
+    """
+    GIVEN a Flask application with bulk quotes enabled and a monkeypatched version of requests.Session.get()
+    WHEN the current prices of a list of stock symbols are requested
+    THEN check that all the prices are retrieved with a single call
+    """
+    requested_urls = []
+
+    def mock_get(session, url, **kwargs):
+        requested_urls.append(url)
+        return MockSuccessResponseBulkQuotes(url)
+
+    current_app.extensions['market_data_provider'].supports_bulk_quotes = True
+    monkeypatch.setattr(requests.Session, 'get', mock_get)
+    prices = get_current_stock_prices(['MSFT', 'AAPL', 'COST'])
+    assert prices == {'AAPL': 148.34, 'COST': 301.23, 'MSFT': 295.37}
+    assert len(requested_urls) == 1
+    assert 'function=REALTIME_BULK_QUOTES&symbol=AAPL,COST,MSFT' in requested_urls[0]
+    database.session.rollback()
+
+
+def test_get_current_stock_prices_bulk_unavailable(new_stock, monkeypatch):
+    """
+    GIVEN a Flask application with bulk quotes enabled and a monkeypatched version of requests.Session.get()
+    WHEN the bulk quote endpoint is not available
+    THEN check that the prices are retrieved with one call per symbol
+    """
+    requested_urls = []
+
+    def mock_get(session, url, **kwargs):
+        requested_urls.append(url)
+        if 'REALTIME_BULK_QUOTES' in url:
+            return MockApiRateLimitExceededResponse(url)
+        return MockSuccessResponseQuote(url)
+
+    current_app.extensions['market_data_provider'].supports_bulk_quotes = True
+    monkeypatch.setattr(requests.Session, 'get', mock_get)
+    prices = get_current_stock_prices(['MSFT', 'AAPL'])
+    assert prices == {'AAPL': 148.34, 'MSFT': 148.34}
+    assert len(requested_urls) == 3
+    database.session.rollback()
+
+
+def test_get_current_stock_price_rate_limited(new_stock, mock_requests_get_success_quote):
+    """
+    GIVEN a Flask application whose call budget for Alpha Vantage is exhausted
+    WHEN the current price of a stock with a stored (stale) quote is requested
+    THEN check that the stored quote is returned
+    """
+    gateway = ProviderGateway(current_app.extensions['market_data_client'], calls_per_minute=5)
+    gateway.report_rate_limited()
+    current_app.extensions['market_data_provider'].gateway = gateway
+    database.session.execute(database.delete(Quote))
+    quote = Quote('AAPL')
+    quote.price = 14512
+    quote.updated_on = datetime(2020, 7, 18)
+    database.session.add(quote)
+
+    assert get_current_stock_price('AAPL') == 145.12
+    assert get_current_stock_price('MSFT') == 0.0
+    database.session.rollback()
+
+
 @freeze_time('2020-07-28')
 def test_get_weekly_stock_data_success(new_stock, mock_requests_get_success_weekly):
     """
@@ -118,28 +248,237 @@ def test_get_weekly_stock_data_success(new_stock, mock_requests_get_success_week
     WHEN the HTTP response is set to successful
     THEN check the HTTP response
     """
-    title, labels, values = new_stock.get_weekly_stock_data()
+    title, series = new_stock.get_weekly_stock_data()
     assert title == 'Weekly Prices (AAPL)'
-    assert len(labels) == 3
-    assert labels[0].date() == datetime(2020, 6, 11).date()
-    assert labels[1].date() == datetime(2020, 7, 17).date()
-    assert labels[2].date() == datetime(2020, 7, 24).date()
-    assert len(values) == 3
-    assert values[0] == '354.3400'
-    assert values[1] == '362.7600'
-    assert values[2] == '379.2400'
+    assert len(series) == 3
+    labels = series.dates()
+    assert labels[0] == datetime(2020, 6, 11).date()
+    assert labels[1] == datetime(2020, 7, 17).date()
+    assert labels[2] == datetime(2020, 7, 24).date()
+    values = series.values()
+    assert values[0] == 354.34
+    assert values[1] == 362.76
+    assert values[2] == 379.24
     assert datetime.now() == datetime(2020, 7, 28)
 
 
-def test_get_weekly_stock_data_failure(new_stock, mock_requests_get_failure):
+@freeze_time('2020-07-28')
+def test_get_weekly_stock_data_from_price_history(new_stock, clear_price_history, monkeypatch):
+    """
+    GIVEN a Flask application configured for testing and a monkeypatched version of requests.Session.get()
+    WHEN the weekly stock data is requested twice within the same week
+    THEN check that Alpha Vantage is only called once and the stored prices are returned
+    """
+    requested_urls = []
+
+    def mock_get(session, url, **kwargs):
+        requested_urls.append(url)
+        return MockSuccessResponseWeekly(url)
+
+    monkeypatch.setattr(requests.Session, 'get', mock_get)
+    new_stock.get_weekly_stock_data()
+    title, series = new_stock.get_weekly_stock_data()
+    assert len(requested_urls) == 1
+    assert title == 'Weekly Prices (AAPL)'
+    assert series.dates() == [datetime(2020, 6, 11).date(),
+                              datetime(2020, 7, 17).date(),
+                              datetime(2020, 7, 24).date()]
+    assert series.values() == [354.34, 362.76, 379.24]
+
+
+@freeze_time('2020-07-28')
+def test_get_weekly_stock_data_before_first_week(new_stock, clear_price_history, monkeypatch):
+    """
+    GIVEN a Flask application configured for testing and a stock purchased before the first week
+          returned by the market-data provider
+    WHEN the weekly stock data is requested twice within the same week
+    THEN check that Alpha Vantage is only called once, as it has no earlier weeks
+    """
+    requested_urls = []
+
+    def mock_get(session, url, **kwargs):
+        requested_urls.append(url)
+        return MockSuccessResponseWeekly(url)
+
+    monkeypatch.setattr(requests.Session, 'get', mock_get)
+    new_stock.purchase_date = datetime(2019, 6, 3)
+    new_stock.get_weekly_stock_data()
+    title, series = new_stock.get_weekly_stock_data()
+    assert len(requested_urls) == 1
+    assert series.dates()[0] == datetime(2020, 2, 25).date()
+    assert database.session.get(Quote, 'AAPL').price_history_since == datetime(2019, 6, 3).date()
+
+def test_get_weekly_stock_data_failure(new_stock, clear_price_history, mock_requests_get_failure):
     """
     GIVEN a Flask application configured for testing and a monkeypatched version of requests.get()
     WHEN the HTTP response is set to failed
     THEN check the HTTP response
     """
-    title, labels, values = new_stock.get_weekly_stock_data()
+    title, series = new_stock.get_weekly_stock_data()
     assert title == 'Stock chart is unavailable.'
-    assert len(labels) == 0
-    assert len(values) == 0
+    assert len(series) == 0
+
+
+
+
+def test_get_current_stock_price_circuit_open(new_stock, monkeypatch):
+    """
+    GIVEN a Flask application with a circuit breaker and Alpha Vantage timing out
+    WHEN the current price of a stock with a stored (stale) quote is requested repeatedly
+    THEN check that the stored quote is returned without calling Alpha Vantage once the circuit is open
+    """
+    requested_urls = []
+
+    def mock_get(session, url, **kwargs):
+        requested_urls.append(url)
+        raise requests.exceptions.Timeout()
+
+    monkeypatch.setattr(requests.Session, 'get', mock_get)
+    gateway = ProviderGateway(current_app.extensions['market_data_client'], failure_threshold=2)
+    current_app.extensions['market_data_provider'].gateway = gateway
+    database.session.execute(database.delete(Quote))
+    quote = Quote('AAPL')
+    quote.price = 14512
+    quote.updated_on = datetime(2020, 7, 18)
+    database.session.add(quote)
+
+    assert get_current_stock_price('AAPL') == 0.0
+    assert get_current_stock_price('AAPL') == 0.0
+    assert get_current_stock_price('AAPL') == 145.12
+    assert get_current_stock_price('MSFT') == 0.0
+    assert len(requested_urls) == 2
+    database.session.rollback()
+
+
+def test_store_quote_concurrent_workers(new_stock):
+    """
+    GIVEN a Flask application and two workers (sessions) that both found no stored quote for a symbol
+    WHEN both workers store the quote of the symbol
+    THEN check that the second worker updates the quote stored by the first one instead of failing
+    """
+    database.session.execute(database.delete(Quote).where(Quote.stock_symbol == 'SAM'))
+    database.session.commit()
+    with current_app.app_context():
+        assert database.session.get(Quote, 'SAM') is None
+        with current_app.app_context():
+            assert database.session.get(Quote, 'SAM') is None
+            store_quote('SAM', 148.34)
+            database.session.commit()
+
+        store_quote('SAM', 149.01)
+        database.session.commit()
+
+    quote = database.session.get(Quote, 'SAM')
+    assert quote.price == 14901
+    database.session.delete(quote)
+    database.session.commit()
+
+
+def test_account_totals(new_stock):
+    """
+    GIVEN a Flask application and two positions of a user
+    WHEN the current prices of the stocks are written back to the database
+    THEN check that the materialized account totals and the totals by symbol are updated
+    """
+    database.session.execute(database.delete(AccountTotal))
+    database.session.execute(database.delete(Stock).where(Stock.user_id == 17))
+    database.session.add(new_stock)
+    database.session.add(Stock('AAPL', '4', '100.00', 17, datetime(2021, 1, 4)))
+    database.session.add(Stock('MSFT', '10', '200.00', 17, datetime(2021, 1, 4)))
+
+    account_total = get_account_total(17)
+    assert account_total.total_value == 0
+    assert account_total.total_cost == 16 * 40678 + 4 * 10000 + 10 * 20000
+    assert account_total.number_of_positions == 3
+
+    write_back_stock_prices({'AAPL': 148.34, 'MSFT': 295.37})
+    database.session.expire_all()
+    account_total = get_account_total(17)
+    assert account_total.total_value == 20 * 14834 + 10 * 29537
+    assert get_position_values_by_symbol(17) == [('AAPL', 20, 20 * 14834), ('MSFT', 10, 10 * 29537)]
+    database.session.rollback()
+
+
+def test_refresh_account_totals_upsert(new_stock):
+    """
+    GIVEN a Flask application and the materialized totals of a user
+    WHEN the totals are refreshed after a position is added, and after every position is deleted
+    THEN check that the stored totals are updated in place, and removed once the user has no positions
+    """
+    database.session.execute(database.delete(Stock).where(Stock.user_id == 17))
+    database.session.execute(database.delete(AccountTotal).where(AccountTotal.user_id == 17))
+    database.session.add(new_stock)
+    refresh_account_totals([17])
+    assert get_account_total(17).number_of_positions == 1
+
+    database.session.add(Stock('MSFT', '10', '200.00', 17, datetime(2021, 1, 4)))
+    refresh_account_totals([17])
+    database.session.expire_all()
+    assert get_account_total(17).number_of_positions == 2
+
+    database.session.execute(database.delete(Stock).where(Stock.user_id == 17))
+    refresh_account_totals([17])
+    database.session.expire_all()
+    assert database.session.get(AccountTotal, 17) is None
+    database.session.rollback()
+
+
+def test_write_back_stock_prices_only_changed(new_stock):
+    """
+    GIVEN a Flask application and positions of a user priced today
+    WHEN the current prices of the stocks are written back to the database
+    THEN check that only the positions whose price changed are written
+    """
+    database.session.execute(database.delete(Stock).where(Stock.user_id == 17))
+    database.session.add(new_stock)
+    database.session.add(Stock('MSFT', '10', '200.00', 17, datetime(2021, 1, 4)))
+
+    assert write_back_stock_prices({'AAPL': 148.34, 'MSFT': 295.37, 'SAM': 0.0}) == [17]
+    assert write_back_stock_prices({'AAPL': 148.34, 'MSFT': 295.37}) == []
+    assert write_back_stock_prices({'AAPL': 148.34, 'MSFT': 301.12}, batch_size=1) == [17]
+    database.session.expire_all()
+    assert get_position_values_by_symbol(17) == [('AAPL', 16, 16 * 14834), ('MSFT', 10, 10 * 30112)]
+    database.session.rollback()
+
+
+def test_write_back_stock_prices_user(new_stock):
+    """
+    GIVEN a Flask application and positions of two users on the same stock
+    WHEN the current price of the stock is written back for one user
+    THEN check that only the positions and the totals of this user are written
+    """
+    database.session.execute(database.delete(Stock).where(Stock.user_id.in_([17, 18])))
+    database.session.add(new_stock)
+    database.session.add(Stock('AAPL', '10', '200.00', 18, datetime(2021, 1, 4)))
+
+    assert write_back_stock_prices({'AAPL': 148.34}, user_id=17) == [17]
+    database.session.expire_all()
+    assert get_position_values_by_symbol(17) == [('AAPL', 16, 16 * 14834)]
+    assert get_position_values_by_symbol(18) == [('AAPL', 10, 0)]
+    assert write_back_stock_prices({'AAPL': 148.34}) == [18]
+    database.session.rollback()
+
+
+def test_flush_stock_views(new_stock):
+    """
+    GIVEN a Flask application and quotes of two stocks
+    WHEN views of the stocks are recorded and flushed
+    THEN check that the views are only written to the `quotes` table when flushed
+    """
+    database.session.execute(database.delete(Quote).where(Quote.stock_symbol.in_(['AAPL', 'MSFT'])))
+    database.session.add(Quote('AAPL'))
+    database.session.add(Quote('MSFT'))
+    flush_stock_views()
 
+    record_stock_views(['AAPL', 'MSFT'])
+    record_stock_views(['AAPL'])
+    assert not flush_stock_views(max_age=60)
+    assert database.session.get(Quote, 'AAPL').view_count == 0
 
+    assert flush_stock_views(max_age=0)
+    database.session.expire_all()
+    assert database.session.get(Quote, 'AAPL').view_count == 2
+    assert database.session.get(Quote, 'MSFT').view_count == 1
+    assert database.session.get(Quote, 'MSFT').last_viewed_on is not None
+    assert not flush_stock_views()
+    database.session.rollback()
@@ -0,0 +1,52 @@
+"""
+This file (test_price_stream.py) contains the unit tests for the price_stream.py file.
+"""
+import time
+
+from project.price_stream import PriceStreamHub
+
+
+def test_price_stream_fan_out():
+    """
+    GIVEN a price stream hub
+    WHEN several subscriptions watch the same symbol
+    THEN check that the symbol is polled by a single poller and each subscription gets the price
+    """
+    calls = []
+
+    def fetch_price(symbol):
+        calls.append(symbol)
+        return 148.34
+
+    hub = PriceStreamHub(fetch_price, interval=60)
+    subscriptions = [hub.subscribe(['AAPL']) for _ in range(100)]
+    for subscription in subscriptions:
+        assert subscription.get(timeout=5) == ('AAPL', 148.34)
+    assert calls == ['AAPL']
+    assert hub.subscriber_count('AAPL') == 100
+    hub.close()
+
+
+def test_price_stream_stops_polling():
+    """
+    GIVEN a price stream hub polling a symbol for one subscription
+    WHEN the subscription is closed
+    THEN check that the symbol is not polled anymore
+    """
+    calls = []
+
+    def fetch_price(symbol):
+        calls.append(symbol)
+        return 148.34 + len(calls)
+
+    hub = PriceStreamHub(fetch_price, interval=0.01)
+    subscription = hub.subscribe(['AAPL'])
+    assert subscription.get(timeout=5) == ('AAPL', 149.34)
+    assert subscription.get(timeout=5) == ('AAPL', 150.34)
+
+    subscription.close()
+    assert hub.subscriber_count('AAPL') == 0
+    time.sleep(0.05)
+    number_of_calls = len(calls)
+    time.sleep(0.05)
+    assert len(calls) == number_of_calls
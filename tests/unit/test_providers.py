@@ -0,0 +1,155 @@
+"""
+This file (test_providers.py) contains the unit tests for the providers.py file.
+"""
+from datetime import date
+
+import pytest
+import requests
+from flask import current_app
+from freezegun import freeze_time
+
+from project.gateway import CircuitBreaker, CircuitOpen, ProviderGateway, RateLimitExceeded
+from project.models import get_current_stock_price
+from project.providers import (AlphaVantageProvider, Cassette, FakeClient, FakeProvider, RecordingProvider,
+                               ReplayProvider, create_market_data_client, create_market_data_provider)
+from tests.conftest import MockApiRateLimitExceededResponse
+
+
+def test_create_market_data_provider():
+    """
+    GIVEN the configuration of the market-data provider
+    WHEN the provider is created
+    THEN check that the configured provider is returned
+    """
+    config = {'MARKET_DATA_PROVIDER': 'FAKE',
+              'MARKET_DATA_FAKE_LATENCY': 0.0,
+              'MARKET_DATA_FAKE_ERROR_RATE': 0.0,
+              'MARKET_DATA_FAKE_SEED': 0,
+              'MARKET_DATA_BULK_QUOTES': False}
+    assert isinstance(create_market_data_provider(config, None), FakeProvider)
+    assert isinstance(create_market_data_client(config), FakeClient)
+
+    config['MARKET_DATA_PROVIDER'] = 'ALPHA_VANTAGE'
+    assert isinstance(create_market_data_provider(config, None), AlphaVantageProvider)
+
+    config['MARKET_DATA_PROVIDER'] = 'UNKNOWN'
+    with pytest.raises(ValueError):
+        create_market_data_provider(config, None)
+
+
+@freeze_time('2020-07-28')
+def test_fake_provider_is_deterministic(new_stock):
+    """
+    GIVEN two fake providers
+    WHEN the same quotes and weekly prices are requested from each provider
+    THEN check that the same data is returned
+    """
+    provider1 = FakeProvider(ProviderGateway(FakeClient()))
+    provider2 = FakeProvider(ProviderGateway(FakeClient()))
+    assert provider1.get_quote('AAPL') == provider2.get_quote('AAPL')
+    assert provider1.get_quote('AAPL') != provider1.get_quote('MSFT')
+    assert provider1.get_quotes(['AAPL', 'MSFT']) == provider2.get_quotes(['AAPL', 'MSFT'])
+    assert provider1.get_quotes(['AAPL', 'MSFT'])['AAPL'] == provider1.get_quote('AAPL')
+
+    weekly_prices = provider1.get_weekly_prices('AAPL')
+    assert weekly_prices == provider2.get_weekly_prices('AAPL')
+    assert len(weekly_prices) == 1040
+    assert weekly_prices[0]['date'] == date(2020, 7, 24)
+    assert weekly_prices[1]['date'] == date(2020, 7, 17)
+    assert weekly_prices[0]['close_price'] == round(provider1.get_quote('AAPL') * 100)
+    assert len(provider1.get_weekly_prices('AAPL', stop_before=date(2020, 7, 10))) == 3
+
+
+def test_fake_provider_error_injection(new_stock):
+    """
+    GIVEN a fake provider where every call fails, behind a gateway with a circuit breaker
+    WHEN quotes and weekly prices are requested
+    THEN check that the data is reported as unavailable until the circuit breaker opens
+    """
+    gateway = ProviderGateway(FakeClient(error_rate=1.0), failure_threshold=3)
+    provider = FakeProvider(gateway)
+    assert provider.get_quote('AAPL') == 0.0
+    assert provider.get_quotes(['AAPL']) == {}
+    assert provider.get_weekly_prices('AAPL') is None
+    assert gateway.circuit_breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpen):
+        provider.get_quote('AAPL')
+
+
+def test_fake_provider_call_budget(new_stock):
+    """
+    GIVEN a fake provider behind a gateway with a budget of one call
+    WHEN two quotes are requested
+    THEN check that the second call is refused by the call budget
+    """
+    provider = FakeProvider(ProviderGateway(FakeClient(), calls_per_minute=1, burst=1))
+    assert provider.get_quote('AAPL') > 0.0
+    with pytest.raises(RateLimitExceeded):
+        provider.get_quote('MSFT')
+
+
+def test_record_and_replay_cassette(new_stock, mock_requests_get_success_quote, tmp_path, monkeypatch):
+    """
+    GIVEN a recording provider and a monkeypatched version of requests.Session.get()
+    WHEN a quote is recorded to a cassette and then replayed
+    THEN check that the replayed quote matches without any network call
+    """
+    cassette_path = str(tmp_path / 'cassette.json.gz')
+    gateway = current_app.extensions['market_data_gateway']
+    recorder = RecordingProvider(gateway, Cassette(cassette_path))
+    assert recorder.get_quote('AAPL') == 148.34
+    recorder.cassette.save()
+
+    def mock_get(session, url, **kwargs):
+        raise AssertionError('The replay provider should not make any network call!')
+
+    monkeypatch.setattr(requests.Session, 'get', mock_get)
+    player = ReplayProvider(Cassette(cassette_path))
+    assert player.get_quote('AAPL') == 148.34
+    assert player.get_quote('MSFT') == 0.0
+    assert player.get_weekly_prices('AAPL') is None
+
+
+def test_record_mode_saves_cassette(new_stock, mock_requests_get_success_quote, tmp_path, monkeypatch):
+    """
+    GIVEN a Flask application running with the 'RECORD' market-data provider
+    WHEN a quote is retrieved through the app and then replayed from the cassette file
+    THEN check that the response was saved to disk without calling `Cassette.save()`
+    """
+    cassette_path = str(tmp_path / 'cassette.json.gz')
+    config = dict(current_app.config, MARKET_DATA_PROVIDER='RECORD', MARKET_DATA_CASSETTE=cassette_path)
+    recorder = create_market_data_provider(config, current_app.extensions['market_data_gateway'])
+    monkeypatch.setitem(current_app.extensions, 'market_data_provider', recorder)
+    assert get_current_stock_price('AAPL') == 148.34
+
+    def mock_get(session, url, **kwargs):
+        raise AssertionError('The replay provider should not make any network call!')
+
+    monkeypatch.setattr(requests.Session, 'get', mock_get)
+    config['MARKET_DATA_PROVIDER'] = 'REPLAY'
+    player = create_market_data_provider(config, None)
+    assert isinstance(player, ReplayProvider)
+    assert player.get_quote('AAPL') == 148.34
+
+
+def test_replay_rate_limit_message(new_stock, tmp_path, monkeypatch):
+    """
+    GIVEN a cassette with the rate limit messages recorded for a quote, bulk quotes and weekly prices
+    WHEN the responses are replayed
+    THEN check that the first rate limit message of a call is recorded, and that the replayed
+         data is reported as unavailable
+    """
+    monkeypatch.setattr(requests.Session, 'get', lambda session, url, **kwargs: MockApiRateLimitExceededResponse(url))
+    cassette = Cassette(str(tmp_path / 'cassette.json.gz'))
+    recorder = RecordingProvider(current_app.extensions['market_data_gateway'], cassette)
+    assert recorder.get_quote('AAPL') == 0.0
+    assert 'Note' in cassette.get('GLOBAL_QUOTE', 'AAPL')
+
+    note = {'Note': 'Thank you for using Alpha Vantage! Our standard API call frequency is 5 calls per minute.'}
+    cassette.record('REALTIME_BULK_QUOTES', 'AAPL,MSFT', note)
+    cassette.record('TIME_SERIES_WEEKLY_ADJUSTED', 'AAPL', {'Information': note['Note']})
+
+    player = ReplayProvider(cassette)
+    assert player.get_quote('AAPL') == 0.0
+    assert player.get_quotes(['AAPL', 'MSFT']) == {}
+    assert player.get_weekly_prices('AAPL') is None
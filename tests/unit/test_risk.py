@@ -0,0 +1,93 @@
+"""
+This file (test_risk.py) contains the unit tests for the risk.py file.
+"""
+import math
+import time
+
+import numpy as np
+
+from project.analytics import WEEKS_PER_YEAR
+from project.risk import PortfolioRisk, compute_covariance_matrix
+
+
+def test_compute_covariance_matrix():
+    """
+    GIVEN weekly closing prices of three symbols
+    WHEN the covariance matrix is computed
+    THEN check that it is the annualized covariance and correlation of the weekly returns
+    """
+    rng = np.random.default_rng(5)
+    closes = 100.0 * np.cumprod(1.0 + rng.normal(0.002, 0.03, size=(60, 3)), axis=0)
+    matrix = compute_covariance_matrix(['AAPL', 'MSFT', 'SAM'], closes)
+
+    returns = closes[1:] / closes[:-1] - 1.0
+    assert matrix.symbols == ['AAPL', 'MSFT', 'SAM']
+    assert matrix.number_of_weeks == 59
+    assert np.allclose(matrix.covariance, np.cov(returns, rowvar=False) * WEEKS_PER_YEAR)
+    assert np.allclose(matrix.correlation, np.corrcoef(returns, rowvar=False))
+
+
+def test_compute_covariance_matrix_missing_weeks():
+    """
+    GIVEN weekly closing prices where the second symbol has a shorter history and the third one a single week
+    WHEN the covariance matrix is computed
+    THEN check that each covariance only uses the weeks when both symbols are known
+         (centered on the mean return of each symbol over all its weeks)
+    """
+    closes = np.array([[10.0, np.nan, np.nan],
+                       [11.0, np.nan, np.nan],
+                       [12.1, 20.0, np.nan],
+                       [11.0, 22.0, np.nan],
+                       [12.0, 21.0, np.nan],
+                       [12.5, 23.0, 5.0]])
+    matrix = compute_covariance_matrix(['AAPL', 'MSFT', 'SAM'], closes)
+
+    returns = closes[1:] / closes[:-1] - 1.0
+    assert math.isclose(matrix.covariance[0, 0], np.var(returns[:, 0], ddof=1) * WEEKS_PER_YEAR)
+    deviations = (returns[2:, 0] - returns[:, 0].mean()) * (returns[2:, 1] - returns[2:, 1].mean())
+    assert math.isclose(matrix.covariance[0, 1], deviations.sum() / 2 * WEEKS_PER_YEAR)
+    assert math.isclose(matrix.correlation[1, 1], 1.0)
+    assert np.isnan(matrix.covariance[2]).all()
+    assert np.isnan(matrix.correlation[2, 2])
+
+
+def test_portfolio_risk():
+    """
+    GIVEN a covariance matrix of two uncorrelated symbols and the weight of each symbol
+    WHEN the risk of the portfolio is computed
+    THEN check the portfolio variance and the risk contribution of each symbol
+    """
+    closes = np.array([[10.0, 10.0],
+                       [11.0, 10.0],
+                       [10.0, 11.0],
+                       [11.0, 11.0],
+                       [10.0, 10.0]])
+    matrix = compute_covariance_matrix(['AAPL', 'SAM'], closes)
+    risk = PortfolioRisk(matrix, np.array([0.75, 0.25]))
+
+    weights = np.array([0.75, 0.25])
+    assert math.isclose(risk.variance, weights @ matrix.covariance @ weights)
+    assert math.isclose(risk.volatility, math.sqrt(risk.variance))
+    assert math.isclose(risk.risk_contributions.sum(), 1.0)
+    assert risk.risk_contributions[0] > risk.risk_contributions[1]
+    assert risk.to_dict()['symbols'] == ['AAPL', 'SAM']
+
+
+def test_portfolio_risk_200_symbols():
+    """
+    GIVEN three years of weekly closing prices of 200 symbols, with some missing weeks
+    WHEN the covariance matrix and the risk of the portfolio are computed
+    THEN check that it takes well under a second
+    """
+    rng = np.random.default_rng(7)
+    closes = 100.0 * np.cumprod(1.0 + rng.normal(0.001, 0.04, size=(157, 200)), axis=0)
+    closes[:50, ::10] = np.nan
+
+    start = time.perf_counter()
+    matrix = compute_covariance_matrix([f'S{index:03d}' for index in range(200)], closes)
+    risk = PortfolioRisk(matrix, np.full(200, 1 / 200))
+    elapsed = time.perf_counter() - start
+
+    assert matrix.covariance.shape == (200, 200)
+    assert math.isclose(risk.risk_contributions.sum(), 1.0)
+    assert elapsed < 0.5
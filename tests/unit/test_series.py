@@ -0,0 +1,57 @@
+"""
+This file (test_series.py) contains the unit tests for the series.py file.
+"""
+import json
+from datetime import date
+
+from project.series import PriceSeries
+
+
+def test_price_series_from_rows():
+    """
+    GIVEN rows of dates and prices in cents
+    WHEN a price series is created from the rows
+    THEN check that the dates and values are stored compactly and returned correctly
+    """
+    series = PriceSeries.from_rows([(date(2020, 7, 17), 36276), (date(2020, 7, 24), 37924)])
+    assert len(series) == 2
+    assert series.days.typecode == 'l'
+    assert list(series.days) == [18460, 18467]
+    assert list(series.prices) == [36276, 37924]
+    assert series.dates() == [date(2020, 7, 17), date(2020, 7, 24)]
+    assert series.values() == [362.76, 379.24]
+
+
+def test_price_series_to_chartjs_json():
+    """
+    GIVEN a price series
+    WHEN the series is serialized for Chart.js
+    THEN check that the labels and values are valid JSON
+    """
+    series = PriceSeries.from_rows([(date(2020, 6, 11), 35434), (date(2020, 7, 24), 37905)])
+    assert json.loads(series.to_chartjs_json()) == {'labels': ['06/11/2020', '07/24/2020'],
+                                                    'values': [354.34, 379.05]}
+    assert json.loads(PriceSeries().to_chartjs_json()) == {'labels': [], 'values': []}
+
+
+def test_price_series_to_chartjs_json_negative_values():
+    """
+    GIVEN a price series with negative values (such as a change of value)
+    WHEN the series is serialized for Chart.js
+    THEN check that the negative values keep their cents
+    """
+    series = PriceSeries.from_rows([(date(2020, 6, 11), -150), (date(2020, 6, 18), -5), (date(2020, 6, 25), -100)])
+    assert json.loads(series.to_chartjs_json())['values'] == [-1.50, -0.05, -1.00]
+
+
+def test_price_series_until():
+    """
+    GIVEN a price series
+    WHEN the series is sliced until a date
+    THEN check that only the points until that date (included) are kept
+    """
+    series = PriceSeries.from_rows([(date(2020, 7, 10), 100), (date(2020, 7, 17), 200), (date(2020, 7, 24), 300)])
+    assert series.until(date(2020, 7, 17)).values() == [1.00, 2.00]
+    assert series.until(date(2020, 7, 23)).values() == [1.00, 2.00]
+    assert len(series.until(date(2020, 7, 1))) == 0
+    assert len(series.until(date(2020, 8, 1))) == 3
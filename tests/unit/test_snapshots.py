@@ -0,0 +1,37 @@
+"""
+This file (test_snapshots.py) contains the unit tests for the snapshots.py file.
+"""
+from datetime import date
+
+from project.series import PriceSeries
+from project.snapshots import get_uncovered_end_date, merge_snapshot_series
+
+
+def test_merge_snapshot_series():
+    """
+    GIVEN weekly values computed from the price history and daily snapshots
+    WHEN the series are merged
+    THEN check that the snapshots are used on their days and the weekly values on the other days
+    """
+    series = PriceSeries.from_rows([(date(2024, 1, 5), 1000), (date(2024, 1, 12), 1100), (date(2024, 1, 19), 1200)])
+    snapshots = PriceSeries.from_rows([(date(2024, 1, 10), 1050), (date(2024, 1, 12), 1125)])
+
+    merged = merge_snapshot_series(series, snapshots)
+    assert merged.dates() == [date(2024, 1, 5), date(2024, 1, 10), date(2024, 1, 12), date(2024, 1, 19)]
+    assert list(merged.prices) == [1000, 1050, 1125, 1200]
+    assert merge_snapshot_series(series, PriceSeries()) is series
+
+
+def test_get_uncovered_end_date():
+    """
+    GIVEN daily snapshots of a portfolio
+    WHEN the last date of a week not covered by the snapshots is requested
+    THEN check that it is the day before the snapshots that follow the latest gap of more than a week
+    """
+    snapshots = PriceSeries.from_rows([(date(2024, 1, 2), 1000), (date(2024, 1, 3), 1000), (date(2024, 1, 10), 1000),
+                                       (date(2024, 1, 20), 1000), (date(2024, 1, 21), 1000)])
+    assert get_uncovered_end_date(snapshots, date(2024, 1, 22)) == date(2024, 1, 19)
+    assert get_uncovered_end_date(snapshots, date(2024, 1, 28)) is None
+
+    snapshots = PriceSeries.from_rows([(date(2024, 1, 2), 1000), (date(2024, 1, 9), 1000)])
+    assert get_uncovered_end_date(snapshots, date(2024, 1, 10)) == date(2024, 1, 1)
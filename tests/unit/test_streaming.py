@@ -0,0 +1,64 @@
+"""
+This file (test_streaming.py) contains the unit tests for the streaming.py file.
+"""
+import json
+
+from project.streaming import parse_time_series
+
+WEEKLY_DATA = {
+    'Meta Data': {'2. Symbol': 'AAPL', '3. Last Refreshed': '2020-07-28'},
+    'Weekly Adjusted Time Series': {
+        '2020-07-24': {'4. close': '379.2400'},
+        '2020-07-17': {'4. close': '362.7600'},
+        '2020-06-11': {'4. close': '354.3400'},
+        '2020-02-25': {'4. close': '432.9800'}
+    }
+}
+
+
+def split_into_chunks(document, chunk_size):
+    content = json.dumps(document).encode('utf-8')
+    return [content[index:index + chunk_size] for index in range(0, len(content), chunk_size)]
+
+
+def test_parse_time_series_complete():
+    """
+    GIVEN a weekly time series split into small chunks
+    WHEN the time series is parsed without a stop date
+    THEN check that every week is returned in order along with the header
+    """
+    header, weeks = parse_time_series(split_into_chunks(WEEKLY_DATA, 7), 'Weekly Adjusted Time Series')
+    assert header == {'Meta Data': {'2. Symbol': 'AAPL', '3. Last Refreshed': '2020-07-28'}}
+    assert [week for week, _ in weeks] == ['2020-07-24', '2020-07-17', '2020-06-11', '2020-02-25']
+    assert weeks[2][1] == {'4. close': '354.3400'}
+
+
+def test_parse_time_series_stops_early():
+    """
+    GIVEN a weekly time series split into chunks
+    WHEN the time series is parsed with a stop date
+    THEN check that the parsing stops at the first week on or before the stop date without reading further
+    """
+    chunks = split_into_chunks(WEEKLY_DATA, 16)
+    read_chunks = []
+
+    def iter_chunks():
+        for chunk in chunks:
+            read_chunks.append(chunk)
+            yield chunk
+
+    header, weeks = parse_time_series(iter_chunks(), 'Weekly Adjusted Time Series', '2020-07-01')
+    assert [week for week, _ in weeks] == ['2020-07-24', '2020-07-17', '2020-06-11']
+    assert len(read_chunks) < len(chunks)
+
+
+def test_parse_time_series_missing():
+    """
+    GIVEN a response from Alpha Vantage when the API rate limit has been exceeded
+    WHEN the time series is parsed
+    THEN check that no time series is returned and the header contains the message
+    """
+    document = {'Note': 'Thank you for using Alpha Vantage! Our standard API call frequency is 5 calls per minute.'}
+    header, weeks = parse_time_series(split_into_chunks(document, 10), 'Weekly Adjusted Time Series')
+    assert weeks is None
+    assert 'Note' in header
@@ -0,0 +1,46 @@
+"""
+This file (test_valuation.py) contains the unit tests for the valuation.py file.
+"""
+import numpy as np
+
+from project.valuation import Positions, value_positions
+
+
+def test_value_positions():
+    """
+    GIVEN positions of two users in three lots of two symbols
+    WHEN the positions are valued with a price vector missing one of the symbols
+    THEN check the values, gains, weights and totals of the positions
+    """
+    positions = Positions.from_rows([(1, 1, 'AAPL', 10, 10000, 14000),
+                                     (2, 1, 'MSFT', 5, 20000, 25000),
+                                     (3, 2, 'AAPL', 20, 15000, 14000)])
+    assert list(positions.symbols) == ['AAPL', 'MSFT']
+    assert list(positions.symbol_ids) == [0, 1, 0]
+
+    valuation = value_positions(positions, {'AAPL': 15000})
+    assert list(valuation.position_values) == [150000, 125000, 300000]
+    assert list(valuation.gains) == [50000, 25000, 0]
+    assert list(valuation.gain_percentages) == [50.0, 25.0, 0.0]
+    assert np.isclose(valuation.weights.sum(), 1.0)
+    assert valuation.total_value == 575000
+    assert valuation.total_cost == 500000
+    assert valuation.total_gain == 75000
+    assert valuation.totals_by_user() == {1: 275000, 2: 300000}
+    weights = valuation.weights_by_symbol()
+    assert list(weights) == ['AAPL', 'MSFT']
+    assert np.isclose(weights['AAPL'], 450000 / 575000)
+
+
+def test_value_positions_empty():
+    """
+    GIVEN no positions
+    WHEN the positions are valued
+    THEN check that the totals are zero
+    """
+    valuation = value_positions(Positions.from_rows([]))
+    assert valuation.total_value == 0
+    assert valuation.total_gain == 0
+    assert len(valuation.weights) == 0
+    assert valuation.totals_by_user() == {}
+    assert valuation.weights_by_symbol() == {}